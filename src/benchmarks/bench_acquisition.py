@@ -0,0 +1,215 @@
+"""
+スクリプト名: bench_acquisition.py
+
+目的:
+ローカルのモックサーバー（mock_marketplace.py）に向けて取得処理を実行し、
+シナリオごとの取得件数/秒と、サーバー側で計測した応答時間の p50 / p95 / p99、
+ステータスコード別の件数（429・500 を含む）をレポートに出力する。
+本番の楽天・Yahoo! API に負荷をかけずに、並列数・レート制限の設定を比べるために使う。
+
+シナリオ:
+- rakuten_ranking: fetch_rakuten.fetch_rakuten_stock（ジャンル × ページの並列取得）
+- yahoo_ranking  : fetch_yahoo.iter_yahoo_stock（ランキング + itemSearch での在庫確認）
+- rakuten_item   : fetch_rakuten_from_mstItem.fetch_item_from_rakuten を --items 件
+- yahoo_item     : fetch_yahoo_shopping_from_mstItem.fetch_item_from_yahoo を --items 件
+
+取得処理は API の URL・並列数・レートを import 時に環境変数から読むため、
+モックサーバーを起動して環境変数を設定してから import する。
+
+使い方:
+python src/benchmarks/bench_acquisition.py --latency-ms 50 --workers 8 --client-rate 0
+python src/benchmarks/bench_acquisition.py --rate-limit 10 --error-rate 0.02 --scenarios rakuten_ranking,yahoo_ranking
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))
+for sub in ("common", "data_acquisition", "prediction"):
+    sys.path.append(os.path.join(SRC_DIR, sub))
+
+from mock_marketplace import MockMarketplace, rakuten_ranking_codes, yahoo_ranking_item
+
+DEFAULT_RESULTS_DIR = os.path.join(BASE_DIR, "bench_results")
+SCENARIOS = ["rakuten_ranking", "yahoo_ranking", "rakuten_item", "yahoo_item"]
+
+
+def configure_env(mock, args):
+    """取得処理の import 前に、向き先と並列数・レートを環境変数で渡す"""
+    os.environ.update(mock.env())
+    os.environ["RAKUTEN_RANKING_GENRES"] = args.genres
+    os.environ["RAKUTEN_RANKING_PAGES"] = str(args.pages)
+    os.environ["RAKUTEN_RANKING_WORKERS"] = str(args.workers)
+    os.environ["RAKUTEN_API_RATE"] = str(args.client_rate)
+    os.environ["YAHOO_ITEM_SEARCH_WORKERS"] = str(args.workers)
+    os.environ["YAHOO_ITEM_SEARCH_RATE"] = str(args.client_rate)
+
+
+def run_lookups(fetch, targets, workers, client_rate):
+    """fetch(*target) を workers 並列・全体で client_rate 件/秒に制限して実行し、取得できた件数を返す"""
+    from rate_limiter import RateLimiter
+
+    limiter = RateLimiter(client_rate)
+
+    def lookup(target):
+        limiter.acquire()
+        return fetch(*target)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(1 for result in executor.map(lookup, targets) if result)
+
+
+def scenario_rakuten_ranking(args, seed):
+    import fetch_rakuten
+
+    return len(fetch_rakuten.fetch_rakuten_stock() or [])
+
+
+def scenario_yahoo_ranking(args, seed):
+    import fetch_yahoo
+
+    return sum(1 for _ in fetch_yahoo.iter_yahoo_stock())
+
+
+def scenario_rakuten_item(args, seed):
+    import fetch_rakuten_from_mstItem
+
+    targets = []
+    page = 1
+    while len(targets) < args.items:
+        targets.extend(rakuten_ranking_codes(seed, "0", page))
+        page += 1
+    return run_lookups(fetch_rakuten_from_mstItem.fetch_item_from_rakuten, targets[:args.items], args.workers, args.client_rate)
+
+
+def scenario_yahoo_item(args, seed):
+    import fetch_yahoo_shopping_from_mstItem
+
+    targets = []
+    for rank in range(1, args.items + 1):
+        item = yahoo_ranking_item(seed, rank)
+        targets.append((item["seller"]["id"], item["item_information"]["code"], item["seller"]["name"]))
+    return run_lookups(fetch_yahoo_shopping_from_mstItem.fetch_item_from_yahoo, targets, args.workers, args.client_rate)
+
+
+SCENARIO_FUNCS = {
+    "rakuten_ranking": scenario_rakuten_ranking,
+    "yahoo_ranking": scenario_yahoo_ranking,
+    "rakuten_item": scenario_rakuten_item,
+    "yahoo_item": scenario_yahoo_item,
+}
+
+
+def client_latency_summary():
+    """取得処理側の timer（stock_api_request_duration_seconds）の件数と平均（エンドポイント別）"""
+    from metrics import registry
+
+    histogram = registry.metrics.get("stock_api_request_duration_seconds")
+    if histogram is None:
+        return {}
+    return {
+        entry["labels"].get("endpoint", ""): {"count": entry["count"], "avg_ms": round(entry["avg"] * 1000, 2)}
+        for entry in histogram.summary()
+    }
+
+
+def run_scenario(name, mock, args):
+    from metrics import registry
+
+    mock.stats.reset()
+    registry.reset()
+    started = time.perf_counter()
+    error = None
+    items = 0
+    # 取得処理は 1 件ごとに print するため、計測中の標準出力は捨てる
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull if not args.verbose else sys.stdout):
+        try:
+            items = SCENARIO_FUNCS[name](args, mock.seed)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": name,
+        "items": items,
+        "seconds": round(elapsed, 3),
+        "items_per_second": round(items / elapsed, 2) if elapsed > 0 else 0.0,
+        "server": mock.stats.summary(),
+        "client": client_latency_summary(),
+        "error": error,
+    }
+
+
+def print_result(result):
+    mark = "❌" if result["error"] else "✅"
+    print(f"{mark} {result['scenario']}: {result['items']}件 / {result['seconds']}秒 "
+          f"= {result['items_per_second']}件/秒")
+    for endpoint, stats in result["server"].items():
+        statuses = ", ".join(f"{status}:{count}" for status, count in stats["statuses"].items())
+        print(f"   {endpoint}: {stats['requests']}リクエスト（{statuses}） "
+              f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+    if result["error"]:
+        print(f"   エラー: {result['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モックサーバーを使った取得処理の負荷試験")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="カンマ区切りのシナリオ名")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="サーバーが 500 を返す割合")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="サーバーが受け付けるリクエスト/秒（超過分は 429、0 で無制限）")
+    parser.add_argument("--rate-burst", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=4, help="取得処理の並列数")
+    parser.add_argument("--client-rate", type=float, default=0.0, help="取得処理側のリクエスト/秒（0 で無制限）")
+    parser.add_argument("--genres", default="0,100371,551177,558885", help="楽天ランキングのジャンル（カンマ区切り）")
+    parser.add_argument("--pages", type=int, default=3, help="楽天ランキングのページ数")
+    parser.add_argument("--items", type=int, default=200, help="商品単位の取得シナリオの件数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="取得処理の標準出力を表示する")
+    parser.add_argument("--output", help="レポートの出力先（省略時は bench_results/acquisition_<日時>.json）")
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = [s for s in scenarios if s not in SCENARIO_FUNCS]
+    if unknown:
+        parser.error(f"不明なシナリオ: {', '.join(unknown)}")
+
+    with MockMarketplace(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        rate_limit=args.rate_limit, rate_burst=args.rate_burst, seed=args.seed,
+    ) as mock:
+        configure_env(mock, args)
+        print(f"🚀 モックサーバー: {mock.address}（遅延 {args.latency_ms}±{args.jitter_ms}ms, "
+              f"エラー率 {args.error_rate}, レート制限 {args.rate_limit or '無制限'}/秒）")
+        results = []
+        for name in scenarios:
+            result = run_scenario(name, mock, args)
+            print_result(result)
+            results.append(result)
+
+    report = {
+        "created_at": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": vars(args),
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        DEFAULT_RESULTS_DIR, f"acquisition_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"✅ レポートを保存しました: {output}")
+
+
+if __name__ == "__main__":
+    main()
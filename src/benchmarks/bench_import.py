@@ -0,0 +1,164 @@
+"""
+スクリプト名: bench_import.py
+
+目的:
+スケジューラなどの起動コスト（import 時間）を python -X importtime で計測する。
+各モジュールを別プロセスで複数回 import し、import 時間の合計（中央値）と
+累積時間の大きいモジュール上位 N 件を表示・保存する。
+
+変更前後の比較は、変更前のコミットを git worktree で展開して --src に指定する。
+python src/benchmarks/bench_import.py --output bench_results/import_new.json
+git worktree add /tmp/old <commit>
+python src/benchmarks/bench_import.py --src /tmp/old/src --output bench_results/import_old.json
+python src/benchmarks/bench_import.py --compare bench_results/import_old.json bench_results/import_new.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))
+DEFAULT_RESULTS_DIR = os.path.join(BASE_DIR, "bench_results")
+DEFAULT_MODULES = "fetch_scheduler,prediction_scheduler,scheduler_daemon"
+
+
+def parse_importtime(stderr):
+    """-X importtime の出力を (モジュール名, 自身の時間us, 累積時間us, 深さ) のリストにする"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line.split("|", 2)
+        try:
+            self_us = int(self_us.split(":")[-1])
+            cumulative_us = int(cumulative_us)
+        except ValueError:
+            # 見出し行（self [us] | cumulative | imported package）
+            continue
+        # 名前の前の空白（区切りの 1 文字を除く）がネストの深さを表す
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), self_us, cumulative_us, depth))
+    return entries
+
+
+def measure_module(module, src_dir, top_n):
+    """1 回分の計測。import に失敗した場合は error を返す"""
+    env = dict(os.environ)
+    # 旧実装は import 時に create_client を呼ぶため、ダミーの接続情報を渡しておく
+    env.setdefault("SUPABASE_URL", "http://localhost:54321")
+    env.setdefault("SUPABASE_KEY", "bench.bench.bench")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=src_dir, env=env, capture_output=True, text=True,
+    )
+    entries = parse_importtime(proc.stderr)
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"
+        return {"status": "error", "error": error}
+
+    top_level = [e for e in entries if e[3] == 0]
+    heaviest = sorted(entries, key=lambda e: e[2], reverse=True)[:top_n]
+    return {
+        "status": "ok",
+        "total_us": sum(e[2] for e in top_level),
+        "module_count": len(entries),
+        "top": [{"module": e[0], "cumulative_us": e[2]} for e in heaviest],
+    }
+
+
+def run_benchmarks(modules, src_dir, repeat, top_n):
+    results = []
+    for module in modules:
+        runs = [measure_module(module, src_dir, top_n) for _ in range(repeat)]
+        ok_runs = [r for r in runs if r["status"] == "ok"]
+        if not ok_runs:
+            result = {"module": module, **runs[-1]}
+        else:
+            median_us = statistics.median(r["total_us"] for r in ok_runs)
+            # 上位モジュールは中央値に最も近い回のものを使う
+            representative = min(ok_runs, key=lambda r: abs(r["total_us"] - median_us))
+            result = {
+                "module": module,
+                "status": "ok",
+                "median_ms": round(median_us / 1000, 1),
+                "min_ms": round(min(r["total_us"] for r in ok_runs) / 1000, 1),
+                "module_count": representative["module_count"],
+                "top": representative["top"],
+            }
+
+        if result["status"] == "ok":
+            print(f"{module}: {result['median_ms']}ms（{result['module_count']} モジュール）")
+            for item in result["top"]:
+                print(f"    {item['cumulative_us'] / 1000:>9.1f}ms  {item['module']}")
+        else:
+            print(f"{module}: {result['status']} {result['error']}")
+        results.append(result)
+    return results
+
+
+def _git_commit(src_dir):
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=src_dir, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare_reports(old_path, new_path):
+    """2 つのレポートの import 時間（中央値）を比較表示する"""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+
+    old_index = {r["module"]: r for r in old["results"]}
+    new_index = {r["module"]: r for r in new["results"]}
+    print(f"{'module':30} {'old ms':>10} {'new ms':>10} {'x':>6}")
+    for module in sorted(old_index.keys() & new_index.keys()):
+        o, n = old_index[module], new_index[module]
+        old_ms = o.get("median_ms") if o["status"] == "ok" else o["status"]
+        new_ms = n.get("median_ms") if n["status"] == "ok" else n["status"]
+        ratio = f"{new_ms / old_ms:>6.2f}" if isinstance(old_ms, float) and isinstance(new_ms, float) and old_ms else f"{'-':>6}"
+        print(f"{module:30} {old_ms:>10} {new_ms:>10} {ratio}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モジュールの import 時間のベンチマーク")
+    parser.add_argument("--modules", default=DEFAULT_MODULES, help="カンマ区切りのモジュール名（src からの相対）")
+    parser.add_argument("--src", default=SRC_DIR, help="計測対象の src ディレクトリ")
+    parser.add_argument("--repeat", type=int, default=5, help="1 モジュールあたりの計測回数")
+    parser.add_argument("--top", type=int, default=10, help="表示する上位モジュール数")
+    parser.add_argument("--output", help="レポートの出力先（省略時は bench_results/import_<commit>.json）")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="2 つのレポートを比較する")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+        return
+
+    src_dir = os.path.abspath(args.src)
+    modules = [m for m in args.modules.split(",") if m]
+    commit = _git_commit(src_dir)
+
+    report = {
+        "commit": commit,
+        "created_at": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": run_benchmarks(modules, src_dir, args.repeat, args.top),
+    }
+
+    output = args.output or os.path.join(DEFAULT_RESULTS_DIR, f"import_{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"✅ レポートを保存しました: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+スクリプト名: fake_supabase.py
+
+目的:
+ベンチマーク用の、supabase クライアントのインメモリ代替。
+table().select/insert/upsert/update/delete と eq/neq/in_/order/range/limit などの
+チェーン呼び出しを再現し、テーブルごと・操作ごとのリクエスト数を記録する。
+"""
+
+import copy
+import itertools
+from collections import Counter, defaultdict
+
+
+class FakeResponse:
+    """postgrest の APIResponse と同じく data / count を持つ"""
+
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+    def __iter__(self):
+        # pydantic モデルと同様に (フィールド名, 値) を返す（`"error" in response` が False になる）
+        yield "data", self.data
+        yield "count", self.count
+
+
+class FakeQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table_name = table
+        self.operation = "select"
+        self.columns = None
+        self.payload = None
+        self.on_conflict = None
+        self.filters = []
+        self.orders = []
+        self.offset = 0
+        self.limit_count = None
+
+    # --- 操作 ---
+    def select(self, columns="*", count=None):
+        self.operation = "select"
+        if columns.strip() != "*":
+            self.columns = [c.strip() for c in columns.split(",")]
+        return self
+
+    def insert(self, data, **kwargs):
+        self.operation = "insert"
+        self.payload = data
+        return self
+
+    def upsert(self, data, on_conflict=None, **kwargs):
+        self.operation = "upsert"
+        self.payload = data
+        if isinstance(on_conflict, str):
+            on_conflict = [c.strip() for c in on_conflict.split(",") if c.strip()]
+        self.on_conflict = on_conflict or None
+        return self
+
+    def update(self, data, **kwargs):
+        self.operation = "update"
+        self.payload = data
+        return self
+
+    def delete(self, **kwargs):
+        self.operation = "delete"
+        return self
+
+    # --- フィルタ ---
+    def eq(self, column, value):
+        self.filters.append(lambda r: r.get(column) == value)
+        return self
+
+    def neq(self, column, value):
+        self.filters.append(lambda r: r.get(column) != value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda r: r.get(column) in values)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda r: r.get(column) is not None and r.get(column) > value)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda r: r.get(column) is not None and r.get(column) >= value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda r: r.get(column) is not None and r.get(column) < value)
+        return self
+
+    def lte(self, column, value):
+        self.filters.append(lambda r: r.get(column) is not None and r.get(column) <= value)
+        return self
+
+    def is_(self, column, value):
+        expected = None if value in (None, "null") else value
+        self.filters.append(lambda r: r.get(column) is expected or r.get(column) == expected)
+        return self
+
+    def order(self, column, desc=False, **kwargs):
+        self.orders.append((column, desc))
+        return self
+
+    def range(self, start, end):
+        self.offset = start
+        self.limit_count = end - start + 1
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    # --- 実行 ---
+    def _matches(self, row):
+        return all(f(row) for f in self.filters)
+
+    def execute(self):
+        self.client.request_counts[(self.table_name, self.operation)] += 1
+        rows = self.client.tables[self.table_name]
+        return getattr(self, f"_execute_{self.operation}")(rows)
+
+    def _execute_select(self, rows):
+        result = [r for r in rows if self._matches(r)]
+        for column, desc in reversed(self.orders):
+            # None は末尾に並べる（PostgreSQL の昇順と同じ）
+            result.sort(key=lambda r: (r.get(column) is None, "" if r.get(column) is None else r.get(column)), reverse=desc)
+        end = None if self.limit_count is None else self.offset + self.limit_count
+        result = result[self.offset:end]
+        if self.columns:
+            result = [{c: r.get(c) for c in self.columns} for r in result]
+        else:
+            result = [dict(r) for r in result]
+        return FakeResponse(result)
+
+    def _payload_rows(self):
+        payload = self.payload if isinstance(self.payload, list) else [self.payload]
+        return [copy.copy(r) for r in payload]
+
+    def _execute_insert(self, rows):
+        inserted = []
+        for row in self._payload_rows():
+            row.setdefault("id", next(self.client.id_sequences[self.table_name]))
+            rows.append(row)
+            inserted.append(dict(row))
+        self.client.invalidate_indexes(self.table_name)
+        return FakeResponse(inserted)
+
+    def _execute_upsert(self, rows):
+        conflict = self.on_conflict or ["id"]
+        index = self.client.conflict_index(self.table_name, tuple(conflict))
+        upserted = []
+        for row in self._payload_rows():
+            key = tuple(row.get(c) for c in conflict)
+            if None not in key and key in index:
+                index[key].update(row)
+                upserted.append(dict(index[key]))
+            else:
+                row.setdefault("id", next(self.client.id_sequences[self.table_name]))
+                rows.append(row)
+                index[tuple(row.get(c) for c in conflict)] = row
+                upserted.append(dict(row))
+        self.client.invalidate_indexes(self.table_name, keep=tuple(conflict))
+        return FakeResponse(upserted)
+
+    def _execute_update(self, rows):
+        updated = []
+        for row in rows:
+            if self._matches(row):
+                row.update(self.payload)
+                updated.append(dict(row))
+        self.client.invalidate_indexes(self.table_name)
+        return FakeResponse(updated)
+
+    def _execute_delete(self, rows):
+        kept, deleted = [], []
+        for row in rows:
+            (deleted if self._matches(row) else kept).append(row)
+        rows[:] = kept
+        self.client.invalidate_indexes(self.table_name)
+        return FakeResponse([dict(r) for r in deleted])
+
+
+class FakeSupabaseClient:
+    """supabase.Client の table() インターフェースだけを持つインメモリ実装"""
+
+    def __init__(self, tables=None):
+        self.tables = defaultdict(list)
+        self.id_sequences = defaultdict(lambda: itertools.count(1))
+        self.request_counts = Counter()
+        self._conflict_indexes = {}
+        for name, rows in (tables or {}).items():
+            self.seed(name, rows)
+
+    def seed(self, table, rows):
+        """テーブルに初期データを投入する（リクエスト数には数えない）"""
+        self.tables[table].extend(dict(r) for r in rows)
+        max_id = max((r.get("id") or 0 for r in self.tables[table]), default=0)
+        self.id_sequences[table] = itertools.count(max_id + 1)
+        self.invalidate_indexes(table)
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def conflict_index(self, table, columns):
+        key = (table, columns)
+        if key not in self._conflict_indexes:
+            self._conflict_indexes[key] = {
+                tuple(r.get(c) for c in columns): r for r in self.tables[table]
+            }
+        return self._conflict_indexes[key]
+
+    def invalidate_indexes(self, table, keep=None):
+        for key in [k for k in self._conflict_indexes if k[0] == table and k[1] != keep]:
+            del self._conflict_indexes[key]
+
+    def request_summary(self):
+        """{"table.operation": 回数} 形式のリクエスト数"""
+        return {f"{t}.{op}": n for (t, op), n in sorted(self.request_counts.items())}
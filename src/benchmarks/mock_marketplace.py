@@ -0,0 +1,348 @@
+"""
+スクリプト名: mock_marketplace.py
+
+目的:
+楽天・Yahoo!ショッピングの API の代わりにローカルで応答する HTTP サーバー。
+本番の API に負荷をかけずに、取得処理（fetch_rakuten / fetch_yahoo / *_from_mstItem）の
+スループットやレート制限時の挙動を計測するために使う。
+
+応答は各取得処理が読む項目だけを、本番と同じ形で返す。
+- /rakuten/ranking : 楽天ランキング（genreId, page → {"Items": [{"Item": {...}}]}）。
+                     itemCode を指定すると、その 1 商品を同じ形で返す（fetch_item_from_rakuten 用）
+- /yahoo/ranking   : Yahoo! 高評価トレンドランキング（{"high_rating_trend_ranking": {"ranking_data": [...]}}）
+- /yahoo/itemSearch: Yahoo! itemSearch（query または jan_code → {"hits": [{...}]}）
+商品データは seed から決まるため、同じ条件なら毎回同じ応答になる。
+
+遅延・エラー・レート制限:
+- latency_ms ± jitter_ms の待ち時間を入れてから応答する
+- error_rate の割合で 500 を返す
+- rate_limit（リクエスト/秒、0 で無制限）を超えたリクエストには 429 と Retry-After を返す
+
+単体での起動:
+python src/benchmarks/mock_marketplace.py --port 8900 --latency-ms 50 --error-rate 0.01 --rate-limit 5
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../common")))
+from rate_limiter import RateLimiter
+
+MOCK_LATENCY_MS = float(os.getenv("MOCK_LATENCY_MS", "20"))
+MOCK_JITTER_MS = float(os.getenv("MOCK_JITTER_MS", "10"))
+MOCK_ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))
+MOCK_RATE_LIMIT = float(os.getenv("MOCK_RATE_LIMIT", "0"))
+MOCK_RATE_BURST = int(os.getenv("MOCK_RATE_BURST", "1"))
+
+# 楽天ランキング 1 ページの件数（本番と同じ 30 件）
+RAKUTEN_PAGE_SIZE = 30
+YAHOO_RANKING_SIZE = int(os.getenv("MOCK_YAHOO_RANKING_SIZE", "100"))
+SHOP_COUNT = 50
+IN_STOCK_RATIO = 0.8
+
+ENDPOINTS = {
+    "/rakuten/ranking": "rakuten_ranking",
+    "/yahoo/ranking": "yahoo_ranking",
+    "/yahoo/itemSearch": "yahoo_item_search",
+}
+
+
+def _stable_hash(*parts):
+    return zlib.crc32(":".join(str(p) for p in parts).encode("utf-8"))
+
+
+def _jan_code(seed, code):
+    return f"49{_stable_hash(seed, 'jan', code) % 10 ** 11:011d}"
+
+
+def _in_stock(seed, code):
+    return _stable_hash(seed, "stock", code) % 1000 < IN_STOCK_RATIO * 1000
+
+
+def _price(seed, code):
+    return 500 + _stable_hash(seed, "price", code) % 50000
+
+
+def rakuten_item(seed, shop_code, item_code, rank=None):
+    """楽天 API の Item 1 件（extract_items_data / fetch_item_from_rakuten が読む項目）"""
+    code = f"{shop_code}:{item_code}"
+    item = {
+        "itemCode": code,
+        "itemName": f"モック商品 {code}",
+        "itemCaption": f"モック商品 {code} の説明",
+        "shopCode": shop_code,
+        "shopName": f"モックショップ {shop_code}",
+        "availability": 1 if _in_stock(seed, code) else 0,
+        "itemPrice": _price(seed, code),
+        "jan": _jan_code(seed, code),
+    }
+    if rank is not None:
+        item["rank"] = rank
+    return {"Item": item}
+
+
+def rakuten_ranking_codes(seed, genre_id, page):
+    """ジャンル・ページごとの (shop_code, item_code) の一覧。ジャンルが違っても一部の商品は重複する"""
+    codes = []
+    for position in range(RAKUTEN_PAGE_SIZE):
+        rank = (page - 1) * RAKUTEN_PAGE_SIZE + position + 1
+        # 上位の商品はジャンルをまたいで共通にし、merge_ranking_items の重複除去も通るようにする
+        n = _stable_hash(seed, "rank", rank if rank <= 10 else f"{genre_id}:{rank}") % 100000
+        codes.append((f"shop{n % SHOP_COUNT:03d}", f"item{n:05d}"))
+    return codes
+
+
+def yahoo_ranking_item(seed, rank):
+    n = _stable_hash(seed, "yahoo", rank) % 100000
+    seller_id = f"yshop{n % SHOP_COUNT:03d}"
+    code = f"{seller_id}_{n:05d}"
+    return {
+        "rank": rank,
+        "item_information": {
+            "code": code,
+            "name": f"モック商品 {code}",
+            "description": f"モック商品 {code} の説明",
+            "regular_price": _price(seed, code),
+            "url": f"https://store.example.jp/{seller_id}/{n:05d}.html",
+            "jan_code": _jan_code(seed, code),
+        },
+        "seller": {"id": seller_id, "name": f"モックストア {seller_id}"},
+        "image": {"medium": f"https://item-shopping.example.jp/i/{code}_m.jpg"},
+    }
+
+
+def yahoo_hit(seed, code, jan_code=None):
+    """itemSearch の hits 1 件（fetch_stock_status / fetch_item_from_yahoo が読む項目）"""
+    seller_id = code.split("_", 1)[0]
+    return {
+        "code": code,
+        "name": f"モック商品 {code}",
+        "description": f"モック商品 {code} の説明",
+        "inStock": _in_stock(seed, code),
+        "price": _price(seed, code),
+        "janCode": jan_code or _jan_code(seed, code),
+        "seller": {"sellerId": seller_id, "name": f"モックストア {seller_id}"},
+    }
+
+
+class MockStats:
+    """エンドポイントごとの応答時間（秒）とステータスコード別の件数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latencies = {}
+            self.statuses = {}
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            by_status = self.statuses.setdefault(endpoint, {})
+            by_status[status] = by_status.get(status, 0) + 1
+
+    def summary(self):
+        with self._lock:
+            result = {}
+            for endpoint, latencies in self.latencies.items():
+                ordered = sorted(latencies)
+                result[endpoint] = {
+                    "requests": len(ordered),
+                    "statuses": dict(sorted(self.statuses[endpoint].items())),
+                    "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+                    "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+                    "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+                }
+            return result
+
+
+def percentile(ordered, q):
+    """昇順に並んだ値の q パーセンタイル（線形補間）"""
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = "MockMarketplace/1.0"
+    # requests の keep-alive をそのまま使えるようにする
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # 1 リクエストごとの標準エラー出力は計測の邪魔になるので出さない
+        pass
+
+    def do_GET(self):
+        started = time.perf_counter()
+        marketplace = self.server.marketplace
+        parsed = urlparse(self.path)
+        endpoint = ENDPOINTS.get(parsed.path)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+
+        if endpoint is None:
+            status, body, headers = 404, {"error": "not_found"}, {}
+            endpoint = "unknown"
+        elif not marketplace.limiter.try_acquire():
+            # レート制限の判定は待ち時間の前に行う（本番も超過分はすぐに断られる）
+            retry_after = max(1, round(1 / marketplace.rate_limit))
+            status, body, headers = 429, {"error": "too_many_requests"}, {"Retry-After": str(retry_after)}
+        else:
+            time.sleep(marketplace.next_delay())
+            if marketplace.should_fail():
+                status, body, headers = 500, {"error": "internal_server_error"}, {}
+            else:
+                status, body, headers = 200, marketplace.respond(endpoint, query), {}
+
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        marketplace.stats.record(endpoint, status, time.perf_counter() - started)
+
+
+class MockMarketplace:
+    """
+    別スレッドで動くモックサーバー。
+    with MockMarketplace(latency_ms=50, rate_limit=5) as mock:
+        os.environ["RAKUTEN_API_URL"] = mock.url("/rakuten/ranking")
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=None, jitter_ms=None, error_rate=None,
+                 rate_limit=None, rate_burst=None, seed=0):
+        self.latency_ms = MOCK_LATENCY_MS if latency_ms is None else latency_ms
+        self.jitter_ms = MOCK_JITTER_MS if jitter_ms is None else jitter_ms
+        self.error_rate = MOCK_ERROR_RATE if error_rate is None else error_rate
+        self.rate_limit = MOCK_RATE_LIMIT if rate_limit is None else rate_limit
+        self.limiter = RateLimiter(self.rate_limit, MOCK_RATE_BURST if rate_burst is None else rate_burst)
+        self.seed = seed
+        self.stats = MockStats()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), MockHandler)
+        self._server.daemon_threads = True
+        self._server.marketplace = self
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, path):
+        return f"{self.address}{path}"
+
+    def env(self):
+        """各取得処理の向き先をこのサーバーにするための環境変数"""
+        return {
+            "RAKUTEN_API_URL": self.url("/rakuten/ranking"),
+            "YAHOO_API_URL": self.url("/yahoo/ranking"),
+            "YAHOO_ITEM_SEARCH_API_URL": self.url("/yahoo/itemSearch"),
+            "YAHOO_API_ITEM_URL": self.url("/yahoo/itemSearch"),
+        }
+
+    def next_delay(self):
+        with self._random_lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def should_fail(self):
+        if self.error_rate <= 0:
+            return False
+        with self._random_lock:
+            return self._random.random() < self.error_rate
+
+    def respond(self, endpoint, query):
+        if endpoint == "rakuten_ranking":
+            if query.get("itemCode"):
+                shop_code, _, item_code = query["itemCode"].partition(":")
+                return {"Items": [rakuten_item(self.seed, shop_code, item_code)]}
+            genre_id = query.get("genreId", "0")
+            page = int(query.get("page", 1))
+            codes = rakuten_ranking_codes(self.seed, genre_id, page)
+            first_rank = (page - 1) * RAKUTEN_PAGE_SIZE + 1
+            return {
+                "Items": [
+                    rakuten_item(self.seed, shop_code, item_code, rank=first_rank + i)
+                    for i, (shop_code, item_code) in enumerate(codes)
+                ]
+            }
+        if endpoint == "yahoo_ranking":
+            return {
+                "high_rating_trend_ranking": {
+                    "ranking_data": [yahoo_ranking_item(self.seed, rank) for rank in range(1, YAHOO_RANKING_SIZE + 1)]
+                }
+            }
+        # yahoo_item_search
+        code = query.get("query")
+        if not code and query.get("jan_code"):
+            code = f"yshop{_stable_hash(self.seed, query['jan_code']) % SHOP_COUNT:03d}_jan"
+        if not code:
+            return {"hits": []}
+        return {"hits": [yahoo_hit(self.seed, code, query.get("jan_code"))]}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-marketplace", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="楽天・Yahoo!ショッピング API のモックサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=MOCK_LATENCY_MS)
+    parser.add_argument("--jitter-ms", type=float, default=MOCK_JITTER_MS)
+    parser.add_argument("--error-rate", type=float, default=MOCK_ERROR_RATE)
+    parser.add_argument("--rate-limit", type=float, default=MOCK_RATE_LIMIT, help="リクエスト/秒（0 で無制限）")
+    parser.add_argument("--rate-burst", type=int, default=MOCK_RATE_BURST)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    mock = MockMarketplace(
+        args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate,
+        args.rate_limit, args.rate_burst, args.seed,
+    )
+    print(f"🚀 モックサーバーを起動しました: {mock.address}")
+    for name, value in mock.env().items():
+        print(f"   {name}={value}")
+    try:
+        mock._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock._server.server_close()
+        print(json.dumps(mock.stats.summary(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
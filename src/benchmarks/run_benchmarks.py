@@ -0,0 +1,212 @@
+"""
+スクリプト名: run_benchmarks.py
+
+目的:
+合成データとインメモリの Supabase 代替（fake_supabase）を使って、
+pretreatment / summary_item.aggregate_and_upsert_site_item / train_arima.main /
+train_lstm.prepare_data を複数のデータ量で実行し、
+実行時間・ピーク RSS・Supabase へのリクエスト数を JSON レポートに出力する。
+各計測は別プロセスで実行するため、ピーク RSS は計測ごとに独立している。
+
+使い方:
+python src/benchmarks/run_benchmarks.py --sizes 100,1000,5000 --snapshots 24
+python src/benchmarks/run_benchmarks.py --compare bench_results/old.json bench_results/new.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))
+for sub in ("common", "database", "data_acquisition", "prediction"):
+    sys.path.append(os.path.join(SRC_DIR, sub))
+
+from fake_supabase import FakeSupabaseClient
+from supabase_client import set_supabase
+from synthetic import generate_snapshot_records, to_raw_records
+
+DEFAULT_RESULTS_DIR = os.path.join(BASE_DIR, "bench_results")
+
+
+def _setup_pretreatment(records):
+    import pretreatment
+    client = FakeSupabaseClient({"trn_ranked_item_stock": to_raw_records(records)})
+    set_supabase(client)
+    return client, pretreatment.pretreatment
+
+
+def _setup_summary_item(records):
+    import summary_item
+    client = FakeSupabaseClient({"trn_ranked_item_stock": to_raw_records(records)})
+    set_supabase(client)
+    return client, summary_item.aggregate_and_upsert_site_item
+
+
+def _setup_train_arima(records):
+    import train_arima
+    client = FakeSupabaseClient({"trn_ranked_item_stock_pretreatment": records})
+    set_supabase(client)
+    return client, train_arima.main
+
+
+def _setup_train_lstm_prepare(records):
+    import pandas as pd
+    import train_lstm
+    df = pd.DataFrame(records)
+    df["update_time"] = pd.to_datetime(df["update_time"])
+    df.sort_values(["site", "seller_site", "product_id", "update_time"], inplace=True)
+
+    def run():
+        for _, group in df.groupby(["site", "seller_site", "product_id"]):
+            train_lstm.prepare_data(group)
+
+    return FakeSupabaseClient(), run
+
+
+STAGES = {
+    "pretreatment": _setup_pretreatment,
+    "summary_item.aggregate_and_upsert_site_item": _setup_summary_item,
+    "train_arima.main": _setup_train_arima,
+    "train_lstm.prepare_data": _setup_train_lstm_prepare,
+}
+
+
+def _run_stage(stage, params, queue):
+    """子プロセスで 1 ステージを計測し、結果をキューに返す"""
+    result = {"stage": stage, "params": params}
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    os.chdir(workdir)
+
+    try:
+        records = generate_snapshot_records(**params)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            client, func = STAGES[stage](records)
+            del records
+            rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        result.update({
+            "status": "ok",
+            "wall_seconds": round(elapsed, 4),
+            "peak_rss_kb": rss_after,
+            "peak_rss_delta_kb": rss_after - rss_before,
+            "requests": client.request_summary(),
+            "request_total": sum(client.request_counts.values()),
+        })
+    except ImportError as e:
+        result.update({"status": "skipped", "error": f"依存ライブラリがありません: {e}"})
+    except Exception as e:
+        result.update({"status": "error", "error": str(e), "traceback": traceback.format_exc()})
+
+    queue.put(result)
+
+
+def run_benchmarks(stages, sizes, snapshots, sellers, change_rate, timeout):
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+
+    for stage in stages:
+        for products in sizes:
+            params = {
+                "products": products,
+                "snapshots": snapshots,
+                "sellers": sellers,
+                "change_rate": change_rate,
+            }
+            queue = ctx.Queue()
+            process = ctx.Process(target=_run_stage, args=(stage, params, queue))
+            process.start()
+            try:
+                result = queue.get(timeout=timeout)
+            except Exception:
+                result = {"stage": stage, "params": params, "status": "timeout"}
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+
+            print(f"{stage} products={products}: {result.get('status')} {result.get('wall_seconds', '')}s "
+                  f"rss={result.get('peak_rss_kb', '')}KB requests={result.get('request_total', '')}")
+            results.append(result)
+
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare_reports(old_path, new_path):
+    """2 つのレポートの wall_seconds / peak_rss_kb / request_total を比較表示する"""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+
+    def index(report):
+        return {(r["stage"], r["params"]["products"]): r for r in report["results"] if r.get("status") == "ok"}
+
+    old_index, new_index = index(old), index(new)
+    print(f"{'stage':45} {'products':>8} {'time x':>8} {'rss x':>8} {'req x':>8}")
+    for key in sorted(old_index.keys() & new_index.keys()):
+        o, n = old_index[key], new_index[key]
+        ratios = [
+            n[m] / o[m] if o[m] else float("nan")
+            for m in ("wall_seconds", "peak_rss_kb", "request_total")
+        ]
+        print(f"{key[0]:45} {key[1]:>8} " + " ".join(f"{r:>8.2f}" for r in ratios))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="パイプライン各処理のベンチマーク")
+    parser.add_argument("--stages", default=",".join(STAGES), help="カンマ区切りのステージ名")
+    parser.add_argument("--sizes", default="100,1000,5000", help="商品数（カンマ区切り）")
+    parser.add_argument("--snapshots", type=int, default=24, help="商品あたりのスナップショット数")
+    parser.add_argument("--sellers", type=int, default=50)
+    parser.add_argument("--change-rate", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=1800, help="1 計測あたりのタイムアウト秒")
+    parser.add_argument("--output", help="レポートの出力先（省略時は bench_results/<commit>.json）")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="2 つのレポートを比較する")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+        return
+
+    stages = [s for s in args.stages.split(",") if s]
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    commit = _git_commit()
+
+    report = {
+        "commit": commit,
+        "created_at": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": run_benchmarks(stages, sizes, args.snapshots, args.sellers, args.change_rate, args.timeout),
+    }
+
+    output = args.output or os.path.join(DEFAULT_RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"✅ レポートを保存しました: {output}")
+
+
+if __name__ == "__main__":
+    main()
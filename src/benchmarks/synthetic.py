@@ -0,0 +1,97 @@
+"""
+スクリプト名: synthetic.py
+
+目的:
+ベンチマーク用に、Supabase の在庫テーブルと同じ形のダミーレコードを生成する。
+本番データに触れずに、データ量を変えながら各処理の時間・メモリを計測するために使う。
+"""
+
+import datetime
+import random
+
+SITES = ["楽天", "Yahoo! Shopping"]
+
+
+def generate_snapshot_records(
+    products=1000,
+    snapshots=24,
+    sellers=50,
+    change_rate=0.05,
+    description_length=2000,
+    start=datetime.datetime(2025, 1, 1),
+    interval=datetime.timedelta(hours=1),
+    seed=0,
+):
+    """
+    trn_ranked_item_stock_pretreatment 相当のレコード（select("*") の結果と同じ形）を生成する。
+    各商品は snapshots 回観測され、毎回 change_rate の確率で在庫状態が反転する。
+    """
+    rng = random.Random(seed)
+    records = []
+    record_id = 1
+
+    for p in range(products):
+        site = SITES[p % len(SITES)]
+        seller_id = f"seller{p % sellers:04d}"
+        product_id = f"{seller_id}:item{p:06d}"
+        product_name = f"商品{p:06d}"
+        description = ("説明" * (description_length // 2 + 1))[:description_length]
+        price = rng.randint(500, 50000)
+        jan_code = f"49{p:011d}"
+
+        status = 1
+        prev_status = None
+        stockout_time = None
+        restock_time = None
+
+        for s in range(snapshots):
+            if s > 0 and rng.random() < change_rate:
+                status = 1 - status
+            timestamp = start + interval * s
+            if prev_status == 1 and status == 0:
+                stockout_time = timestamp
+            elif prev_status == 0 and status == 1:
+                restock_time = timestamp
+
+            iso = timestamp.isoformat()
+            records.append({
+                "id": record_id,
+                "product_id": product_id,
+                "product_name": product_name,
+                "description": description,
+                "site": site,
+                "seller_site": seller_id,
+                "seller_site_id": seller_id,
+                "seller_site_name": f"ショップ{seller_id}",
+                "prev_stock_status": prev_status,
+                "stock_status": status,
+                "stockout_time": stockout_time.isoformat() if stockout_time else None,
+                "restock_time": restock_time.isoformat() if restock_time else None,
+                "price": price,
+                "jan_code": jan_code,
+                "day_of_week": timestamp.weekday(),
+                "month": timestamp.month,
+                "insert_time": iso,
+                "update_time": iso,
+            })
+            record_id += 1
+            prev_status = status
+
+    return records
+
+
+# trn_ranked_item_stock（前処理前の生データ）に存在するカラム
+RAW_COLUMNS = [
+    "id", "product_id", "product_name", "description", "site", "seller_site_id",
+    "seller_site_name", "stock_status", "price", "jan_code", "insert_time", "update_time",
+]
+
+
+def to_raw_records(records):
+    """generate_snapshot_records の結果を trn_ranked_item_stock の形に変換する"""
+    raw = []
+    for r in records:
+        row = {col: r[col] for col in RAW_COLUMNS}
+        row["stock_status"] = bool(r["stock_status"])
+        raw.append(row)
+    return raw
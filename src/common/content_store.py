@@ -0,0 +1,180 @@
+"""
+スクリプト名: content_store.py
+
+目的:
+商品名・商品説明の文字列を、ハッシュをキーにした mst_item_content テーブルに 1 度だけ保存する。
+スナップショット行（trn_ranked_item_stock / trn_ranked_item_stock_pretreatment）には
+content_hash だけを持たせ、同じ文字列を取得のたびに書き込まないようにする。
+
+- 書き込み側: ContentStore.prepare() で行の文字列をハッシュに置き換え、
+  未登録のハッシュだけを flush() で mst_item_content に登録する。
+  登録済みのハッシュはローカルファイル（既知ハッシュキャッシュ）に記録し、次回以降は送らない。
+- 読み込み側: lookup() / attach_text() でハッシュから文字列を引き直す（取得結果はプロセス内でキャッシュ）。
+  web/api の /api/products/<product_id> が商品名・説明を返すときに使う。
+
+有効化:
+環境変数 CONTENT_DEDUPE_ENABLED=1（db_init.sql の mst_item_content / content_hash カラム作成後に有効にする）
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from metrics import counter
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_KNOWN_HASHES_PATH = os.path.abspath(os.path.join(BASE_DIR, "..", "state", "known_content_hashes.txt"))
+
+CONTENT_TABLE = "mst_item_content"
+TEXT_COLUMNS = ("product_name", "description")
+
+# lookup() で 1 リクエストに含めるハッシュ数（URL 長の制限に収まるように）
+LOOKUP_CHUNK_SIZE = 100
+# 読み込み側でキャッシュする文字列の件数
+LOOKUP_CACHE_SIZE = int(os.getenv("CONTENT_LOOKUP_CACHE_SIZE", "10000"))
+
+
+def is_enabled():
+    return os.getenv("CONTENT_DEDUPE_ENABLED", "0") == "1"
+
+
+def content_hash(product_name, description):
+    """商品名と商品説明から決まる SHA-256（16 進 64 文字）"""
+    payload = f"{product_name or ''}\x1f{description or ''}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class KnownHashCache:
+    """登録済みハッシュの集合。1 行 1 ハッシュのファイルに追記して永続化する"""
+
+    def __init__(self, path):
+        self.path = path
+        self._hashes = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._hashes = {line.strip() for line in f if line.strip()}
+
+    def __contains__(self, value):
+        with self._lock:
+            return value in self._hashes
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add_many(self, values):
+        with self._lock:
+            new_values = [v for v in values if v not in self._hashes]
+            if not new_values:
+                return
+            self._hashes.update(new_values)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{v}\n" for v in new_values))
+
+
+class ContentStore:
+    def __init__(self, client_getter, known_hashes_path=DEFAULT_KNOWN_HASHES_PATH):
+        self._client_getter = client_getter
+        self.known = KnownHashCache(known_hashes_path)
+        self._pending = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def prepare(self, rows):
+        """
+        各行に content_hash を付け、product_name / description を None にする。
+        未登録の文字列は flush() まで保留する。rows はその場で書き換える。
+        """
+        for row in rows:
+            digest = content_hash(row.get("product_name"), row.get("description"))
+            if digest not in self.known:
+                with self._lock:
+                    self._pending.setdefault(digest, {
+                        "content_hash": digest,
+                        "product_name": row.get("product_name"),
+                        "description": row.get("description"),
+                    })
+            row["content_hash"] = digest
+            for col in TEXT_COLUMNS:
+                row[col] = None
+        return rows
+
+    def flush(self):
+        """保留中の文字列を mst_item_content に登録し、登録した件数を返す"""
+        with self._lock:
+            pending, self._pending = list(self._pending.values()), {}
+        if not pending:
+            return 0
+
+        try:
+            # 別プロセスが先に登録していても重複エラーにしない
+            self._client_getter().table(CONTENT_TABLE).upsert(
+                pending, on_conflict="content_hash", ignore_duplicates=True
+            ).execute()
+        except Exception:
+            # 次回の flush で再送する
+            with self._lock:
+                for row in pending:
+                    self._pending.setdefault(row["content_hash"], row)
+            raise
+
+        self.known.add_many(row["content_hash"] for row in pending)
+        counter("stock_content_rows_written_total", "mst_item_content に登録した文字列の件数").inc(len(pending))
+        return len(pending)
+
+    def _remember(self, digest, row):
+        self._cache[digest] = row
+        self._cache.move_to_end(digest)
+        while len(self._cache) > LOOKUP_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def lookup(self, hashes):
+        """ハッシュ → {"product_name", "description"} の辞書を返す（見つからないハッシュは含まない）"""
+        result, missing = {}, []
+        with self._lock:
+            for digest in set(h for h in hashes if h):
+                if digest in self._cache:
+                    self._cache.move_to_end(digest)
+                    result[digest] = self._cache[digest]
+                else:
+                    missing.append(digest)
+
+        for i in range(0, len(missing), LOOKUP_CHUNK_SIZE):
+            chunk = missing[i:i + LOOKUP_CHUNK_SIZE]
+            response = (
+                self._client_getter().table(CONTENT_TABLE)
+                .select("content_hash, product_name, description")
+                .in_("content_hash", chunk)
+                .execute()
+            )
+            with self._lock:
+                for row in response.data or []:
+                    text = {col: row.get(col) for col in TEXT_COLUMNS}
+                    self._remember(row["content_hash"], text)
+                    result[row["content_hash"]] = text
+        return result
+
+    def attach_text(self, rows):
+        """content_hash を持つ行に product_name / description を付け直す（rows はその場で書き換える）"""
+        texts = self.lookup(row.get("content_hash") for row in rows)
+        for row in rows:
+            text = texts.get(row.get("content_hash"))
+            if text:
+                row.update(text)
+        return rows
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """プロセス内で共有する ContentStore を返す"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            from supabase_client import get_supabase
+            _store = ContentStore(get_supabase, os.getenv("CONTENT_KNOWN_HASHES_PATH", DEFAULT_KNOWN_HASHES_PATH))
+        return _store
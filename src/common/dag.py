@@ -0,0 +1,192 @@
+"""
+スクリプト名: dag.py
+
+目的:
+依存関係を宣言したステージを、依存が解決したものから並列に実行する小さな DAG ランナー。
+ステージの完了状況と進捗カーソルをチェックポイントファイル（JSON）に記録し、
+途中で失敗した実行を、完了済みステージを飛ばして続きから再開できるようにする。
+"""
+
+import datetime
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+
+
+class Stage:
+    """DAG の 1 ステージ。func は StageProgress を 1 つ受け取る"""
+
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+class Checkpoint:
+    """ステージの完了状況と進捗カーソルを保存するチェックポイント"""
+
+    def __init__(self, path, max_age_hours=24):
+        self.path = path
+        self.max_age_hours = max_age_hours
+        self._lock = threading.Lock()
+        self.state = self._load()
+
+    def _new_state(self):
+        return {
+            "started_at": datetime.datetime.now().isoformat(),
+            "completed": {},
+            "cursors": {},
+        }
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return self._new_state()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            started_at = datetime.datetime.fromisoformat(state["started_at"])
+        except (OSError, ValueError, KeyError):
+            return self._new_state()
+
+        # 古すぎるチェックポイントは再開に使わない
+        if datetime.datetime.now() - started_at > datetime.timedelta(hours=self.max_age_hours):
+            return self._new_state()
+        state.setdefault("completed", {})
+        state.setdefault("cursors", {})
+        return state
+
+    @property
+    def resumed(self):
+        return bool(self.state["completed"] or self.state["cursors"])
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def is_done(self, name):
+        with self._lock:
+            return name in self.state["completed"]
+
+    def mark_done(self, name):
+        with self._lock:
+            self.state["completed"][name] = datetime.datetime.now().isoformat()
+            self.state["cursors"].pop(name, None)
+            self._save()
+
+    def get_cursor(self, name):
+        with self._lock:
+            return self.state["cursors"].get(name)
+
+    def set_cursor(self, name, value):
+        with self._lock:
+            self.state["cursors"][name] = value
+            self._save()
+
+    def clear(self):
+        """全ステージ完了後に呼び、次回は最初から実行させる"""
+        with self._lock:
+            self.state = self._new_state()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class StageProgress:
+    """ステージ関数に渡す進捗カーソルの読み書き口"""
+
+    def __init__(self, checkpoint, name):
+        self._checkpoint = checkpoint
+        self.name = name
+
+    @property
+    def cursor(self):
+        return self._checkpoint.get_cursor(self.name)
+
+    def advance(self, value):
+        self._checkpoint.set_cursor(self.name, value)
+
+
+class DagRunner:
+    def __init__(self, stages, checkpoint, max_workers=4, stage_context=None, log=print):
+        self.stages = {s.name: s for s in stages}
+        self.checkpoint = checkpoint
+        self.max_workers = max_workers
+        # ステージ実行を包むコンテキストマネージャ（計測・プロファイル用）
+        self.stage_context = stage_context or (lambda name: nullcontext())
+        self.log = log
+        self._validate()
+
+    def _validate(self):
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"未定義の依存ステージ: {stage.name} -> {dep}")
+
+        # 循環依存の検出（深さ優先）
+        visiting, visited = set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"ステージの依存関係が循環しています: {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def _run_stage(self, stage):
+        with self.stage_context(stage.name):
+            stage.func(StageProgress(self.checkpoint, stage.name))
+
+    def run(self):
+        """
+        全ステージを実行し、失敗したステージ名のリストを返す。
+        失敗したステージに依存するステージは実行しない（次回の再開時に実行される）。
+        """
+        done = {name for name in self.stages if self.checkpoint.is_done(name)}
+        for name in sorted(done):
+            self.log(f"⏭ 完了済みのためスキップ: {name}")
+
+        failed, blocked = [], set()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                for stage in self.stages.values():
+                    if stage.name in done or stage.name in blocked or stage.name in running.values():
+                        continue
+                    if any(dep in blocked for dep in stage.deps):
+                        blocked.add(stage.name)
+                        continue
+                    if all(dep in done for dep in stage.deps):
+                        self.log(f"▶ ステージ開始: {stage.name}")
+                        running[executor.submit(self._run_stage, stage)] = stage.name
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        self.checkpoint.mark_done(name)
+                        done.add(name)
+                        self.log(f"✅ ステージ完了: {name}")
+                    else:
+                        failed.append(name)
+                        blocked.add(name)
+                        self.log(f"❌ ステージ失敗: {name}: {error}")
+
+        if not failed and len(done) == len(self.stages):
+            self.checkpoint.clear()
+        return failed
@@ -0,0 +1,240 @@
+"""
+スクリプト名: jan_index.py
+
+目的:
+同じ商品が楽天と Yahoo!ショッピングで別々の product_id を持っているため、
+JAN コードをキーに、各サイトの出品（site, seller_site_id, product_id）と
+その最新の在庫状況・価格をまとめた mst_jan_listing を扱う。
+
+- 書き込み側: JanIndexMaintainer が登録されたスナップショット（ランキング: insert_stock_data、
+  ランキング外の追跡商品: fetch_*_from_mstItem の upsert_product_to_supabase）を受け取り、
+  出品ごとに最新の状態だけを残して、まとめて upsert する。
+- 読み込み側: JanIndex が JAN コード → 出品一覧の辞書を持ち、lookup() を O(1) で返す。
+  サイト間で在庫状況が分かれている JAN（どこかで在庫切れ、別のサイトでは在庫あり）も一覧できる。
+- 既存データからの作り直し: python src/common/jan_index.py --rebuild
+
+有効化:
+環境変数 JAN_INDEX_ENABLED=1（db_init.sql の mst_jan_listing 作成後に有効にする）
+"""
+
+import datetime
+import os
+import threading
+
+from metrics import counter
+
+JAN_TABLE = "mst_jan_listing"
+JAN_COLUMNS = [
+    "jan_code", "site", "seller_site_id", "seller_site_name", "product_id",
+    "stock_status", "price", "update_time",
+]
+CONFLICT_COLUMNS = "site,seller_site_id,product_id"
+
+# Supabase（PostgREST）の 1 リクエストあたりの最大件数
+PAGE_SIZE = 1000
+# in_ フィルタ 1 回で指定する JAN コード数（URL 長の制限に収まるように）
+LOOKUP_CHUNK_SIZE = 100
+
+
+def is_enabled():
+    return os.getenv("JAN_INDEX_ENABLED", "0") == "1"
+
+
+def _to_datetime(value):
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+def listing_key(row):
+    return (row.get("site"), row.get("seller_site_id") or "", row.get("product_id"))
+
+
+def _listing(row):
+    return {
+        "jan_code": str(row["jan_code"]).strip(),
+        "site": row.get("site"),
+        "seller_site_id": row.get("seller_site_id") or "",
+        "seller_site_name": row.get("seller_site_name"),
+        "product_id": row.get("product_id"),
+        "stock_status": bool(row.get("stock_status")),
+        "price": row.get("price"),
+        "update_time": _to_datetime(row.get("update_time")),
+    }
+
+
+def _to_record(listing):
+    return {**listing, "update_time": listing["update_time"].isoformat() if listing["update_time"] else None}
+
+
+class JanIndexMaintainer:
+    """出品ごとの最新状態を保持し、前回の flush 以降に観測した出品を 1 出品 1 行で upsert する"""
+
+    def __init__(self, client_getter):
+        self._client_getter = client_getter
+        self._latest = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+
+    def observe(self, row):
+        if not row.get("jan_code") or not str(row["jan_code"]).strip():
+            return
+        listing = _listing(row)
+        key = listing_key(listing)
+        current = self._latest.get(key)
+        if current is not None:
+            if listing["update_time"] and current["update_time"] and listing["update_time"] < current["update_time"]:
+                # 古いスナップショットで最新状態を上書きしない
+                return
+        self._latest[key] = listing
+        self._dirty[key] = listing
+
+    def observe_many(self, rows):
+        with self._lock:
+            for row in rows:
+                self.observe(row)
+
+    def take_dirty(self):
+        """書き込み待ちの出品を DB 書き込み用の dict にして返し、空にする"""
+        dirty, self._dirty = list(self._dirty.values()), {}
+        return [_to_record(row) for row in dirty]
+
+    def flush(self):
+        """観測した出品を upsert し、件数を返す。書き込めなかった出品は次回の flush で再送する"""
+        with self._lock:
+            dirty, self._dirty = list(self._dirty.items()), {}
+            rows = [_to_record(listing) for _, listing in dirty]
+        if not rows:
+            return 0
+        written = 0
+        try:
+            client = self._client_getter()
+            for i in range(0, len(rows), PAGE_SIZE):
+                client.table(JAN_TABLE).upsert(rows[i:i + PAGE_SIZE], on_conflict=CONFLICT_COLUMNS).execute()
+                written = min(i + PAGE_SIZE, len(rows))
+        except Exception:
+            with self._lock:
+                # 失敗中に新しい状態を観測した出品は、そちらを残す
+                for key, listing in dirty[written:]:
+                    self._dirty.setdefault(key, listing)
+            raise
+        finally:
+            counter("stock_db_rows_written_total", "DBに書き込んだ行数").inc(written, table=JAN_TABLE)
+        return written
+
+
+class JanIndex:
+    """JAN コード → 出品一覧の辞書"""
+
+    def __init__(self, listings):
+        self._by_jan = {}
+        for row in listings:
+            row = dict(row)
+            row["update_time"] = _to_datetime(row.get("update_time"))
+            self._by_jan.setdefault(str(row["jan_code"]).strip(), {})[listing_key(row)] = row
+
+    def __len__(self):
+        return len(self._by_jan)
+
+    def __contains__(self, jan_code):
+        return str(jan_code).strip() in self._by_jan
+
+    def jan_codes(self):
+        return self._by_jan.keys()
+
+    def lookup(self, jan_code):
+        """その JAN コードの出品一覧（サイト・販売元の順）。見つからなければ空リスト"""
+        listings = self._by_jan.get(str(jan_code).strip(), {})
+        return sorted(listings.values(), key=lambda r: (r["site"] or "", r["seller_site_id"]))
+
+    def in_stock(self, jan_code):
+        """その JAN コードで今在庫がある出品"""
+        return [row for row in self.lookup(jan_code) if row["stock_status"]]
+
+    def cross_site_stockouts(self):
+        """
+        どこかの出品が在庫切れで、別のサイトには在庫がある JAN コードの一覧。
+        {jan_code: {"out_of_stock": [...], "in_stock": [...]}} を返す
+        """
+        result = {}
+        for jan_code, listings in self._by_jan.items():
+            out_of_stock = [row for row in listings.values() if not row["stock_status"]]
+            if not out_of_stock:
+                continue
+            out_sites = {row["site"] for row in out_of_stock}
+            in_stock = [row for row in listings.values() if row["stock_status"] and row["site"] not in out_sites]
+            if in_stock:
+                result[jan_code] = {"out_of_stock": out_of_stock, "in_stock": in_stock}
+        return result
+
+
+def load_jan_index(client, jan_codes=None):
+    """mst_jan_listing を読み込んで JanIndex を作る（jan_codes で絞り込み可）"""
+    rows = []
+    if jan_codes:
+        # 絞り込みは jan_code の索引を使う
+        codes = sorted({str(c).strip() for c in jan_codes if c})
+        for i in range(0, len(codes), LOOKUP_CHUNK_SIZE):
+            response = (
+                client.table(JAN_TABLE)
+                .select(", ".join(JAN_COLUMNS))
+                .in_("jan_code", codes[i:i + LOOKUP_CHUNK_SIZE])
+                .execute()
+            )
+            rows.extend(response.data or [])
+    else:
+        offset = 0
+        while True:
+            response = (
+                client.table(JAN_TABLE)
+                .select(", ".join(JAN_COLUMNS))
+                .order("jan_code")
+                .range(offset, offset + PAGE_SIZE - 1)
+                .execute()
+            )
+            if not response.data:
+                break
+            rows.extend(response.data)
+            offset += PAGE_SIZE
+    counter("stock_db_rows_fetched_total", "DBから取得した行数").inc(len(rows), table=JAN_TABLE)
+    return JanIndex(rows)
+
+
+_maintainer = None
+_maintainer_lock = threading.Lock()
+
+
+def get_maintainer():
+    """プロセス内で共有する JanIndexMaintainer を返す"""
+    global _maintainer
+    with _maintainer_lock:
+        if _maintainer is None:
+            from supabase_client import get_supabase
+            _maintainer = JanIndexMaintainer(get_supabase)
+        return _maintainer
+
+
+def rebuild_jan_index():
+    """trn_ranked_item_stock 全体（アーカイブ済みの期間を含む）から mst_jan_listing を作り直す（初回の移行用）"""
+    from stock_archive import fetch_stock_records
+    from supabase_client import get_supabase
+
+    client = get_supabase()
+    snapshots = fetch_stock_records(
+        client,
+        ["jan_code", "site", "seller_site_id", "seller_site_name", "product_id", "stock_status", "price", "update_time"],
+    )
+    maintainer = JanIndexMaintainer(lambda: client)
+    maintainer.observe_many(sorted(snapshots, key=lambda r: str(r.get("update_time") or "")))
+    count = maintainer.flush()
+    print(f"✅ {len(snapshots)}件のスナップショットから {count}件の出品を登録しました")
+    return count
+
+
+if __name__ == "__main__":
+    import sys
+
+    if "--rebuild" in sys.argv[1:]:
+        rebuild_jan_index()
+    else:
+        print("使い方: python src/common/jan_index.py --rebuild")
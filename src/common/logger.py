@@ -1,8 +1,14 @@
+import atexit
 import datetime
+import gzip
+import json
 import logging
 import os
+import queue
+import random
+import threading
 import time
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener
 
 # # ログディレクトリのパス
 # LOG_DIR = r"C:\Users\kazuk\python\stock_predictor_project\logs"
@@ -11,78 +17,256 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LOG_DIR = os.path.join(BASE_DIR, "logs")
 os.makedirs(LOG_DIR, exist_ok=True)  # ディレクトリが存在しない場合は作成
 
+# 保持期間（日）
+LOG_RETENTION_DAYS = 30
 
-# 各ログファイルのパス
-rakuten_response_log_file = os.path.join(LOG_DIR, "response_rakuten_log.log")
-yahoo_response_log_file = os.path.join(LOG_DIR, "response_yahoo_log.log")
+# APIレスポンスのログ設定（サンプリング率 0.0〜1.0 / 1件あたりの最大文字数）
+LOG_RESPONSE_SAMPLE_RATE = float(os.getenv("LOG_RESPONSE_SAMPLE_RATE", "1.0"))
+LOG_RESPONSE_MAX_CHARS = int(os.getenv("LOG_RESPONSE_MAX_CHARS", str(256 * 1024)))
+
+# gzip ファイルをフラッシュする間隔（秒）
+LOG_GZIP_FLUSH_INTERVAL = 5
+
+# 古いログの削除チェック間隔（秒）
+LOG_CLEANUP_INTERVAL = 60 * 60
+
+# 各ログファイルのパス（実際のファイル名には日付が付く: info_log_2025-01-01.log）
+rakuten_response_log_file = os.path.join(LOG_DIR, "response_rakuten_log")
+yahoo_response_log_file = os.path.join(LOG_DIR, "response_yahoo_log")
+other_response_log_file = os.path.join(LOG_DIR, "response_other_log")
 error_log_file = os.path.join(LOG_DIR, "error_log.log")
 info_log_file = os.path.join(LOG_DIR, "info_log.log")
 
+
+class DailyFileHandler(logging.FileHandler):
+    """
+    日付ごとに別ファイル（<名前>_YYYY-MM-DD.log）へ追記するハンドラ。
+    リネームによるローテーションを行わないため、複数プロセスが同じファイルに追記しても安全。
+    """
+
+    def __init__(self, log_file):
+        root, ext = os.path.splitext(log_file)
+        self._root, self._ext = root, ext or ".log"
+        self._date = datetime.date.today()
+        super().__init__(self._dated_path(), encoding="utf-8", delay=True)
+
+    def _dated_path(self):
+        return f"{self._root}_{self._date.isoformat()}{self._ext}"
+
+    def emit(self, record):
+        today = datetime.date.today()
+        if today != self._date:
+            self._date = today
+            self.close()
+            self.baseFilename = os.path.abspath(self._dated_path())
+        super().emit(record)
+
+
+class GzipPayloadHandler(logging.Handler):
+    """
+    APIレスポンスを JSON Lines 形式で gzip ファイルに追記するハンドラ。
+    ファイルは日付・プロセスごとに分ける（<名前>_YYYY-MM-DD.<pid>.jsonl.gz）。
+    JSON への変換は log_response（呼び出し元スレッド）で済ませ、切り詰めと圧縮はこのハンドラ（バックグラウンドスレッド）で行う。
+    """
+
+    def __init__(self, log_file, max_chars=LOG_RESPONSE_MAX_CHARS):
+        super().__init__()
+        self.log_file = log_file
+        self.max_chars = max_chars
+        self._stream = None
+        self._key = None
+        self._last_flush = 0.0
+
+    def _open(self):
+        key = (datetime.date.today(), os.getpid())
+        if self._stream is None or key != self._key:
+            if self._stream is not None:
+                self._stream.close()
+            self._key = key
+            path = f"{self.log_file}_{key[0].isoformat()}.{key[1]}.jsonl.gz"
+            self._stream = gzip.open(path, "at", encoding="utf-8")
+        return self._stream
+
+    def emit(self, record):
+        try:
+            payload = getattr(record, "payload_json", "null")
+            truncated = len(payload) > self.max_chars
+            if truncated:
+                payload = json.dumps(payload[:self.max_chars], ensure_ascii=False)
+
+            line = (
+                f'{{"time": "{datetime.datetime.fromtimestamp(record.created).isoformat()}", '
+                f'"type": {json.dumps(record.getMessage(), ensure_ascii=False)}, '
+                f'"truncated": {str(truncated).lower()}, "response": {payload}}}\n'
+            )
+            self.acquire()
+            try:
+                self._open().write(line)
+                # 異常終了してもそこまでの内容を読めるよう、一定間隔で圧縮ブロックを書き出す
+                if record.created - self._last_flush >= LOG_GZIP_FLUSH_INTERVAL:
+                    self._stream.flush()
+                    self._last_flush = record.created
+            finally:
+                self.release()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self._stream is not None:
+                self._stream.flush()
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+        finally:
+            self.release()
+        super().close()
+
+
+class DeferredQueueHandler(QueueHandler):
+    """メッセージの整形を呼び出し元スレッドで行わず、レコードをそのままキューに積む"""
+
+    def prepare(self, record):
+        return record
+
+
+# ログ書き込み用のキューとバックグラウンドスレッド（プロセスごとに 1 つ）
+_log_queue = queue.SimpleQueue()
+_queue_handlers = []
+_file_handlers = []
+_listener = None
+
+
+def _start_listener():
+    global _listener
+    _listener = QueueListener(_log_queue, *_file_handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+    for handler in _file_handlers:
+        handler.close()
+
+
+def _restart_after_fork():
+    """fork 後の子プロセスでは、キューと書き込みスレッドを作り直す"""
+    global _log_queue
+    _log_queue = queue.SimpleQueue()
+    for handler in _queue_handlers:
+        handler.queue = _log_queue
+    for handler in _file_handlers:
+        handler.createLock()
+        if isinstance(handler, GzipPayloadHandler):
+            handler._stream = None
+        else:
+            handler.stream = None
+    _start_listener()
+
+
 # ロガーの設定
-def setup_logger(name, log_file):
+def setup_logger(name, log_file, handler=None):
     logger = logging.getLogger(name)
-    
+
     # すでにハンドラが設定されている場合は追加しない
     if logger.hasHandlers():
         return logger
-    
+
     logger.setLevel(logging.INFO)
-    
-    # 日付ごとにローテーションし、過去30日分保持
-    handler = TimedRotatingFileHandler(
-        log_file, when="midnight", interval=1, backupCount=30, encoding="utf-8"
-    )
-    handler.suffix = "%Y-%m-%d"  # ローテーションしたログに日付を追加
-    handler.extMatch = r"^\d{4}-\d{2}-\d{2}$"  # ローテーション時に適用される日付フォーマット
-    
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    
+    logger.propagate = False
+
+    # 実際の書き込みはバックグラウンドスレッドで行う
+    if handler is None:
+        handler = DailyFileHandler(log_file)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    handler.addFilter(logging.Filter(name))
+    _file_handlers.append(handler)
+
+    queue_handler = DeferredQueueHandler(_log_queue)
+    _queue_handlers.append(queue_handler)
+    logger.addHandler(queue_handler)
+
     return logger
 
-rakuten_response_logger = setup_logger("rakuten_response_logger", rakuten_response_log_file)
-yahoo_response_logger = setup_logger("yahoo_response_logger", yahoo_response_log_file)
+rakuten_response_logger = setup_logger(
+    "rakuten_response_logger", rakuten_response_log_file, GzipPayloadHandler(rakuten_response_log_file)
+)
+yahoo_response_logger = setup_logger(
+    "yahoo_response_logger", yahoo_response_log_file, GzipPayloadHandler(yahoo_response_log_file)
+)
+other_response_logger = setup_logger(
+    "other_response_logger", other_response_log_file, GzipPayloadHandler(other_response_log_file)
+)
 error_logger = setup_logger("error_logger", error_log_file)
 info_logger = setup_logger("info_logger", info_log_file)
 
+_start_listener()
+atexit.register(_stop_listener)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
 # 古いログを削除する関数
 def delete_old_logs():
-    cutoff_time = time.time() - (30 * 24 * 60 * 60)  # 30日前のタイムスタンプ
+    cutoff_time = time.time() - (LOG_RETENTION_DAYS * 24 * 60 * 60)  # 30日前のタイムスタンプ
     for log_file in os.listdir(LOG_DIR):
         log_path = os.path.join(LOG_DIR, log_file)
-        if os.path.isfile(log_path) and os.path.getmtime(log_path) < cutoff_time:
-            os.remove(log_path)
+        try:
+            if os.path.isfile(log_path) and os.path.getmtime(log_path) < cutoff_time:
+                os.remove(log_path)
+        except OSError:
+            # 別プロセスが先に削除した場合など
+            pass
 
 # 日付が変わったら実行する処理
-last_checked_date = datetime.date.today()
+last_checked_date = None
 
 def check_and_cleanup_logs():
     global last_checked_date
     today = datetime.date.today()
-    
-    if today > last_checked_date:
+
+    if last_checked_date is None or today > last_checked_date:
         delete_old_logs()
         last_checked_date = today
 
+# 古いログの削除はバックグラウンドで定期的に行う（ログ出力のたびには行わない）
+def _cleanup_loop():
+    while True:
+        try:
+            check_and_cleanup_logs()
+        except Exception:
+            pass
+        time.sleep(LOG_CLEANUP_INTERVAL)
+
+threading.Thread(target=_cleanup_loop, name="log-cleanup", daemon=True).start()
+
 # ログ記録関数
 def log_response(data_type, response):
-    check_and_cleanup_logs()
+    # サンプリング（記録しないレスポンスはシリアライズしない）
+    if LOG_RESPONSE_SAMPLE_RATE < 1.0 and random.random() >= LOG_RESPONSE_SAMPLE_RATE:
+        return
 
+    # 呼び出し元は記録後も同じ list / dict を書き換えるため、書き込みスレッドに渡す前に JSON にしておく
+    extra = {"payload_json": json.dumps(response, ensure_ascii=False, default=str)}
     if data_type.lower() == "rakuten":
-        rakuten_response_logger.info(f"[{data_type}] Response: {response}")
+        rakuten_response_logger.info(data_type, extra=extra)
     elif data_type.lower() == "yahoo_data":
-        yahoo_response_logger.info(f"[{data_type}] Response: {response}")
+        yahoo_response_logger.info(data_type, extra=extra)
     else:
-        # どちらにも該当しない場合は、info_logに記録
-        info_logger.info(f"[{data_type}] Response: {response}")
+        # どちらにも該当しない場合は、その他のレスポンスログに記録
+        other_response_logger.info(data_type, extra=extra)
 
 def log_error(error_message):
-    check_and_cleanup_logs()
     error_logger.error(f"ERROR: {error_message}")
     print(f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ERROR: {error_message}")
 
 def log_info(info_message):
-    check_and_cleanup_logs()
     info_logger.info(f"INFO: {info_message}")
     print(f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} INFO: {info_message}")
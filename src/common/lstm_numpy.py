@@ -0,0 +1,183 @@
+"""
+スクリプト名: lstm_numpy.py
+
+目的:
+train_lstm.build_lstm_model() の構成（LSTM(50) → Dense(25, relu) → Dense(1)）の学習済み重みを
+.npz に書き出し、TensorFlow を読み込まずに NumPy だけで予測する。
+TensorFlow は import だけで数秒・数百 MB かかるため、予測だけを行う処理（train_lstm --predict-only、web/app）はこちらを使う。
+予測系（prediction）と画面（web）の両方から読み込むため common に置く。
+
+- LstmWeights: 1 モデル分の重み。predict(X) は Keras の model.predict(X) と同じ形 (サンプル数, 1) を返す。
+- LstmWeightBank: 商品ごとの重みを商品の軸で積み重ねて 1 つの .npz に保存する。
+  predict_next() は全商品の「最後の値 → 次の値」を 1 回の行列演算でまとめて計算する。
+- verify_against_keras(): 同じ入力で Keras と NumPy の出力を比べ、最大誤差を返す（書き出し後の確認用）。
+
+LSTM の計算は Keras の既定（ゲート順 i, f, c, o、activation=tanh、recurrent_activation=sigmoid）に合わせている。
+"""
+
+import os
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LSTM_WEIGHTS_PATH = os.getenv("LSTM_WEIGHTS_PATH") or os.path.abspath(
+    os.path.join(BASE_DIR, "..", "state", "lstm_weights.npz")
+)
+# Keras と NumPy の出力の差として許容する値（float32 の計算誤差）
+VERIFY_TOLERANCE = 1e-4
+
+WEIGHT_NAMES = ["lstm_kernel", "lstm_recurrent", "lstm_bias", "dense1_kernel", "dense1_bias", "dense2_kernel", "dense2_bias"]
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class LstmWeights:
+    def __init__(self, lstm_kernel, lstm_recurrent, lstm_bias, dense1_kernel, dense1_bias, dense2_kernel, dense2_bias):
+        self.lstm_kernel = np.asarray(lstm_kernel, dtype=np.float32)        # (特徴量数, 4 * units)
+        self.lstm_recurrent = np.asarray(lstm_recurrent, dtype=np.float32)  # (units, 4 * units)
+        self.lstm_bias = np.asarray(lstm_bias, dtype=np.float32)            # (4 * units,)
+        self.dense1_kernel = np.asarray(dense1_kernel, dtype=np.float32)    # (units, 25)
+        self.dense1_bias = np.asarray(dense1_bias, dtype=np.float32)
+        self.dense2_kernel = np.asarray(dense2_kernel, dtype=np.float32)    # (25, 1)
+        self.dense2_bias = np.asarray(dense2_bias, dtype=np.float32)
+
+    @property
+    def units(self):
+        return self.lstm_recurrent.shape[0]
+
+    @classmethod
+    def from_keras(cls, model):
+        """build_lstm_model() のモデルから重みを取り出す（get_weights() の順に並んでいる）"""
+        return cls(*model.get_weights())
+
+    def arrays(self):
+        return [getattr(self, name) for name in WEIGHT_NAMES]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez_compressed(path, **{name: array for name, array in zip(WEIGHT_NAMES, self.arrays())})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(*(data[name] for name in WEIGHT_NAMES))
+
+    def predict(self, X):
+        """X: (サンプル数, 時系列の長さ, 特徴量の数) → (サンプル数, 1)"""
+        X = np.asarray(X, dtype=np.float32)
+        batch, steps, _ = X.shape
+        units = self.units
+        h = np.zeros((batch, units), dtype=np.float32)
+        c = np.zeros((batch, units), dtype=np.float32)
+        # 入力側の行列積は全時刻分を先にまとめて計算する
+        projected = X @ self.lstm_kernel + self.lstm_bias
+        for t in range(steps):
+            z = projected[:, t, :] + h @ self.lstm_recurrent
+            i = _sigmoid(z[:, :units])
+            f = _sigmoid(z[:, units:2 * units])
+            g = np.tanh(z[:, 2 * units:3 * units])
+            o = _sigmoid(z[:, 3 * units:])
+            c = f * c + i * g
+            h = o * np.tanh(c)
+        hidden = np.maximum(h @ self.dense1_kernel + self.dense1_bias, 0.0)
+        return hidden @ self.dense2_kernel + self.dense2_bias
+
+
+class LstmWeightBank:
+    """商品ごとの LstmWeights を商品の軸で積み重ねたもの"""
+
+    def __init__(self, keys=None, arrays=None):
+        self.keys = list(keys or [])
+        self._arrays = arrays          # WEIGHT_NAMES と同じ順の、先頭に商品の軸を持つ配列
+        self._pending = []
+        self._rows = {key: i for i, key in enumerate(self.keys)}
+
+    def __len__(self):
+        self._stack()
+        return len(self.keys)
+
+    def __contains__(self, key):
+        self._stack()
+        return tuple(key) in self._rows
+
+    def add(self, key, weights):
+        """商品 key（(site, seller_site, product_id)）の重みを追加する。同じ key は後から追加した方で置き換える"""
+        self._pending.append((tuple(key), weights))
+
+    def _stack(self):
+        if not self._pending:
+            return
+        merged = {key: LstmWeights(*(array[i] for array in self._arrays)) for i, key in enumerate(self.keys)}
+        for key, weights in self._pending:
+            merged[key] = weights
+        self._pending = []
+        self.keys = list(merged)
+        self._rows = {key: i for i, key in enumerate(self.keys)}
+        self._arrays = [np.stack([w.arrays()[n] for w in merged.values()]) for n in range(len(WEIGHT_NAMES))]
+
+    def get(self, key):
+        """1 商品分の LstmWeights"""
+        if self._pending:
+            self._stack()
+        row = self._rows[tuple(key)]
+        return LstmWeights(*(array[row] for array in self._arrays))
+
+    def save(self, path=LSTM_WEIGHTS_PATH):
+        self._stack()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        keys = np.array(self.keys, dtype=str).reshape(-1, 3)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_path, keys=keys, **{name: array for name, array in zip(WEIGHT_NAMES, self._arrays or [])})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=LSTM_WEIGHTS_PATH):
+        with np.load(path) as data:
+            keys = [tuple(row) for row in data["keys"].tolist()]
+            arrays = [data[name] for name in WEIGHT_NAMES] if keys else None
+        return cls(keys, arrays)
+
+    def predict_next(self, last_values, keys=None):
+        """
+        各商品の最後の値から次の値を予測する（build_lstm_model の入力形 (1, 1) と同じ 1 ステップ）。
+        last_values は keys（省略時は self.keys）と同じ順の配列。戻り値も同じ順の (商品数,) の配列。
+        """
+        self._stack()
+        rows = np.arange(len(self.keys)) if keys is None else np.array([self._rows[tuple(k)] for k in keys])
+        kernel, recurrent, bias, w1, b1, w2, b2 = (array[rows] for array in self._arrays)
+        x = np.asarray(last_values, dtype=np.float32).reshape(-1, 1)
+        units = recurrent.shape[1]
+
+        # 初期状態が 0 なので 1 ステップでは recurrent の項は 0 になる
+        z = np.einsum("pf,pfu->pu", x, kernel) + bias
+        i = _sigmoid(z[:, :units])
+        g = np.tanh(z[:, 2 * units:3 * units])
+        o = _sigmoid(z[:, 3 * units:])
+        h = o * np.tanh(i * g)
+        hidden = np.maximum(np.einsum("pu,puv->pv", h, w1) + b1, 0.0)
+        return (np.einsum("pv,pvo->po", hidden, w2) + b2)[:, 0]
+
+
+def verify_against_keras(model, X, tolerance=VERIFY_TOLERANCE):
+    """同じ入力で Keras と NumPy の出力を比べ、(一致したか, 最大誤差) を返す"""
+    expected = model.predict(X, verbose=0)
+    actual = LstmWeights.from_keras(model).predict(X)
+    max_error = float(np.max(np.abs(expected - actual))) if len(X) else 0.0
+    return max_error <= tolerance, max_error
+
+
+if __name__ == "__main__":
+    # TensorFlow がある環境で、NumPy の計算が Keras と一致するかを確認する
+    import sys
+
+    from train_lstm import build_lstm_model
+
+    rng = np.random.default_rng(0)
+    model = build_lstm_model()
+    X = rng.random((64, 1, 1)).astype(np.float32)
+    model.fit(X, rng.random((64, 1)), epochs=2, verbose=0)
+    ok, max_error = verify_against_keras(model, X)
+    print(f"{'✅' if ok else '❌'} Keras との最大誤差: {max_error:.2e}（許容 {VERIFY_TOLERANCE:.0e}）")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,254 @@
+"""
+スクリプト名: metrics.py
+
+目的:
+スケジューラの各処理（API 呼び出し・DB 読み書き・モデル学習・ステージ所要時間）を計測する
+軽量なメトリクス層。カウンタ・ゲージ・レイテンシのヒストグラムと、計時用のコンテキストマネージャを提供し、
+実行終了時に Prometheus の textfile 形式と JSON サマリーを出力する。
+
+環境変数:
+METRICS_ENABLED=0 で無効化（計測呼び出しはすべて何もしない関数になる）
+METRICS_DIR で出力先ディレクトリを指定
+"""
+
+import json
+import os
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+METRICS_DIR = os.getenv("METRICS_DIR") or os.path.join(BASE_DIR, "metrics")
+
+# レイテンシ用ヒストグラムの既定バケット（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in key) + "}"
+
+
+class Counter:
+    type_name = "counter"
+
+    def __init__(self, name, help_text=""):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [(self.name, key, value) for key, value in self.values.items()]
+
+    def summary(self):
+        return [{"labels": dict(key), "value": value} for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[_label_key(labels)] = value
+
+
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [バケットごとの件数..., +Inf の件数, 合計, 件数]
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        samples = []
+        for key, state in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), state[:-2]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", key + (("le", str(bound)),), cumulative))
+            samples.append((f"{self.name}_sum", key, state[-2]))
+            samples.append((f"{self.name}_count", key, state[-1]))
+        return samples
+
+    def summary(self):
+        return [
+            {
+                "labels": dict(key),
+                "count": state[-1],
+                "sum": round(state[-2], 6),
+                "avg": round(state[-2] / state[-1], 6) if state[-1] else 0.0,
+            }
+            for key, state in self.values.items()
+        ]
+
+
+class _NullMetric:
+    """無効化時に返す何もしないメトリクス"""
+
+    def inc(self, amount=1, **labels):
+        pass
+
+    def set(self, value, **labels):
+        pass
+
+    def observe(self, value, **labels):
+        pass
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_METRIC = _NullMetric()
+_NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name, help_text=""):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text=""):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def to_prometheus(self):
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            if metric.help:
+                lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type_name}")
+            for sample_name, key, value in metric.samples():
+                lines.append(f"{sample_name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        return {
+            name: {"type": metric.type_name, "samples": metric.summary()}
+            for name, metric in sorted(self.metrics.items())
+        }
+
+    def reset(self):
+        with self._lock:
+            self.metrics = {}
+
+
+registry = MetricsRegistry()
+
+
+def counter(name, help_text=""):
+    return registry.counter(name, help_text) if METRICS_ENABLED else _NULL_METRIC
+
+
+def gauge(name, help_text=""):
+    return registry.gauge(name, help_text) if METRICS_ENABLED else _NULL_METRIC
+
+
+def histogram(name, help_text="", buckets=DEFAULT_BUCKETS):
+    return registry.histogram(name, help_text, buckets) if METRICS_ENABLED else _NULL_METRIC
+
+
+class Timer:
+    """with ブロックの所要時間（秒）をヒストグラムに記録する"""
+
+    def __init__(self, metric, labels):
+        self.metric = metric
+        self.labels = labels
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self._started
+        self.metric.observe(self.elapsed, **self.labels)
+        return False
+
+
+def timer(name, help_text="", **labels):
+    """使い方: with timer("stock_stage_duration_seconds", stage="pretreatment"): ..."""
+    if not METRICS_ENABLED:
+        return _NULL_TIMER
+    return Timer(registry.histogram(name, help_text), labels)
+
+
+def export_metrics(job, output_dir=None):
+    """
+    メトリクスを <job>.prom（Prometheus textfile collector 用）と <job>.json に書き出し、
+    書き出したパスを返す。無効化時は何もしない。
+    """
+    if not METRICS_ENABLED:
+        return None
+
+    output_dir = output_dir or METRICS_DIR
+    os.makedirs(output_dir, exist_ok=True)
+
+    gauge("stock_run_last_completed_timestamp_seconds", "実行が完了した時刻").set(time.time(), job=job)
+
+    prom_path = os.path.join(output_dir, f"{job}.prom")
+    json_path = os.path.join(output_dir, f"{job}.json")
+
+    # textfile collector が書きかけのファイルを読まないよう、一時ファイル経由で置き換える
+    for path, content in (
+        (prom_path, registry.to_prometheus()),
+        (json_path, json.dumps({"job": job, "metrics": registry.to_dict()}, indent=2, ensure_ascii=False)),
+    ):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    return prom_path, json_path
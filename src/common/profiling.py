@@ -0,0 +1,125 @@
+"""
+スクリプト名: profiling.py
+
+目的:
+スケジューラの各ステージを cProfile（および任意で tracemalloc）で個別にプロファイルする。
+1 回の実行ごとに実行ディレクトリを作り、ステージごとに以下を出力する。
+  <stage>.prof       … cProfile の統計（snakeviz / pstats で開ける）
+  <stage>.txt        … 累積時間の上位 N 関数
+  <stage>.alloc.txt  … tracemalloc による確保量の上位 N 行（メモリプロファイル有効時のみ）
+
+有効化:
+環境変数 PROFILE=1（メモリも取る場合は PROFILE_MEMORY=1）、
+またはスケジューラの引数 --profile / --profile-memory
+"""
+
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PROFILE_ENABLED = os.getenv("PROFILE", "0") == "1"
+PROFILE_MEMORY = os.getenv("PROFILE_MEMORY", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(BASE_DIR, "profiles")
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "30"))
+
+_state = {"job": "run", "run_dir": None}
+_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def configure(job, argv=None):
+    """実行名を設定し、引数 --profile / --profile-memory があれば有効化する"""
+    global PROFILE_ENABLED, PROFILE_MEMORY
+    argv = argv or []
+    if "--profile" in argv:
+        PROFILE_ENABLED = True
+    if "--profile-memory" in argv:
+        PROFILE_ENABLED = True
+        PROFILE_MEMORY = True
+    with _lock:
+        _state["job"] = job
+        _state["run_dir"] = None
+
+
+def run_dir():
+    """今回の実行の出力先ディレクトリ（初回呼び出し時に作成）"""
+    with _lock:
+        if _state["run_dir"] is None:
+            stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+            path = os.path.join(PROFILE_DIR, f"{_state['job']}_{stamp}_{os.getpid()}")
+            os.makedirs(path, exist_ok=True)
+            _state["run_dir"] = path
+        return _state["run_dir"]
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+def _write_alloc_report(path, snapshot, peak, top_n):
+    stats = snapshot.statistics("lineno")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"peak traced memory: {peak / 1024 / 1024:.1f} MiB\n")
+        f.write(f"top {top_n} allocations by line:\n")
+        for stat in stats[:top_n]:
+            f.write(f"{stat}\n")
+
+
+@contextmanager
+def profile_stage(name, top_n=None):
+    """with ブロックをプロファイルし、結果を実行ディレクトリに書き出す（無効時は何もしない）"""
+    if not PROFILE_ENABLED:
+        yield
+        return
+
+    top_n = top_n or PROFILE_TOP_N
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 別スレッドで他のステージをプロファイル中（cProfile は同時に 1 つしか有効にできない）
+        profiler = None
+
+    memory = PROFILE_MEMORY
+    if memory:
+        _start_tracemalloc()
+        tracemalloc.reset_peak()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        output_dir = run_dir()
+
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(output_dir, f"{name}.prof"))
+            buffer = io.StringIO()
+            pstats.Stats(profiler, stream=buffer).sort_stats("cumulative").print_stats(top_n)
+            with open(os.path.join(output_dir, f"{name}.txt"), "w", encoding="utf-8") as f:
+                f.write(buffer.getvalue())
+
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            _stop_tracemalloc()
+            _write_alloc_report(os.path.join(output_dir, f"{name}.alloc.txt"), snapshot, peak, top_n)
@@ -0,0 +1,54 @@
+"""
+スクリプト名: rate_limiter.py
+
+目的:
+外部 API へのリクエスト頻度を制限するトークンバケット。
+複数スレッドから共有でき、acquire() は次のトークンが貯まるまで待つ。
+try_acquire() は待たずに取得できたかどうかを返す（受け付ける側で超過分を断る用途）。
+rate=1.0, burst=1 なら従来の「1 件ごとに sleep(1)」と同じ 1 リクエスト/秒になる。
+"""
+
+import threading
+import time
+
+
+class RateLimiter:
+    def __init__(self, rate, burst=1):
+        """rate: 1 秒あたりのリクエスト数（0 以下で無制限）、burst: 連続して許可する最大数"""
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """トークンがあれば 1 つ取得して True、なければ待たずに False を返す"""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """トークンを 1 つ取得する。足りなければ貯まるまで待ち、待った秒数を返す"""
+        if self.rate <= 0:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+            waited += wait_seconds
@@ -0,0 +1,295 @@
+"""
+スクリプト名: stock_archive.py
+
+目的:
+trn_ranked_item_stock の古いスナップショットを、月 × サイトで分けた zstd 圧縮の Parquet ファイルに移し、
+ホットテーブルからはバッチごとに削除する（テーブルを小さく保ち、全件走査する処理を速くする）。
+過去の期間を読むときは load_history()（期間指定）または fetch_stock_records()（全期間）が
+アーカイブとホットテーブルをまとめて返す。
+
+ファイル配置（Hive 形式のパーティション、値は URL エンコード）:
+<ARCHIVE_DIR>/trn_ranked_item_stock/month=2025-01/site=%E6%A5%BD%E5%A4%A9/part-<最小id>-<最大id>.parquet
+
+安全性:
+ファイルを一時ファイルに書いてから rename し、書き込みが完了したバッチだけを削除する。
+削除前に止まった場合は次回同じ行が同じファイル名で書き直されるため、重複しない
+（読み込み側でも id で重複を除く）。
+
+使い方:
+python src/common/stock_archive.py --archive --days 90
+python src/common/stock_archive.py --archive --dry-run
+"""
+
+import datetime
+import os
+import urllib.parse
+
+from metrics import counter
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR") or os.path.abspath(os.path.join(BASE_DIR, "..", "archive"))
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+HOT_TABLE = "trn_ranked_item_stock"
+# 削除時に in_ フィルタ 1 回で指定する id 数（URL 長の制限に収まるように）
+DELETE_CHUNK_SIZE = 200
+# Supabase（PostgREST）の 1 リクエストあたりの最大件数
+PAGE_SIZE = 1000
+
+# Parquet に保存する列の型（ホットテーブルのカラムに合わせる）
+ARCHIVE_COLUMNS = [
+    ("id", "int64"),
+    ("product_id", "string"),
+    ("product_name", "string"),
+    ("description", "string"),
+    ("site", "string"),
+    ("seller_site_id", "string"),
+    ("seller_site_name", "string"),
+    ("stock_status", "bool"),
+    ("price", "int64"),
+    ("jan_code", "string"),
+    ("ranking_genre_id", "string"),
+    ("ranking_rank", "int64"),
+    ("content_hash", "string"),
+    ("insert_time", "timestamp"),
+    ("update_time", "timestamp"),
+]
+
+
+def _table_dir():
+    return os.path.join(ARCHIVE_DIR, HOT_TABLE)
+
+
+def _schema():
+    import pyarrow as pa
+
+    types = {
+        "int64": pa.int64(),
+        "string": pa.string(),
+        "bool": pa.bool_(),
+        "timestamp": pa.timestamp("us"),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in ARCHIVE_COLUMNS])
+
+
+def _to_datetime(value):
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+
+
+def _partition_path(month, site):
+    return os.path.join(
+        _table_dir(),
+        f"month={month}",
+        f"site={urllib.parse.quote(site or '', safe='')}",
+    )
+
+
+def write_partition(rows, month, site):
+    """1 パーティション分の行を zstd 圧縮の Parquet に書き、ファイルパスを返す"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _schema()
+    columns = {name: [] for name in schema.names}
+    for row in rows:
+        for name, kind in ARCHIVE_COLUMNS:
+            value = row.get(name)
+            columns[name].append(_to_datetime(value) if kind == "timestamp" else value)
+    table = pa.table(columns, schema=schema)
+
+    directory = _partition_path(month, site)
+    os.makedirs(directory, exist_ok=True)
+    ids = [row["id"] for row in rows]
+    path = os.path.join(directory, f"part-{min(ids)}-{max(ids)}.parquet")
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+    return path
+
+
+def _fetch_old_batch(client, cutoff, batch_size):
+    response = (
+        client.table(HOT_TABLE)
+        .select("*")
+        .lt("update_time", cutoff.isoformat())
+        .order("id")
+        .limit(batch_size)
+        .execute()
+    )
+    return response.data or []
+
+
+def _delete_ids(client, ids):
+    for i in range(0, len(ids), DELETE_CHUNK_SIZE):
+        client.table(HOT_TABLE).delete().in_("id", ids[i:i + DELETE_CHUNK_SIZE]).execute()
+
+
+def archive_old_rows(client=None, max_age_days=None, batch_size=None, dry_run=False):
+    """
+    max_age_days より古い行をアーカイブしてホットテーブルから削除し、移した件数を返す。
+    dry_run では対象件数の確認のみ（最初のバッチだけ読み、書き込み・削除はしない）。
+    """
+    if client is None:
+        from supabase_client import get_supabase
+        client = get_supabase()
+    max_age_days = ARCHIVE_AFTER_DAYS if max_age_days is None else max_age_days
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+
+    archived = 0
+    while True:
+        rows = _fetch_old_batch(client, cutoff, batch_size)
+        if not rows:
+            break
+        if dry_run:
+            print(f"🔍 {cutoff.isoformat()} より古い行があります（最初のバッチ {len(rows)}件）")
+            return len(rows)
+
+        partitions = {}
+        for row in rows:
+            month = _to_datetime(row["update_time"]).strftime("%Y-%m")
+            partitions.setdefault((month, row.get("site")), []).append(row)
+        for (month, site), part_rows in partitions.items():
+            write_partition(part_rows, month, site)
+
+        # ファイルの書き込みがすべて終わってから削除する
+        _delete_ids(client, [row["id"] for row in rows])
+        archived += len(rows)
+        counter("stock_archived_rows_total", "アーカイブに移した行数").inc(len(rows), table=HOT_TABLE)
+        print(f"📦 アーカイブ: {archived}件（{len(partitions)}パーティション）")
+
+    print(f"✅ {cutoff.isoformat()} より古い {archived}件をアーカイブしました")
+    return archived
+
+
+def read_archive(start, end, columns=None, sites=None):
+    """[start, end) のアーカイブを DataFrame で返す（該当する月のパーティションだけを読む）"""
+    import pandas as pd
+    import pyarrow.dataset as ds
+
+    start, end = _to_datetime(start), _to_datetime(end)
+    names = columns or [name for name, _ in ARCHIVE_COLUMNS]
+    if not os.path.isdir(_table_dir()):
+        return pd.DataFrame(columns=names)
+
+    dataset = ds.dataset(_table_dir(), format="parquet", partitioning="hive", schema=_schema_with_partitions())
+    start_month, end_month = start.strftime("%Y-%m"), end.strftime("%Y-%m")
+    condition = (
+        (ds.field("month") >= start_month) & (ds.field("month") <= end_month)
+        & (ds.field("update_time") >= start) & (ds.field("update_time") < end)
+    )
+    if sites:
+        condition = condition & ds.field("site").isin(list(sites))
+    table = dataset.to_table(columns=names, filter=condition)
+    return table.to_pandas()
+
+
+def _schema_with_partitions():
+    import pyarrow as pa
+
+    # site はファイル内の列と同じ値なので、パーティション側は month だけを追加する
+    return _schema().append(pa.field("month", pa.string()))
+
+
+def _fetch_hot(client, start, end, columns):
+    records = []
+    offset = 0
+    while True:
+        response = (
+            client.table(HOT_TABLE)
+            .select(", ".join(columns))
+            .gte("update_time", start.isoformat())
+            .lt("update_time", end.isoformat())
+            .order("id")
+            .range(offset, offset + PAGE_SIZE - 1)
+            .execute()
+        )
+        if not response.data:
+            break
+        records.extend(response.data)
+        offset += PAGE_SIZE
+    counter("stock_db_rows_fetched_total", "DBから取得した行数").inc(len(records), table=HOT_TABLE)
+    return records
+
+
+def load_history(client, start, end, columns=None, sites=None):
+    """[start, end) の在庫スナップショットを、アーカイブとホットテーブルを合わせて返す"""
+    from stock_loader import to_compact_frame
+
+    start, end = _to_datetime(start), _to_datetime(end)
+    columns = list(columns or [name for name, _ in ARCHIVE_COLUMNS])
+    # 重複除去のため id は常に読む
+    read_columns = columns if "id" in columns else ["id"] + columns
+
+    records = {}
+    for row in read_archive(start, end, columns=read_columns, sites=sites).to_dict("records"):
+        records[row["id"]] = row
+    for row in _fetch_hot(client, start, end, read_columns):
+        if sites and row.get("site") not in sites:
+            continue
+        # アーカイブ後の削除前に止まった行は両方にあるので id で重複を除く
+        records.setdefault(row["id"], row)
+
+    df = to_compact_frame(list(records.values()), read_columns)
+    df = df.sort_values("update_time", kind="stable")
+    return df[columns].reset_index(drop=True)
+
+
+def _read_archive_records(columns, product_ids=None):
+    """アーカイブ全体を、ホットテーブルの行と同じ形（日時は ISO8601 文字列）の dict のリストで返す"""
+    if not os.path.isdir(_table_dir()):
+        return []
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(_table_dir(), format="parquet", partitioning="hive", schema=_schema_with_partitions())
+    condition = ds.field("product_id").isin(sorted(product_ids)) if product_ids is not None else None
+    rows = dataset.to_table(columns=columns, filter=condition).to_pylist()
+    for row in rows:
+        for name, value in row.items():
+            if isinstance(value, datetime.datetime):
+                row[name] = value.isoformat()
+    return rows
+
+
+def fetch_stock_records(client, columns, product_ids=None):
+    """
+    trn_ranked_item_stock の全期間の行を、アーカイブとホットテーブルを合わせて返す
+    （stock_loader.fetch_records の代わりに、全件から作り直す処理・集計で使う）。
+    アーカイブ済みの期間を読み落とさないように、期間を指定しない全件読み込みはこちらを使う。
+    """
+    from stock_loader import fetch_records
+
+    columns = list(columns)
+    # 重複除去のため id は常に読む
+    read_columns = columns if "id" in columns else ["id"] + columns
+
+    records = {row["id"]: row for row in _read_archive_records(read_columns, product_ids)}
+    archived = len(records)
+    for row in fetch_records(client, HOT_TABLE, read_columns, product_ids=product_ids):
+        # アーカイブ後の削除前に止まった行は両方にあるので id で重複を除く
+        records.setdefault(row["id"], row)
+    if archived:
+        counter("stock_archive_rows_read_total", "アーカイブから読んだ行数").inc(archived, table=HOT_TABLE)
+
+    if read_columns is columns:
+        return list(records.values())
+    return [{name: row.get(name) for name in columns} for row in records.values()]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="古い在庫スナップショットを Parquet にアーカイブする")
+    parser.add_argument("--archive", action="store_true", help="アーカイブを実行する")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="これより古い行を対象にする（日数）")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="対象があるかの確認のみ")
+    args = parser.parse_args()
+
+    if args.archive:
+        archive_old_rows(max_age_days=args.days, batch_size=args.batch_size, dry_run=args.dry_run)
+    else:
+        parser.print_help()
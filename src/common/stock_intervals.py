@@ -0,0 +1,289 @@
+"""
+スクリプト名: stock_intervals.py
+
+目的:
+在庫スナップショット（trn_ranked_item_stock）を、在庫状態が続いた区間ごとの 1 行に
+ランレングス圧縮した trn_stock_intervals を扱う。
+
+- 書き込み側: IntervalMaintainer がスナップショットを受け取るたびに、
+  同じ状態なら開いている区間を延長し、状態が変わったら区間を閉じて新しい区間を開く。
+- 読み込み側: IntervalIndex が商品ごとに区間の開始時刻を並べて保持し、
+  「時刻 T の在庫状態」「期間内の在庫切れ区間」を二分探索で答える。
+- 既存データからの作り直し: python src/common/stock_intervals.py --rebuild
+
+区間の意味:
+start_time から次の区間の start_time まで（最後の区間は現在まで）その状態が続いたとみなす。
+end_time は区間内で最後に観測した時刻で、snapshot_count は区間内のスナップショット数。
+
+有効化:
+環境変数 STOCK_INTERVALS_ENABLED=1（db_init.sql の trn_stock_intervals 作成後に有効にする）
+"""
+
+import bisect
+import datetime
+import os
+import threading
+
+from metrics import counter
+
+INTERVAL_TABLE = "trn_stock_intervals"
+INTERVAL_COLUMNS = [
+    "site", "seller_site_id", "product_id", "stock_status",
+    "start_time", "end_time", "snapshot_count", "is_open",
+]
+CONFLICT_COLUMNS = "site,seller_site_id,product_id,start_time"
+
+# Supabase（PostgREST）の 1 リクエストあたりの最大件数
+PAGE_SIZE = 1000
+
+
+def is_enabled():
+    return os.getenv("STOCK_INTERVALS_ENABLED", "0") == "1"
+
+
+def _to_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+def interval_key(row):
+    return (row.get("site"), row.get("seller_site_id") or "", row.get("product_id"))
+
+
+def _snapshot_status(row):
+    return bool(row.get("stock_status"))
+
+
+def _to_record(row):
+    return {**row, "start_time": row["start_time"].isoformat(), "end_time": row["end_time"].isoformat()}
+
+
+def build_intervals(snapshots):
+    """スナップショットの一括変換（時刻順でなくてもよい）。区間の dict のリストを返す"""
+    maintainer = IntervalMaintainer(client_getter=None)
+    ordered = sorted(snapshots, key=lambda r: (interval_key(r), _to_datetime(r["update_time"])))
+    maintainer.observe_many(ordered)
+    return maintainer.take_dirty()
+
+
+class IntervalMaintainer:
+    """スナップショットを受けて区間を延長・分割し、変更のあった区間をまとめて upsert する"""
+
+    def __init__(self, client_getter):
+        self._client_getter = client_getter
+        self._open = {}
+        self._dirty = {}
+        self._loaded = client_getter is None
+        self._lock = threading.Lock()
+        self.skipped_out_of_order = 0
+
+    def _load_open_intervals(self):
+        """DB 上の開いている区間（商品ごとに最新の 1 件）を読み込む"""
+        client = self._client_getter()
+        offset = 0
+        while True:
+            response = (
+                client.table(INTERVAL_TABLE)
+                .select(", ".join(INTERVAL_COLUMNS))
+                .eq("is_open", True)
+                .range(offset, offset + PAGE_SIZE - 1)
+                .execute()
+            )
+            if not response.data:
+                break
+            for row in response.data:
+                row["start_time"] = _to_datetime(row["start_time"])
+                row["end_time"] = _to_datetime(row["end_time"])
+                self._open[interval_key(row)] = row
+            offset += PAGE_SIZE
+        self._loaded = True
+
+    def observe(self, snapshot):
+        key = interval_key(snapshot)
+        observed_at = _to_datetime(snapshot["update_time"])
+        status = _snapshot_status(snapshot)
+        current = self._open.get(key)
+
+        if current is not None and observed_at < current["end_time"]:
+            # 既に反映済みの時刻より古いスナップショットは区間を壊さないよう捨てる
+            self.skipped_out_of_order += 1
+            return
+
+        if current is not None and current["stock_status"] == status:
+            current["end_time"] = observed_at
+            current["snapshot_count"] += 1
+            self._dirty[(key, current["start_time"])] = current
+            return
+
+        if current is not None:
+            current["is_open"] = False
+            self._dirty[(key, current["start_time"])] = current
+
+        new_interval = {
+            "site": key[0],
+            "seller_site_id": key[1],
+            "product_id": key[2],
+            "stock_status": status,
+            "start_time": observed_at,
+            "end_time": observed_at,
+            "snapshot_count": 1,
+            "is_open": True,
+        }
+        self._open[key] = new_interval
+        self._dirty[(key, observed_at)] = new_interval
+
+    def observe_many(self, snapshots):
+        with self._lock:
+            if not self._loaded:
+                self._load_open_intervals()
+            for snapshot in snapshots:
+                self.observe(snapshot)
+
+    def take_dirty(self):
+        """変更のあった区間を DB 書き込み用の dict にして返し、変更記録を空にする"""
+        dirty, self._dirty = list(self._dirty.values()), {}
+        return [_to_record(row) for row in dirty]
+
+    def flush(self):
+        """変更のあった区間を upsert し、件数を返す。失敗した分は変更記録に戻し、次回の flush で再送する"""
+        with self._lock:
+            dirty, self._dirty = list(self._dirty.items()), {}
+            rows = [_to_record(row) for _, row in dirty]
+        if not rows:
+            return 0
+        written = 0
+        try:
+            client = self._client_getter()
+            for i in range(0, len(rows), PAGE_SIZE):
+                client.table(INTERVAL_TABLE).upsert(rows[i:i + PAGE_SIZE], on_conflict=CONFLICT_COLUMNS).execute()
+                written = min(i + PAGE_SIZE, len(rows))
+        except Exception:
+            with self._lock:
+                # 失敗後に同じ区間が更新されていれば、区間の dict は共有なので新しい値のまま送られる
+                for dirty_key, row in dirty[written:]:
+                    self._dirty.setdefault(dirty_key, row)
+            raise
+        finally:
+            counter("stock_db_rows_written_total", "DBに書き込んだ行数").inc(written, table=INTERVAL_TABLE)
+        return written
+
+
+class IntervalIndex:
+    """商品ごとの区間を開始時刻順に並べ、二分探索で状態を引く"""
+
+    def __init__(self, intervals):
+        grouped = {}
+        for row in intervals:
+            row = dict(row)
+            row["start_time"] = _to_datetime(row["start_time"])
+            row["end_time"] = _to_datetime(row["end_time"])
+            grouped.setdefault(interval_key(row), []).append(row)
+
+        self._intervals = {}
+        self._starts = {}
+        for key, rows in grouped.items():
+            rows.sort(key=lambda r: r["start_time"])
+            self._intervals[key] = rows
+            self._starts[key] = [r["start_time"] for r in rows]
+
+    def keys(self):
+        return self._intervals.keys()
+
+    def state_at(self, key, when):
+        """時刻 when の在庫状態（True/False）。最初の観測より前なら None"""
+        starts = self._starts.get(key)
+        if not starts:
+            return None
+        i = bisect.bisect_right(starts, _to_datetime(when)) - 1
+        if i < 0:
+            return None
+        return self._intervals[key][i]["stock_status"]
+
+    def intervals_between(self, key, start, end):
+        """[start, end) と重なる区間を (区間, 実効終了時刻) の形で返す。最後の区間の実効終了時刻は None"""
+        rows = self._intervals.get(key, [])
+        starts = self._starts.get(key, [])
+        start, end = _to_datetime(start), _to_datetime(end)
+        i = max(bisect.bisect_right(starts, start) - 1, 0)
+        while i < len(rows) and rows[i]["start_time"] < end:
+            effective_end = rows[i + 1]["start_time"] if i + 1 < len(rows) else None
+            if effective_end is None or effective_end > start:
+                yield rows[i], effective_end
+            i += 1
+
+    def stockouts(self, start, end, key=None):
+        """期間 [start, end) に重なる在庫切れ区間。key を省略すると全商品が対象"""
+        keys = [key] if key is not None else list(self._intervals)
+        result = []
+        for k in keys:
+            for row, effective_end in self.intervals_between(k, start, end):
+                if not row["stock_status"]:
+                    result.append({**row, "effective_end": effective_end})
+        return result
+
+
+def load_interval_index(client, product_ids=None):
+    """trn_stock_intervals を読み込んで IntervalIndex を作る（product_ids で絞り込み可）"""
+    rows = []
+    offset = 0
+    while True:
+        query = client.table(INTERVAL_TABLE).select(", ".join(INTERVAL_COLUMNS))
+        if product_ids:
+            query = query.in_("product_id", list(product_ids))
+        response = query.order("start_time").range(offset, offset + PAGE_SIZE - 1).execute()
+        if not response.data:
+            break
+        rows.extend(response.data)
+        offset += PAGE_SIZE
+    counter("stock_db_rows_fetched_total", "DBから取得した行数").inc(len(rows), table=INTERVAL_TABLE)
+    return IntervalIndex(rows)
+
+
+_maintainer = None
+_maintainer_lock = threading.Lock()
+
+
+def get_maintainer():
+    """プロセス内で共有する IntervalMaintainer を返す"""
+    global _maintainer
+    with _maintainer_lock:
+        if _maintainer is None:
+            from supabase_client import get_supabase
+            _maintainer = IntervalMaintainer(get_supabase)
+        return _maintainer
+
+
+def rebuild_intervals():
+    """trn_ranked_item_stock 全体（アーカイブ済みの期間を含む）から区間を作り直す（初回の移行用）"""
+    from stock_archive import fetch_stock_records
+    from stock_loader import delete_stale_rows
+    from supabase_client import get_supabase
+
+    client = get_supabase()
+    snapshots = fetch_stock_records(
+        client, ["site", "seller_site_id", "product_id", "stock_status", "update_time"]
+    )
+    intervals = build_intervals(snapshots)
+    # 先に新しい区間を書き、書き終えてから作り直しに含まれない古い区間だけを消す
+    for i in range(0, len(intervals), PAGE_SIZE):
+        client.table(INTERVAL_TABLE).upsert(intervals[i:i + PAGE_SIZE], on_conflict=CONFLICT_COLUMNS).execute()
+
+    def normalize(row):
+        return interval_key(row) + (_to_datetime(row["start_time"]),)
+
+    deleted = delete_stale_rows(
+        client, INTERVAL_TABLE, ["site", "seller_site_id", "product_id", "start_time"],
+        {normalize(row) for row in intervals}, normalize,
+    )
+    print(f"✅ {len(snapshots)}件のスナップショットを {len(intervals)}件の区間に変換しました（古い区間 {deleted}件を削除）")
+    return len(intervals)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if "--rebuild" in sys.argv[1:]:
+        rebuild_intervals()
+    else:
+        print("使い方: python src/common/stock_intervals.py --rebuild")
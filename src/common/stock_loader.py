@@ -0,0 +1,142 @@
+"""
+スクリプト名: stock_loader.py
+
+目的:
+予測系モジュール（pretreatment / train_arima / web/app）で共通利用する在庫データのローダー。
+必要なカラムだけを Supabase から取得（select("*") を使わない）し、
+ID 系は category、stock_status は int8、日時は明示フォーマットで一度だけ変換した
+コンパクトな DataFrame を返す。
+"""
+
+import pandas as pd
+
+import content_store
+from metrics import counter
+
+# Supabase（PostgREST）の 1 リクエストあたりの最大取得件数
+DEFAULT_BATCH_SIZE = 1000
+# product_id で絞り込むとき、in_ フィルタ 1 回で指定する件数（URL 長の制限に収まるように）
+ID_CHUNK_SIZE = 100
+
+# 日時カラムの書式（Supabase は ISO8601 で返す）
+TIMESTAMP_FORMAT = "ISO8601"
+
+# category に変換する ID 系カラム
+CATEGORY_COLUMNS = ("site", "seller_site", "seller_site_id", "seller_site_name", "product_id", "jan_code", "content_hash")
+
+# 日時として変換するカラム
+TIMESTAMP_COLUMNS = ("insert_time", "update_time", "stockout_time", "restock_time")
+
+# trn_ranked_item_stock から前処理に必要なカラム
+# （product_name / description はモデルでは使わないが、trn_ranked_item_stock_pretreatment にそのまま引き継ぐ）
+RAW_STOCK_COLUMNS = [
+    "id",
+    "product_id",
+    "product_name",
+    "description",
+    "site",
+    "seller_site_id",
+    "seller_site_name",
+    "stock_status",
+    "price",
+    "jan_code",
+    "insert_time",
+    "update_time",
+]
+
+
+def raw_stock_columns():
+    """前処理で読むカラム。content_hash は移行前の DB には存在しないため、content_store が有効なときだけ加える"""
+    if content_store.is_enabled():
+        return RAW_STOCK_COLUMNS + ["content_hash"]
+    return RAW_STOCK_COLUMNS
+
+
+# trn_ranked_item_stock_pretreatment からモデル学習に必要なカラム
+PRETREATMENT_COLUMNS = [
+    "site",
+    "seller_site",
+    "product_id",
+    "stock_status",
+    "update_time",
+    "stockout_time",
+    "restock_time",
+]
+
+
+def fetch_records(client, table, columns, batch_size=DEFAULT_BATCH_SIZE, product_ids=None, order_by=("id",)):
+    """
+    指定カラムだけをページングしながら全件取得する（product_ids を渡すとその商品の行だけ）。
+    range() でのページングが行を飛ばしたり重複させたりしないよう、一意になるカラム（order_by）で並べる。
+    id を持たないテーブルは主キーのカラムを order_by に渡す。
+    """
+    select_clause = ", ".join(columns)
+    records = []
+
+    product_ids = sorted(product_ids) if product_ids is not None else None
+    id_chunks = [product_ids[i:i + ID_CHUNK_SIZE] for i in range(0, len(product_ids), ID_CHUNK_SIZE)] if product_ids is not None else [None]
+    for chunk in id_chunks:
+        offset = 0
+        while True:
+            query = client.table(table).select(select_clause)
+            if chunk is not None:
+                query = query.in_("product_id", chunk)
+            for column in order_by:
+                query = query.order(column)
+            response = query.range(offset, offset + batch_size - 1).execute()
+            if not response.data:
+                break
+
+            records.extend(response.data)
+            offset += batch_size
+
+    counter("stock_db_rows_fetched_total", "DBから取得した行数").inc(len(records), table=table)
+    return records
+
+
+def delete_stale_rows(client, table, key_columns, keep, normalize):
+    """
+    table の行のうち normalize(row) が keep に含まれないものを削除し、件数を返す。
+    作り直し（--rebuild）で新しい行を upsert した後に、古い行だけを消すために使う
+    （先に全削除すると、upsert の途中で失敗したときにテーブルが空のまま残る）。
+    削除は key_columns の最後以外が同じ行ごとに、最後のカラムの in_ でまとめて行う。
+    key_columns はテーブルの主キー（読み込みの並び順にも使う）。
+    """
+    stale = {}
+    for row in fetch_records(client, table, key_columns, order_by=key_columns):
+        if normalize(row) not in keep:
+            stale.setdefault(tuple(row[c] for c in key_columns[:-1]), []).append(row[key_columns[-1]])
+
+    for prefix, values in stale.items():
+        for i in range(0, len(values), ID_CHUNK_SIZE):
+            query = client.table(table).delete()
+            for column, value in zip(key_columns[:-1], prefix):
+                query = query.eq(column, value)
+            query.in_(key_columns[-1], values[i:i + ID_CHUNK_SIZE]).execute()
+    return sum(len(values) for values in stale.values())
+
+
+def to_compact_frame(records, columns):
+    """レコードのリストを省メモリな dtype の DataFrame に変換する"""
+    df = pd.DataFrame.from_records(records, columns=columns)
+
+    for col in df.columns:
+        if col in CATEGORY_COLUMNS:
+            df[col] = df[col].astype("category")
+        elif col in TIMESTAMP_COLUMNS:
+            df[col] = pd.to_datetime(df[col], format=TIMESTAMP_FORMAT, errors="coerce")
+        elif col == "stock_status":
+            # 真偽値・数値・文字列が混在しても 0/1 の int8 に揃える（無効な値は 0）
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype("int8")
+        elif col == "price":
+            df[col] = pd.to_numeric(df[col], errors="coerce", downcast="integer")
+
+    return df
+
+
+def load_stock_frame(client, table, columns, batch_size=DEFAULT_BATCH_SIZE, product_ids=None):
+    """指定テーブルから必要カラムのみを取得し、コンパクトな DataFrame として返す"""
+    records = fetch_records(client, table, columns, batch_size=batch_size, product_ids=product_ids)
+    if not records:
+        return pd.DataFrame(columns=columns)
+    return to_compact_frame(records, columns)
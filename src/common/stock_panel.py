@@ -0,0 +1,107 @@
+"""
+スクリプト名: stock_panel.py
+
+目的:
+日次など共通の時刻グリッドで系列を扱うモジュール（backtest / web/app）で共通利用する、
+商品 × 時刻の 2 次元配列（パネル）を作る。
+train_arima（商品ごとに infer_freq で間隔を決める）と train_lstm（実際の観測時刻のまま学習する）は
+系列の時刻の粒度が変わってしまうため、パネルを使わずに商品ごとの group をそのまま使う。
+
+従来は各モジュールが商品ごとに infer_freq / asfreq / resample を呼んで時刻を揃えていたが、
+ここで全商品分を一度に処理する。
+  1. 各行を (商品の行番号, 時刻グリッドの列番号) に変換する
+  2. 同じマスに入る観測を bincount で平均する
+  3. 観測のないマスは同じ商品の直前の値で埋める（列方向の累積最大で埋め元の列を求める）
+
+パネルの各行は keys の同じ行番号の (site, seller_site, product_id) に対応する。
+商品ごとに最初と最後の観測がある列（first / last）を持ち、series() / frame() はその範囲を返す。
+"""
+
+import numpy as np
+import pandas as pd
+
+GROUP_KEYS = ["site", "seller_site", "product_id"]
+DEFAULT_FREQ = "D"
+
+
+class StockPanel:
+    def __init__(self, values, observed, times, keys, first, last):
+        self.values = values        # (商品数, 時刻数) の float64。最初の観測より前は NaN
+        self.observed = observed    # 実際に観測があったマス（前方埋めした値は False）
+        self.times = times          # 時刻グリッド（DatetimeIndex）
+        self.keys = keys            # 行番号に対応する (site, seller_site, product_id) の DataFrame
+        self.first = first          # 商品ごとの最初の観測の列番号
+        self.last = last            # 商品ごとの最後の観測の列番号
+        self._rows = {key: i for i, key in enumerate(keys.itertuples(index=False, name=None))}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def row(self, key):
+        """(site, seller_site, product_id) → 行番号（O(1)）"""
+        return self._rows[tuple(key)]
+
+    def items(self):
+        """(行番号, (site, seller_site, product_id)) を行番号順に返す"""
+        return enumerate(self.keys.itertuples(index=False, name=None))
+
+    def _resolve(self, key_or_row):
+        return key_or_row if isinstance(key_or_row, (int, np.integer)) else self.row(key_or_row)
+
+    def slice(self, key_or_row):
+        """その商品の最初から最後の観測までの値（パネルの view なのでコピーしない）"""
+        i = self._resolve(key_or_row)
+        return self.values[i, self.first[i]:self.last[i] + 1]
+
+    def series(self, key_or_row):
+        """slice() を時刻 index 付きの Series にしたもの（freq 付き）"""
+        i = self._resolve(key_or_row)
+        return pd.Series(self.slice(i), index=self.times[self.first[i]:self.last[i] + 1], name="stock_status")
+
+    def frame(self, key_or_row):
+        """従来の商品ごとの group と同じ形（update_time が index、stock_status 列）の DataFrame"""
+        series = self.series(key_or_row)
+        return series.to_frame().rename_axis("update_time")
+
+
+def build_panel(df, freq=DEFAULT_FREQ, value_column="stock_status", time_column=None):
+    """
+    在庫データ（update_time が index、または time_column 列）から StockPanel を作る。
+    同じマスに複数の観測があれば平均する（0/1 の stock_status なら在庫あり率になる）。
+    """
+    times = pd.DatetimeIndex(df[time_column] if time_column else df.index)
+    valid = ~times.isna()
+    if not valid.all():
+        df, times = df[valid], times[valid]
+    if len(df) == 0:
+        return StockPanel(
+            np.empty((0, 0)), np.empty((0, 0), dtype=bool), pd.DatetimeIndex([], freq=freq),
+            pd.DataFrame(columns=GROUP_KEYS), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+        )
+
+    # ngroup の番号はキーの昇順なので、番号ごとの最初の行を並べると行番号順のキー一覧になる
+    codes = df.groupby(GROUP_KEYS, observed=True, sort=True).ngroup().to_numpy()
+    keys = df[GROUP_KEYS].iloc[np.unique(codes, return_index=True)[1]].reset_index(drop=True)
+
+    buckets = times.floor(freq)
+    grid = pd.date_range(buckets.min(), buckets.max(), freq=freq)
+    columns = grid.get_indexer(buckets)
+
+    n_rows, n_cols = len(keys), len(grid)
+    flat = codes * n_cols + columns
+    values = df[value_column].astype(float).to_numpy()
+    counts = np.bincount(flat, minlength=n_rows * n_cols).reshape(n_rows, n_cols)
+    sums = np.bincount(flat, weights=values, minlength=n_rows * n_cols).reshape(n_rows, n_cols)
+
+    observed = counts > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        panel = np.where(observed, sums / np.maximum(counts, 1), np.nan)
+
+    # 観測のないマスは、同じ行で直前に観測があった列の値で埋める
+    source = np.where(observed, np.arange(n_cols), 0)
+    np.maximum.accumulate(source, axis=1, out=source)
+    panel = panel[np.arange(n_rows)[:, None], source]
+
+    first = observed.argmax(axis=1)
+    last = n_cols - 1 - observed[:, ::-1].argmax(axis=1)
+    return StockPanel(panel, observed, grid, keys, first, last)
@@ -0,0 +1,368 @@
+"""
+スクリプト名: stock_rollup.py
+
+目的:
+在庫スナップショットを (site, seller_site_id, product_id) × 時間バケットで集計した
+ロールアップテーブル（1 時間単位: trn_stock_rollup_hourly / 1 日単位: trn_stock_rollup_daily）を扱う。
+予測モジュールやダッシュボードは生のスナップショットの代わりにロールアップを読むことで、
+入力サイズが取得頻度ではなく対象期間だけで決まるようになる。
+
+集計項目:
+sample_count（スナップショット数）、in_stock_count / in_stock_ratio（在庫あり率）、
+transition_count（在庫状態の切り替わり回数）、min_price / max_price / last_price、
+last_status / last_time（バケット内で最後に観測した状態と時刻）
+
+- 書き込み側: RollupMaintainer がスナップショットを受けるたびに該当バケットを更新し、変更分だけ upsert する
+- 読み込み側: load_rollup_frame() で必要な期間のロールアップを DataFrame として取得する。
+  fetch_rollup_data() は train_arima / web/app の入力の形（update_time の索引つき）にして返す
+- 既存データからの作り直し: python src/common/stock_rollup.py --rebuild
+
+有効化:
+書き込みは環境変数 STOCK_ROLLUP_ENABLED=1、
+予測・ダッシュボードの入力切り替えは STOCK_INPUT_SOURCE=rollup（既定は raw）
+"""
+
+import datetime
+import os
+import threading
+
+from metrics import counter
+
+ROLLUP_TABLES = {
+    "hourly": "trn_stock_rollup_hourly",
+    "daily": "trn_stock_rollup_daily",
+}
+ROLLUP_COLUMNS = [
+    "site", "seller_site_id", "product_id", "bucket_start",
+    "sample_count", "in_stock_count", "in_stock_ratio", "transition_count",
+    "min_price", "max_price", "last_price", "last_status", "last_time",
+]
+CONFLICT_COLUMNS = "site,seller_site_id,product_id,bucket_start"
+
+# Supabase（PostgREST）の 1 リクエストあたりの最大件数
+PAGE_SIZE = 1000
+# in_ フィルタ 1 回あたりの商品 ID 数（URL 長の制限に収まるように）
+ID_CHUNK_SIZE = 100
+
+# 予測・ダッシュボードがロールアップを読むときの既定の対象期間
+ROLLUP_HORIZON_DAYS = int(os.getenv("ROLLUP_HORIZON_DAYS", "180"))
+
+
+def is_enabled():
+    return os.getenv("STOCK_ROLLUP_ENABLED", "0") == "1"
+
+
+def use_rollup_input():
+    """予測・ダッシュボードの入力をロールアップにするか"""
+    return os.getenv("STOCK_INPUT_SOURCE", "raw") == "rollup"
+
+
+def _to_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+def bucket_start(when, grain):
+    if grain == "hourly":
+        return when.replace(minute=0, second=0, microsecond=0)
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_key(row):
+    return (row.get("site"), row.get("seller_site_id") or "", row.get("product_id"))
+
+
+def _new_bucket(key, start):
+    return {
+        "site": key[0],
+        "seller_site_id": key[1],
+        "product_id": key[2],
+        "bucket_start": start,
+        "sample_count": 0,
+        "in_stock_count": 0,
+        "in_stock_ratio": 0.0,
+        "transition_count": 0,
+        "min_price": None,
+        "max_price": None,
+        "last_price": None,
+        "last_status": None,
+        "last_time": None,
+    }
+
+
+class RollupMaintainer:
+    """スナップショットを受けて hourly / daily のバケットを更新する"""
+
+    def __init__(self, client_getter):
+        self._client_getter = client_getter
+        self._buckets = {grain: {} for grain in ROLLUP_TABLES}
+        self._dirty = {grain: set() for grain in ROLLUP_TABLES}
+        # 商品ごとの最後の観測（バケットをまたぐ切り替わりの判定用）
+        self._last = {}
+        self._known_keys = set()
+        self._pruned_before = None
+        self._lock = threading.Lock()
+        # flush 同士を直列にする（送信中のバケットを別の flush が prune しないように）
+        self._flush_lock = threading.Lock()
+
+    def seed_known_keys(self, keys):
+        """keys の商品は DB の既存ロールアップを読み込まない（全件を作り直すときに使う）"""
+        with self._lock:
+            self._known_keys |= set(keys)
+
+    def _load_existing(self, snapshots):
+        """まだ見ていない商品について、今回のバケット以降の既存ロールアップを読み込む"""
+        new_keys = {rollup_key(s) for s in snapshots} - self._known_keys
+        if not new_keys or self._client_getter is None:
+            self._known_keys |= new_keys
+            return
+
+        earliest = min(_to_datetime(s["update_time"]) for s in snapshots if rollup_key(s) in new_keys)
+        product_ids = sorted({key[2] for key in new_keys})
+        client = self._client_getter()
+
+        for grain, table in ROLLUP_TABLES.items():
+            # 直前のバケットも読み、バケットをまたぐ切り替わりを数えられるようにする
+            since = bucket_start(earliest, grain) - (datetime.timedelta(hours=1) if grain == "hourly" else datetime.timedelta(days=1))
+            for i in range(0, len(product_ids), ID_CHUNK_SIZE):
+                offset = 0
+                while True:
+                    response = (
+                        client.table(table)
+                        .select(", ".join(ROLLUP_COLUMNS))
+                        .in_("product_id", product_ids[i:i + ID_CHUNK_SIZE])
+                        .gte("bucket_start", since.isoformat())
+                        .range(offset, offset + PAGE_SIZE - 1)
+                        .execute()
+                    )
+                    if not response.data:
+                        break
+                    for row in response.data:
+                        key = rollup_key(row)
+                        if key not in new_keys:
+                            continue
+                        row["bucket_start"] = _to_datetime(row["bucket_start"])
+                        row["last_time"] = _to_datetime(row["last_time"]) if row.get("last_time") else None
+                        if (key, row["bucket_start"]) in self._dirty[grain]:
+                            # 未保存の更新があるバケットは DB の値で上書きしない
+                            continue
+                        self._buckets[grain][(key, row["bucket_start"])] = row
+                        if grain == "hourly" and row["last_time"] is not None:
+                            last = self._last.get(key)
+                            if last is None or row["last_time"] > last[0]:
+                                self._last[key] = (row["last_time"], row["last_status"])
+                    offset += PAGE_SIZE
+
+        self._known_keys |= new_keys
+
+    def observe(self, snapshot):
+        key = rollup_key(snapshot)
+        observed_at = _to_datetime(snapshot["update_time"])
+        status = bool(snapshot.get("stock_status"))
+        price = snapshot.get("price")
+
+        last = self._last.get(key)
+        in_order = last is None or observed_at >= last[0]
+        # 時刻順に届いたものだけで切り替わりを数える（遅れて届いたものは件数・価格のみ反映）
+        transition = 1 if in_order and last is not None and last[1] is not None and last[1] != status else 0
+        if in_order:
+            self._last[key] = (observed_at, status)
+
+        for grain in ROLLUP_TABLES:
+            start = bucket_start(observed_at, grain)
+            bucket = self._buckets[grain].setdefault((key, start), _new_bucket(key, start))
+            bucket["sample_count"] += 1
+            bucket["in_stock_count"] += int(status)
+            bucket["in_stock_ratio"] = bucket["in_stock_count"] / bucket["sample_count"]
+            bucket["transition_count"] += transition
+            if price is not None:
+                bucket["min_price"] = price if bucket["min_price"] is None else min(bucket["min_price"], price)
+                bucket["max_price"] = price if bucket["max_price"] is None else max(bucket["max_price"], price)
+            if bucket["last_time"] is None or observed_at >= bucket["last_time"]:
+                bucket["last_time"] = observed_at
+                bucket["last_status"] = status
+                if price is not None:
+                    bucket["last_price"] = price
+            self._dirty[grain].add((key, start))
+
+    def observe_many(self, snapshots):
+        with self._lock:
+            if self._pruned_before is not None:
+                # メモリから捨てたバケットに届いた遅延データは、DB から読み直してから反映する
+                self._known_keys -= {
+                    rollup_key(s) for s in snapshots if _to_datetime(s["update_time"]) < self._pruned_before
+                }
+            self._load_existing(snapshots)
+            for snapshot in sorted(snapshots, key=lambda s: _to_datetime(s["update_time"])):
+                self.observe(snapshot)
+
+    def _to_record(self, grain, bucket_key):
+        bucket = self._buckets[grain][bucket_key]
+        return {
+            **bucket,
+            "bucket_start": bucket["bucket_start"].isoformat(),
+            "last_time": bucket["last_time"].isoformat() if bucket["last_time"] else None,
+        }
+
+    def take_dirty(self, grain):
+        """変更のあったバケットを DB 書き込み用の dict にして返し、変更記録を空にする"""
+        dirty, self._dirty[grain] = self._dirty[grain], set()
+        return [self._to_record(grain, bucket_key) for bucket_key in dirty]
+
+    def prune(self, keep_after):
+        """keep_after より前のバケットをメモリから捨てる（常駐プロセスのメモリを一定に保つ）"""
+        for grain, buckets in self._buckets.items():
+            for bucket_key in [k for k in buckets if k[1] < bucket_start(keep_after, grain) and k not in self._dirty[grain]]:
+                del buckets[bucket_key]
+        self._pruned_before = bucket_start(keep_after, "hourly")
+
+    def flush(self):
+        """
+        変更のあったバケットを upsert し、件数を返す。
+        失敗した分は変更記録に戻して次回の flush で再送し、古いバケットの prune は書き込みが成功してから行う。
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = {}
+                for grain in ROLLUP_TABLES:
+                    keys, self._dirty[grain] = list(self._dirty[grain]), set()
+                    pending[grain] = (keys, [self._to_record(grain, key) for key in keys])
+
+            total = 0
+            for grain, (keys, rows) in pending.items():
+                table = ROLLUP_TABLES[grain]
+                written = 0
+                try:
+                    client = self._client_getter()
+                    for i in range(0, len(rows), PAGE_SIZE):
+                        client.table(table).upsert(rows[i:i + PAGE_SIZE], on_conflict=CONFLICT_COLUMNS).execute()
+                        written = min(i + PAGE_SIZE, len(rows))
+                except Exception:
+                    with self._lock:
+                        # 書き込めなかったバケット（以降の粒度の分も含む）を戻す。バケットの dict は共有なので、
+                        # 失敗後に届いたスナップショットの反映もそのまま再送される
+                        self._dirty[grain].update(keys[written:])
+                        for later_grain in list(pending)[list(pending).index(grain) + 1:]:
+                            self._dirty[later_grain].update(pending[later_grain][0])
+                    raise
+                finally:
+                    counter("stock_db_rows_written_total", "DBに書き込んだ行数").inc(written, table=table)
+                total += written
+
+            with self._lock:
+                self.prune(datetime.datetime.now() - datetime.timedelta(days=2))
+        return total
+
+
+def load_rollup_frame(client, grain="daily", since=None, product_ids=None):
+    """
+    ロールアップを DataFrame で返す。予測モジュールの入力と同じ形にするため、
+    seller_site_id を seller_site、bucket_start を update_time として返す。
+    """
+    import pandas as pd
+
+    if since is None:
+        since = datetime.datetime.now() - datetime.timedelta(days=ROLLUP_HORIZON_DAYS)
+
+    table = ROLLUP_TABLES[grain]
+    rows = []
+    id_chunks = [product_ids[i:i + ID_CHUNK_SIZE] for i in range(0, len(product_ids), ID_CHUNK_SIZE)] if product_ids else [None]
+    for chunk in id_chunks:
+        offset = 0
+        while True:
+            query = client.table(table).select(", ".join(ROLLUP_COLUMNS)).gte("bucket_start", since.isoformat())
+            if chunk:
+                query = query.in_("product_id", chunk)
+            response = query.order("bucket_start").range(offset, offset + PAGE_SIZE - 1).execute()
+            if not response.data:
+                break
+            rows.extend(response.data)
+            offset += PAGE_SIZE
+    counter("stock_db_rows_fetched_total", "DBから取得した行数").inc(len(rows), table=table)
+
+    df = pd.DataFrame.from_records(rows, columns=ROLLUP_COLUMNS)
+    df = df.rename(columns={"seller_site_id": "seller_site", "bucket_start": "update_time"})
+    for col in ("site", "seller_site", "product_id"):
+        df[col] = df[col].astype("category")
+    df["update_time"] = pd.to_datetime(df["update_time"], format="ISO8601")
+    df["last_time"] = pd.to_datetime(df["last_time"], format="ISO8601", errors="coerce")
+    for col in ("sample_count", "in_stock_count", "transition_count"):
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+    df["in_stock_ratio"] = pd.to_numeric(df["in_stock_ratio"], downcast="float")
+    # 既存の学習コードがそのまま使えるよう、在庫あり率を stock_status として持たせる
+    df["stock_status"] = df["in_stock_ratio"]
+    return df
+
+
+def fetch_rollup_data(product_ids=None):
+    """
+    日次ロールアップ（在庫あり率）を、train_arima / web/app の入力の形で返す（データがなければ None）。
+    取得件数は対象期間 × 商品数で決まる。取得に失敗した場合は例外を送出する。
+    """
+    from supabase_client import get_supabase
+
+    try:
+        df = load_rollup_frame(get_supabase(), "daily", product_ids=sorted(product_ids) if product_ids else None)
+        if not df.empty:
+            df.sort_values(["site", "seller_site", "product_id", "update_time"], inplace=True)
+            df.set_index("update_time", inplace=True)
+            return df
+        else:
+            print("⚠ データが取得できませんでした。")
+            return None
+    except Exception as e:
+        print(f"❌ データ取得エラー: {e}")
+        raise
+
+
+_maintainer = None
+_maintainer_lock = threading.Lock()
+
+
+def get_maintainer():
+    """プロセス内で共有する RollupMaintainer を返す"""
+    global _maintainer
+    with _maintainer_lock:
+        if _maintainer is None:
+            from supabase_client import get_supabase
+            _maintainer = RollupMaintainer(get_supabase)
+        return _maintainer
+
+
+def rebuild_rollups():
+    """trn_ranked_item_stock 全体（アーカイブ済みの期間を含む）からロールアップを作り直す（初回の移行用）"""
+    from stock_archive import fetch_stock_records
+    from stock_loader import delete_stale_rows
+    from supabase_client import get_supabase
+
+    client = get_supabase()
+    snapshots = fetch_stock_records(
+        client, ["site", "seller_site_id", "product_id", "stock_status", "price", "update_time"]
+    )
+
+    maintainer = RollupMaintainer(get_supabase)
+    # 全スナップショットから数え直すので、既存のロールアップは読み込まずに上書きする
+    maintainer.seed_known_keys(rollup_key(s) for s in snapshots)
+    maintainer.observe_many(snapshots)
+    count = maintainer.flush()
+
+    # 書き終えてから、作り直しに含まれない古いバケットだけを消す
+    deleted = 0
+    for grain, table in ROLLUP_TABLES.items():
+        keep = {rollup_key(s) + (bucket_start(_to_datetime(s["update_time"]), grain),) for s in snapshots}
+        deleted += delete_stale_rows(
+            client, table, ["site", "seller_site_id", "product_id", "bucket_start"], keep,
+            lambda row: rollup_key(row) + (_to_datetime(row["bucket_start"]),),
+        )
+    print(f"✅ {len(snapshots)}件のスナップショットから {count}件のロールアップを作成しました（古いバケット {deleted}件を削除）")
+    return count
+
+
+if __name__ == "__main__":
+    import sys
+
+    if "--rebuild" in sys.argv[1:]:
+        rebuild_rollups()
+    else:
+        print("使い方: python src/common/stock_rollup.py --rebuild")
@@ -0,0 +1,50 @@
+"""
+スクリプト名: supabase_client.py
+
+目的:
+プロセス内で共有する Supabase クライアントを、初めて使われたときに 1 つだけ作成する。
+各モジュールは import 時にクライアントを作らず get_supabase() を呼ぶ。
+supabase パッケージ自体の import（httpx / postgrest など）も初回呼び出しまで遅らせるため、
+スケジューラの起動が軽くなる。
+
+使い方:
+from supabase_client import get_supabase
+get_supabase().table("mst_site_item").select("*").execute()
+
+ベンチマークなどでは set_supabase() で差し替えられる。
+接続先は環境変数（または .env）の SUPABASE_URL / SUPABASE_KEY で指定する。
+未設定のまま本番に読み書きしないよう、既定値は持たずにエラーにする。
+"""
+
+import os
+import threading
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_supabase():
+    """共有クライアントを返す（初回呼び出し時に作成）"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from dotenv import load_dotenv
+                from supabase import create_client
+
+                # .env ファイルの読み込み
+                load_dotenv()
+                url = os.getenv("SUPABASE_URL")
+                key = os.getenv("SUPABASE_KEY")
+                missing = [name for name, value in (("SUPABASE_URL", url), ("SUPABASE_KEY", key)) if not value]
+                if missing:
+                    raise RuntimeError(f"❌ Supabase の接続情報が未設定です: {', '.join(missing)}（環境変数または .env で指定してください）")
+                _client = create_client(url, key)
+    return _client
+
+
+def set_supabase(client):
+    """共有クライアントを差し替える（None を渡すと次回の get_supabase() で作り直す）"""
+    global _client
+    with _lock:
+        _client = client
@@ -11,11 +11,14 @@
 import json
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from dotenv import load_dotenv
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../common")))
 from logger import log_error,log_response
+from metrics import counter, timer
+from rate_limiter import RateLimiter
 
 # .env ファイルの読み込み（環境変数の設定）
 load_dotenv()
@@ -24,7 +27,15 @@ load_dotenv()
 RAKUTEN_API_URL = os.getenv("RAKUTEN_API_URL") # 楽天APIのエンドポイント 商品ランキング
 RAKUTEN_APP_ID = os.getenv("RAKUTEN_APP_ID")
 
-def fetch_rakuten_stock():
+# 取得するランキングのジャンルID（カンマ区切り）とページ数（1 ページ 30 件、最大 34 ページ）
+RAKUTEN_RANKING_GENRES = [g.strip() for g in os.getenv("RAKUTEN_RANKING_GENRES", "0").split(",") if g.strip()]
+RAKUTEN_RANKING_PAGES = int(os.getenv("RAKUTEN_RANKING_PAGES", "1"))
+# 並列数と 1 秒あたりのリクエスト数（楽天APIは 1 アプリIDあたり 1 リクエスト/秒程度が目安）
+RAKUTEN_RANKING_WORKERS = int(os.getenv("RAKUTEN_RANKING_WORKERS", "4"))
+RAKUTEN_API_RATE = float(os.getenv("RAKUTEN_API_RATE", "1.0"))
+
+def fetch_rakuten_ranking_page(genre_id="0", page=1):
+    """1 ジャンル・1 ページ分のランキングを取得し、Item のリストを返す（失敗時は空リスト）"""
     # params = {
     #     "applicationId": RAKUTEN_APP_ID,
     #     "keyword": "PS5",
@@ -34,28 +45,88 @@ def fetch_rakuten_stock():
     params = {
         "applicationId": RAKUTEN_APP_ID,
         "format": "json",
-        "genreId": "0"  # 全ジャンルのランキング取得
+        "genreId": genre_id,  # "0" は全ジャンルのランキング
+        "page": page,
     }
 
     try:
-        response = requests.get(RAKUTEN_API_URL, params=params)
+        with timer("stock_api_request_duration_seconds", "APIリクエストの所要時間", site="rakuten", endpoint="ranking"):
+            response = requests.get(RAKUTEN_API_URL, params=params)
+        counter("stock_api_requests_total", "APIリクエスト数").inc(site="rakuten", endpoint="ranking", status=response.status_code)
         if response.status_code == 200:
             data = response.json()
             # print(json.dumps(data, indent=4).encode("utf-8").decode("unicode_escape"))
             log_response("rakuten",data)
-            items = extract_items_data(data["Items"])  # 商品データを抽出
-            # print(items)
-            return items
+            return data["Items"]
         else:
-            error_message=(f"Error: {response.status_code}, {response.text}")
+            error_message=(f"Error: genreId={genre_id} page={page} {response.status_code}, {response.text}")
             log_error(error_message)
             print(error_message)
+    except Exception as e:
+        error_message = f"An exception occurred: genreId={genre_id} page={page} {str(e)}"
+        log_error(error_message)
+    return []
+
+
+def merge_ranking_items(pages):
+    """
+    (genre_id, page, Items) のリストを 1 つにまとめる。
+    複数ジャンルに出てくる商品は、最も順位の高い（rank が小さい）ものだけを残し、
+    そのジャンルと順位を ranking_genre_id / ranking_rank として付ける。
+    """
+    best = {}
+    for genre_order, (genre_id, page, items) in enumerate(pages):
+        for position, item_wrapper in enumerate(items):
+            item = item_wrapper["Item"]
+            # rank が無いレスポンスでもページ内の位置から順位を補う
+            rank = item.get("rank") or (page - 1) * len(items) + position + 1
+            key = item["itemCode"]
+            sort_key = (rank, genre_order)
+            if key not in best or sort_key < best[key][0]:
+                best[key] = (sort_key, genre_id, rank, item_wrapper)
+
+    merged = []
+    for _, genre_id, rank, item_wrapper in sorted(best.values(), key=lambda v: v[0]):
+        merged.append({"Item": {**item_wrapper["Item"], "genreId": genre_id, "rank": rank}})
+    return merged
+
+
+def fetch_rakuten_stock(genre_ids=None, pages=None):
+    """
+    指定したジャンル × ページのランキングを並列に取得し、重複を除いて商品データを返す。
+    既定（RAKUTEN_RANKING_GENRES="0", RAKUTEN_RANKING_PAGES=1）は従来どおり全ジャンル 1 ページ。
+    """
+    genre_ids = genre_ids or RAKUTEN_RANKING_GENRES
+    pages = pages or RAKUTEN_RANKING_PAGES
+    tasks = [(genre_id, page) for genre_id in genre_ids for page in range(1, pages + 1)]
+    limiter = RateLimiter(RAKUTEN_API_RATE)
+
+    def fetch(task):
+        limiter.acquire()
+        return fetch_rakuten_ranking_page(*task)
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(RAKUTEN_RANKING_WORKERS, len(tasks))) as executor:
+            # map は投入順に結果を返すので、ジャンルの指定順がそのまま同順位の優先順になる
+            results = list(executor.map(fetch, tasks))
+
+        merged = merge_ranking_items(
+            (genre_id, page, items) for (genre_id, page), items in zip(tasks, results)
+        )
+        counter("stock_ranking_items_total", "ランキングから取得した商品数").inc(
+            sum(len(items) for items in results), site="rakuten", stage="fetched"
+        )
+        counter("stock_ranking_items_total", "ランキングから取得した商品数").inc(len(merged), site="rakuten", stage="unique")
+        if not merged:
+            return None
+        items = extract_items_data(merged)  # 商品データを抽出
+        # print(items)
+        return items
     except Exception as e:
         error_message = f"An exception occurred: {str(e)}"
         log_error(error_message)
     finally:
         print(f"処理を継続")
-    
 
 
 def extract_items_data(items):
@@ -73,7 +144,9 @@ def extract_items_data(items):
             "seller_site_name": item["shopName"],    # 販売元名
             "stock_status": item["availability"] == 1,  # 在庫ステータス
             "price": item["itemPrice"],               # 価格
-            "jan_code": item.get("jan", None)       # JANコード（存在しない場合はNoneを設定）
+            "jan_code": item.get("jan", None),      # JANコード（存在しない場合はNoneを設定）
+            "ranking_genre_id": item.get("genreId"),  # ランキングのジャンル
+            "ranking_rank": item.get("rank"),         # ランキング順位
         })
 
     return extracted_items
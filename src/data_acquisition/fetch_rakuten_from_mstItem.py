@@ -15,20 +15,19 @@ import sys
 import time
 import requests
 from dotenv import load_dotenv
-from supabase import create_client, Client
 
 # 共通モジュール読み込み
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../common")))
+import jan_index
 from logger import log_error
+from metrics import counter, timer
+from supabase_client import get_supabase
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../prediction")))
+import stream_anomaly
 
 # --- 環境変数の読み込み ---
 load_dotenv()
 
-# --- Supabase 初期化 ---
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
 # --- 楽天API 設定 ---
 RAKUTEN_API_URL = os.getenv("RAKUTEN_API_URL")
 RAKUTEN_APP_ID = os.getenv("RAKUTEN_APP_ID")
@@ -37,10 +36,11 @@ SITE = "楽天"  # 固定値
 def fetch_mst_site_item_rows():
     """Supabaseのmst_site_itemテーブルから楽天の情報を取得"""
     try:
-        response = supabase.table("mst_site_item") \
+        response = get_supabase().table("mst_site_item") \
             .select("seller_site_id, seller_site_name, product_id, jan_code") \
             .eq("site", SITE) \
             .execute()
+        counter("stock_db_rows_fetched_total", "DBから取得した行数").inc(len(response.data), table="mst_site_item")
         return response.data
     except Exception as e:
         log_error(f"Supabase mst_site_item取得失敗: {str(e)}")
@@ -57,7 +57,9 @@ def fetch_item_from_rakuten(shop_code, item_code):
     }
 
     try:
-        response = requests.get(RAKUTEN_API_URL, params=params)
+        with timer("stock_api_request_duration_seconds", "APIリクエストの所要時間", site="rakuten", endpoint="item"):
+            response = requests.get(RAKUTEN_API_URL, params=params)
+        counter("stock_api_requests_total", "APIリクエスト数").inc(site="rakuten", endpoint="item", status=response.status_code)
         if response.status_code != 200:
             log_error(f"楽天APIエラー: {response.status_code} {response.text}")
             return None
@@ -83,7 +85,7 @@ def fetch_item_from_rakuten(shop_code, item_code):
         log_error(f"楽天API通信エラー: {str(e)}")
         return None
 
-def upsert_product_to_supabase(product_data):
+def upsert_product_to_supabase(product_data, jan_code=None):
     """Supabaseに商品情報をアップサート（新規追加または更新）"""
     try:
         site = product_data["site"]
@@ -91,7 +93,7 @@ def upsert_product_to_supabase(product_data):
         product_id = product_data["product_id"]
 
         # 既存レコードを確認
-        existing = supabase.table("trn_tracked_item_stock") \
+        existing = get_supabase().table("trn_tracked_item_stock") \
             .select("id") \
             .eq("site", site) \
             .eq("seller_site_id", seller_site_id) \
@@ -103,17 +105,57 @@ def upsert_product_to_supabase(product_data):
             trn_tracked_item_stock_id = existing.data[0]["id"]
             product_data["updated_at"] = datetime.datetime.now().isoformat()
 
-            supabase.table("trn_tracked_item_stock") \
+            get_supabase().table("trn_tracked_item_stock") \
                 .update(product_data) \
                 .eq("id", trn_tracked_item_stock_id) \
                 .execute()
         else:
-            supabase.table("trn_tracked_item_stock").insert(product_data).execute()
+            get_supabase().table("trn_tracked_item_stock").insert(product_data).execute()
+
+        counter("stock_db_rows_written_total", "DBに書き込んだ行数").inc(table="trn_tracked_item_stock")
+
+        if stream_anomaly.is_enabled():
+            stream_anomaly.get_monitor().observe(product_data, "trn_tracked_item_stock")
+
+        if jan_index.is_enabled():
+            # ランキングから外れた追跡商品も、JAN インデックスの在庫・価格を最新にする
+            jan_index.get_maintainer().observe_many([{
+                **product_data,
+                "jan_code": product_data.get("jan_code") or jan_code,
+                "update_time": datetime.datetime.now().isoformat(),
+            }])
 
     except Exception as e:
         log_error(f"Supabase trn_tracked_item_stock upsert失敗: {str(e)}")
 
-def main_rakuten():
+
+def flush_stock_anomalies():
+    """upsert 中に検知した異常を trn_stock_anomaly に登録"""
+    if not stream_anomaly.is_enabled():
+        return
+    try:
+        count = stream_anomaly.get_monitor().flush(get_supabase())
+        if count:
+            print(f"⚠️ 異常を検知しました: {count}件")
+    except Exception as e:
+        log_error(f"異常検知結果の登録失敗: {str(e)}")
+
+def flush_jan_index():
+    """upsert 中に観測した出品を mst_jan_listing に登録"""
+    if not jan_index.is_enabled():
+        return
+    try:
+        jan_index.get_maintainer().flush()
+    except Exception as e:
+        log_error(f"JANインデックスの更新失敗: {str(e)}")
+
+
+def row_cursor(row):
+    """進捗カーソル用のキー（販売元ID:商品ID:JANコード）"""
+    return f"{row.get('seller_site_id') or ''}:{row.get('product_id') or ''}:{row.get('jan_code') or ''}"
+
+def main_rakuten(progress=None):
+    """progress（dag.StageProgress）を渡すと、処理済みの商品を記録し、再実行時は続きから処理する"""
     print("🔍 Supabaseから検索条件を取得中...")
     rows = fetch_mst_site_item_rows()
 
@@ -121,6 +163,13 @@ def main_rakuten():
         print("⚠️ データが見つかりません。処理を終了します。")
         return
 
+    # 再開できるよう、常に同じ順序で処理する
+    rows.sort(key=row_cursor)
+    cursor = progress.cursor if progress else None
+    if cursor:
+        rows = [row for row in rows if row_cursor(row) > cursor]
+        print(f"⏩ 前回の続きから再開: {cursor} 以降の{len(rows)}件")
+
     for row in rows:
         shop_code = row["seller_site_id"]
         item_code = row["product_id"]
@@ -131,12 +180,18 @@ def main_rakuten():
             # seller_site_nameがmst_site_itemに含まれている場合は補完
             item_data["seller_site_name"] = row.get("seller_site_name", item_data.get("seller_site_name", ""))
             # item_data["seller_site_id"] = item_data.get("seller_site_id", "") or ""
-            upsert_product_to_supabase(item_data)
+            upsert_product_to_supabase(item_data, jan_code=row.get("jan_code"))
             print(f"✅ 登録完了: {item_data['product_id']}")
         else:
             print(f"❌ スキップ: {shop_code}:{item_code}")
 
+        if progress:
+            progress.advance(row_cursor(row))
+
         time.sleep(1)
 
+    flush_stock_anomalies()
+    flush_jan_index()
+
 if __name__ == "__main__":
     main_rakuten()
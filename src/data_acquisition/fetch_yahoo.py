@@ -15,12 +15,14 @@ Yahoo!ショッピング上で人気商品かつ在庫があるアイテムを
 import json
 import os
 import sys
-from time import sleep
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import requests
 from dotenv import load_dotenv
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../common")))
 from logger import log_error,log_response
+from metrics import counter, timer
+from rate_limiter import RateLimiter
 
 # .env ファイルの読み込み（環境変数の設定）
 load_dotenv()
@@ -30,10 +32,16 @@ YAHOO_API_URL = os.getenv("YAHOO_API_URL")  # 高評価トレンドランキン
 YAHOO_APP_ID = os.getenv("YAHOO_APP_ID")  # 取得したClient ID（アプリケーションID）
 
 # 在庫情報を取得するためのAPIエンドポイント
-ITEM_SEARCH_API_URL = "https://shopping.yahooapis.jp/ShoppingWebService/V3/itemSearch" # https://developer.yahoo.co.jp/webapi/shopping/v3/itemsearch.html
-
-def fetch_yahoo_stock():
-    """Yahoo! ショッピングのランキングから商品を取得し、在庫情報を追加する"""
+# 負荷試験ではモックサーバー（benchmarks/mock_marketplace.py）に向けるため環境変数で上書きできる
+ITEM_SEARCH_API_URL = os.getenv(
+    "YAHOO_ITEM_SEARCH_API_URL", "https://shopping.yahooapis.jp/ShoppingWebService/V3/itemSearch"
+)  # https://developer.yahoo.co.jp/webapi/shopping/v3/itemsearch.html
+# 在庫確認の並列数と 1 秒あたりのリクエスト数（従来は 1 件ずつ sleep(1)）
+YAHOO_ITEM_SEARCH_WORKERS = int(os.getenv("YAHOO_ITEM_SEARCH_WORKERS", "4"))
+YAHOO_ITEM_SEARCH_RATE = float(os.getenv("YAHOO_ITEM_SEARCH_RATE", "1.0"))
+
+def fetch_yahoo_ranking_items():
+    """Yahoo! ショッピングのランキングから商品を取得する（在庫情報はまだ付いていない）"""
     params = {
         "appid": YAHOO_APP_ID,
         # "category_id": "1"  # 例: 家電のカテゴリ
@@ -41,20 +49,13 @@ def fetch_yahoo_stock():
 
     try:
         # API にリクエストを送信
-        response = requests.get(YAHOO_API_URL, params=params)
+        with timer("stock_api_request_duration_seconds", "APIリクエストの所要時間", site="yahoo", endpoint="ranking"):
+            response = requests.get(YAHOO_API_URL, params=params)
+        counter("stock_api_requests_total", "APIリクエスト数").inc(site="yahoo", endpoint="ranking", status=response.status_code)
         if response.status_code == 200:
             data = response.json()
             log_response("yahoo_data",data)
-            items = extract_items_data(data["high_rating_trend_ranking"]["ranking_data"])  # 商品データを抽出
-
-            # 在庫情報を取得して商品のデータを更新
-            for item in items:
-                item["stock_status"] = fetch_stock_status(item["product_id"])  # 在庫情報を追加
-
-                sleep(1)
-            
-            # print(json.dumps(items, indent=4, ensure_ascii=False))  # 日本語を適切に表示
-            return items
+            return extract_items_data(data["high_rating_trend_ranking"]["ranking_data"])  # 商品データを抽出
         else:
             error_message=(f"Error: {response.status_code}, {response.text}")
             log_error(error_message)
@@ -63,10 +64,56 @@ def fetch_yahoo_stock():
         error_message = f"An exception occurred: {str(e)}"
         log_error(error_message)
         print(error_message)
-    finally:
-        print(f"処理を継続")
-    
-    
+    return None
+
+
+def iter_yahoo_stock(items=None, max_workers=None, rate=None):
+    """
+    ランキングの商品に在庫情報を付けて、完了したものから順に返すジェネレータ。
+    在庫確認は max_workers 件まで並行し、全体で rate 件/秒に制限する。
+    投入済みで未完了の件数は max_workers * 2 までに抑える。
+    """
+    if items is None:
+        items = fetch_yahoo_ranking_items()
+    if not items:
+        return
+
+    max_workers = max_workers or YAHOO_ITEM_SEARCH_WORKERS
+    limiter = RateLimiter(YAHOO_ITEM_SEARCH_RATE if rate is None else rate)
+
+    def enrich(item):
+        limiter.acquire()
+        item["stock_status"] = fetch_stock_status(item["product_id"])  # 在庫情報を追加
+        return item
+
+    pending_items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = set()
+        while True:
+            for item in pending_items:
+                running.add(executor.submit(enrich, item))
+                if len(running) >= max_workers * 2:
+                    break
+            if not running:
+                break
+
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    yield future.result()
+                except Exception as e:
+                    # 1 件の失敗で残りを捨てない
+                    error_message = f"在庫情報の取得に失敗: {str(e)}"
+                    log_error(error_message)
+                    print(error_message)
+
+
+def fetch_yahoo_stock():
+    """Yahoo! ショッピングのランキングから商品を取得し、在庫情報を追加する（全件揃ってから返す）"""
+    items = list(iter_yahoo_stock())
+    # print(json.dumps(items, indent=4, ensure_ascii=False))  # 日本語を適切に表示
+    return items or None
+
 
 def extract_items_data(items):
     """JSON内のItemデータから必要な情報を抽出する"""
@@ -97,7 +144,9 @@ def fetch_stock_status(item_code):
         "results": 1  # 1件のみ取得
     }
     
-    response = requests.get(ITEM_SEARCH_API_URL, params=params)
+    with timer("stock_api_request_duration_seconds", "APIリクエストの所要時間", site="yahoo", endpoint="item_search"):
+        response = requests.get(ITEM_SEARCH_API_URL, params=params)
+    counter("stock_api_requests_total", "APIリクエスト数").inc(site="yahoo", endpoint="item_search", status=response.status_code)
     if response.status_code == 200:
         data = response.json()
         
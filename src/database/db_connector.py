@@ -1,15 +1,240 @@
+"""
+スクリプト名: db_connector.py
+
+目的:
+PostgreSQL に直接接続するバックエンド。
+スレッドセーフなコネクションプールを持ち、大量データは COPY FROM STDIN でストリーミング投入、
+executemany 相当のバッチ UPSERT も提供する。PostgREST（Supabase API）を経由せずに
+大量ロードを行いたい場合に使う。
+
+接続先は環境変数 DATABASE_URL（libpq の接続文字列または URI）で指定する。
+"""
+
+import datetime
+import io
+import os
+import threading
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import pool, sql
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+# .env ファイルの読み込み
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL") or "dbname=stock_db user=admin password=pass host=localhost"
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+
+# COPY 1 回の読み出しで返す最大文字数
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class BlockingConnectionPool:
+    """ThreadedConnectionPool に、空きが出るまで待つ getconn を加えたもの"""
+
+    def __init__(self, minconn, maxconn, dsn):
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, dsn)
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, timeout=None):
+        if not self._slots.acquire(timeout=timeout):
+            raise pool.PoolError("コネクションプールの空き待ちがタイムアウトしました")
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close=False):
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """プロセス内で共有するコネクションプールを返す（初回呼び出し時に作成）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BlockingConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL)
+        return _pool
+
+
+def close_pool():
+    """プールの全コネクションを閉じる"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+@contextmanager
+def get_connection(timeout=None):
+    """プールからコネクションを借り、正常終了なら commit、例外なら rollback して返却する"""
+    db_pool = get_pool()
+    conn = db_pool.getconn(timeout=timeout)
+    broken = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+        raise
+    finally:
+        db_pool.putconn(conn, close=broken or conn.closed != 0)
+
+
+def _copy_text(value):
+    """COPY の text 形式 1 フィールド分の文字列に変換する"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class RowStream(io.TextIOBase):
+    """行のイテレータを、COPY FROM STDIN が読み出せるファイルライクなオブジェクトにする"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ""
+        self.row_count = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        limit = COPY_CHUNK_SIZE if size is None or size < 0 else size
+        while len(self._buffer) < limit:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += "\t".join(_copy_text(v) for v in row) + "\n"
+            self.row_count += 1
+        chunk, self._buffer = self._buffer[:limit], self._buffer[limit:]
+        return chunk
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def copy_rows(table, columns, rows, conn=None):
+    """
+    rows（タプルのイテラブル）を COPY FROM STDIN でテーブルに投入し、件数を返す。
+    rows はジェネレータでもよく、全件をメモリに載せずに流し込める。
+    """
+    query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table),
+        sql.SQL(", ").join(map(sql.Identifier, columns)),
+    )
+    stream = RowStream(rows)
+
+    if conn is not None:
+        with conn.cursor() as cursor:
+            cursor.copy_expert(query.as_string(conn), stream)
+        return stream.row_count
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.copy_expert(query.as_string(conn), stream)
+    return stream.row_count
+
+
+def upsert_many(table, columns, rows, conflict_columns, update_columns=None, page_size=1000, conn=None):
+    """
+    INSERT ... ON CONFLICT DO UPDATE を page_size 件ずつまとめて実行し、件数を返す。
+    update_columns を省略すると conflict_columns 以外の全カラムを更新する。
+    """
+    if update_columns is None:
+        update_columns = [c for c in columns if c not in conflict_columns]
+
+    if update_columns:
+        conflict_action = sql.SQL("DO UPDATE SET {}").format(sql.SQL(", ").join(
+            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c)) for c in update_columns
+        ))
+    else:
+        conflict_action = sql.SQL("DO NOTHING")
+
+    query = sql.SQL("INSERT INTO {} ({}) VALUES %s ON CONFLICT ({}) {}").format(
+        sql.Identifier(table),
+        sql.SQL(", ").join(map(sql.Identifier, columns)),
+        sql.SQL(", ").join(map(sql.Identifier, conflict_columns)),
+        conflict_action,
+    )
+    rows = list(rows)
+
+    def run(target):
+        with target.cursor() as cursor:
+            execute_values(cursor, query.as_string(target), rows, page_size=page_size)
+
+    if conn is not None:
+        run(conn)
+    else:
+        with get_connection() as conn:
+            run(conn)
+    return len(rows)
+
 
 def save_to_db(product_id, product_name, site, stock_status, price):
-    conn = psycopg2.connect("dbname=stock_db user=admin password=pass host=localhost")
-    cursor = conn.cursor()
-    
-    query = """
-    INSERT INTO trn_ranked_item_stock (product_id, product_name, site, stock_status, price)
-    VALUES (%s, %s, %s, %s, %s);
-    """
-    cursor.execute(query, (product_id, product_name, site, stock_status, price))
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            query = """
+            INSERT INTO trn_ranked_item_stock (product_id, product_name, site, stock_status, price)
+            VALUES (%s, %s, %s, %s, %s);
+            """
+            cursor.execute(query, (product_id, product_name, site, stock_status, price))
+
+
+# ローカルの PostgreSQL に対する動作確認用
+# 例: DATABASE_URL="dbname=postgres user=postgres host=localhost" python src/database/db_connector.py
+if __name__ == "__main__":
+    table = "tmp_db_connector_check"
+    columns = ["product_id", "product_name", "stock_status", "price"]
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(
+                f"CREATE TABLE {table} (product_id VARCHAR(50) PRIMARY KEY, product_name VARCHAR(255),"
+                " stock_status BOOLEAN, price INT)"
+            )
+
+    copied = copy_rows(table, columns, ((f"P{i:05d}", f"商品\t{i}\n", i % 2 == 0, i) for i in range(10000)))
+    upserted = upsert_many(table, columns, [(f"P{i:05d}", None, False, 0) for i in range(5000, 15000)], ["product_id"])
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT count(*), count(*) FILTER (WHERE price = 0) FROM {table}")
+            total, zero_price = cursor.fetchone()
+            cursor.execute(f"SELECT product_name FROM {table} WHERE product_id = 'P00001'")
+            name = cursor.fetchone()[0]
+            cursor.execute(f"DROP TABLE {table}")
+
+    print(f"COPY: {copied}件 / UPSERT: {upserted}件 / 合計: {total}件 / 更新: {zero_price}件 / 名前: {name!r}")
+    assert (copied, upserted, total, zero_price) == (10000, 10000, 15000, 10000)
+    assert name == "商品\t1\n"
+    close_pool()
@@ -60,3 +60,95 @@ CREATE TABLE mst_site_item (
   count integer NOT NULL,
   summary_time timestamp without time zone DEFAULT CURRENT_TIMESTAMP
 );
+
+CREATE TABLE trn_stock_anomaly (
+    id SERIAL PRIMARY KEY,
+    detected_at TIMESTAMP NOT NULL,                 -- 検知日時
+    source_table VARCHAR(50) NOT NULL,              -- 検知元テーブル (trn_ranked_item_stock / trn_tracked_item_stock)
+    event_type VARCHAR(30) NOT NULL,                -- price_crash / price_outlier / stock_flapping / seller_mass_stockout
+    site VARCHAR(20),
+    seller_site_id VARCHAR(50),
+    product_id VARCHAR(50),                         -- 販売元単位のイベントでは NULL
+    value FLOAT,                                    -- 観測値
+    expected FLOAT,                                 -- 期待値（EWMA 等）
+    score FLOAT                                     -- 外れ度合い
+);
+
+
+-- ランキング取得時のジャンルと順位（楽天の複数ジャンル取得で使用。適用後に RANKING_COLUMNS_ENABLED=1 で登録を有効にする）
+ALTER TABLE trn_ranked_item_stock ADD COLUMN IF NOT EXISTS ranking_genre_id VARCHAR(20);
+ALTER TABLE trn_ranked_item_stock ADD COLUMN IF NOT EXISTS ranking_rank INT;
+
+-- 商品名・商品説明の重複排除（スナップショット行は content_hash のみを持つ）
+CREATE TABLE IF NOT EXISTS mst_item_content (
+    content_hash CHAR(64) PRIMARY KEY,              -- SHA-256(product_name + 0x1F + description)
+    product_name VARCHAR(255),
+    description VARCHAR(5000),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+ALTER TABLE trn_ranked_item_stock ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+ALTER TABLE trn_ranked_item_stock_pretreatment ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+
+-- 在庫状態が続いた区間（trn_ranked_item_stock のランレングス圧縮）
+CREATE TABLE IF NOT EXISTS trn_stock_intervals (
+    site VARCHAR(20) NOT NULL,
+    seller_site_id VARCHAR(50) NOT NULL DEFAULT '',
+    product_id VARCHAR(50) NOT NULL,
+    stock_status BOOLEAN NOT NULL,                  -- 区間中の在庫状況
+    start_time TIMESTAMP NOT NULL,                  -- 区間の最初の観測時刻
+    end_time TIMESTAMP NOT NULL,                    -- 区間の最後の観測時刻
+    snapshot_count INT NOT NULL DEFAULT 1,          -- 区間内のスナップショット数
+    is_open BOOLEAN NOT NULL DEFAULT TRUE,          -- 商品ごとの最新区間なら TRUE
+    PRIMARY KEY (site, seller_site_id, product_id, start_time)
+);
+CREATE INDEX IF NOT EXISTS idx_stock_intervals_open ON trn_stock_intervals (is_open) WHERE is_open;
+
+-- 在庫スナップショットの 1 時間 / 1 日単位のロールアップ
+CREATE TABLE IF NOT EXISTS trn_stock_rollup_hourly (
+    site VARCHAR(20) NOT NULL,
+    seller_site_id VARCHAR(50) NOT NULL DEFAULT '',
+    product_id VARCHAR(50) NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,                -- バケットの開始時刻
+    sample_count INT NOT NULL,                      -- スナップショット数
+    in_stock_count INT NOT NULL,                    -- 在庫ありのスナップショット数
+    in_stock_ratio FLOAT NOT NULL,                  -- 在庫あり率
+    transition_count INT NOT NULL DEFAULT 0,        -- 在庫状態の切り替わり回数
+    min_price INT,
+    max_price INT,
+    last_price INT,
+    last_status BOOLEAN,                            -- バケット内で最後に観測した在庫状況
+    last_time TIMESTAMP,                            -- バケット内で最後に観測した時刻
+    PRIMARY KEY (site, seller_site_id, product_id, bucket_start)
+);
+CREATE INDEX IF NOT EXISTS idx_stock_rollup_hourly_bucket ON trn_stock_rollup_hourly (bucket_start);
+CREATE TABLE IF NOT EXISTS trn_stock_rollup_daily (
+    site VARCHAR(20) NOT NULL,
+    seller_site_id VARCHAR(50) NOT NULL DEFAULT '',
+    product_id VARCHAR(50) NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,                -- バケットの開始時刻
+    sample_count INT NOT NULL,                      -- スナップショット数
+    in_stock_count INT NOT NULL,                    -- 在庫ありのスナップショット数
+    in_stock_ratio FLOAT NOT NULL,                  -- 在庫あり率
+    transition_count INT NOT NULL DEFAULT 0,        -- 在庫状態の切り替わり回数
+    min_price INT,
+    max_price INT,
+    last_price INT,
+    last_status BOOLEAN,                            -- バケット内で最後に観測した在庫状況
+    last_time TIMESTAMP,                            -- バケット内で最後に観測した時刻
+    PRIMARY KEY (site, seller_site_id, product_id, bucket_start)
+);
+CREATE INDEX IF NOT EXISTS idx_stock_rollup_daily_bucket ON trn_stock_rollup_daily (bucket_start);
+
+-- JAN コード別の出品一覧（サイトをまたいだ同一商品の最新の在庫状況・価格）
+CREATE TABLE IF NOT EXISTS mst_jan_listing (
+    site VARCHAR(20) NOT NULL,
+    seller_site_id VARCHAR(50) NOT NULL DEFAULT '',
+    product_id VARCHAR(50) NOT NULL,
+    jan_code VARCHAR(13) NOT NULL,
+    seller_site_name VARCHAR(100),
+    stock_status BOOLEAN NOT NULL,                  -- 最新の在庫状況
+    price INT,                                      -- 最新の価格
+    update_time TIMESTAMP,                          -- 最後に観測した時刻
+    PRIMARY KEY (site, seller_site_id, product_id)
+);
+CREATE INDEX IF NOT EXISTS idx_jan_listing_jan_code ON mst_jan_listing (jan_code);
@@ -12,16 +12,52 @@ Supabaseの「trn_ranked_item_stock」テーブルに対して個別または一
 
 import datetime
 import os
-from supabase import create_client, Client
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../common")))
+from metrics import counter
+from supabase_client import get_supabase
+import content_store
+import jan_index
+import stock_intervals
+import stock_rollup
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../prediction")))
+import stream_anomaly
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../database")))
+
 # .env ファイルの読み込み
 load_dotenv()
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# 書き込み先（"supabase": PostgREST 経由で 1 件ずつ / "postgres": db_connector の COPY で一括）
+STOCK_WRITE_BACKEND = os.getenv("STOCK_WRITE_BACKEND", "supabase")
+# insert_stock_stream で 1 回に登録する件数
+STOCK_STREAM_BATCH_SIZE = int(os.getenv("STOCK_STREAM_BATCH_SIZE", "20"))
+
+# trn_ranked_item_stock に登録するカラム
+STOCK_COLUMNS = [
+    "product_id", "product_name", "description", "site", "seller_site_id", "seller_site_name",
+    "stock_status", "price", "insert_time", "update_time", "jan_code",
+]
+# ランキングのジャンルと順位（db_init.sql の ALTER TABLE を適用した DB でだけ登録する）
+RANKING_COLUMNS = ["ranking_genre_id", "ranking_rank"]
+
+
+def ranking_columns_enabled():
+    return os.getenv("RANKING_COLUMNS_ENABLED", "0") == "1"
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+def stock_columns():
+    """
+    登録するカラム。ranking_genre_id / ranking_rank と content_hash は移行前の DB には存在しないため、
+    それぞれ RANKING_COLUMNS_ENABLED / content_store が有効なときだけ加える
+    """
+    columns = list(STOCK_COLUMNS)
+    if ranking_columns_enabled():
+        columns += RANKING_COLUMNS
+    if content_store.is_enabled():
+        columns.append("content_hash")
+    return columns
 
 # Supabaseに在庫データを登録
 # Supabaseに在庫データを登録
@@ -34,7 +70,10 @@ def update_stock_in_supabase(
     seller_site_id="",
     seller_site_name="",
     price=0,
-    jan_code=None  # 🆕 追加
+    jan_code=None,  # 🆕 追加
+    ranking_genre_id=None,
+    ranking_rank=None,
+    content_hash=None,
 ):
     timestamp = datetime.datetime.now().isoformat()
 
@@ -51,8 +90,13 @@ def update_stock_in_supabase(
         "update_time": timestamp,
         "jan_code": jan_code,  # 🆕 追加
     }
+    if ranking_columns_enabled():
+        data["ranking_genre_id"] = ranking_genre_id  # ランキングのジャンル（楽天）
+        data["ranking_rank"] = ranking_rank  # ランキング順位
+    if content_store.is_enabled():
+        data["content_hash"] = content_hash  # mst_item_content のキー（商品名・説明の代わりに保存）
 
-    response = supabase.table("trn_ranked_item_stock").insert(data).execute()
+    response = get_supabase().table("trn_ranked_item_stock").insert(data).execute()
 
     if response.data:
         return data
@@ -61,21 +105,155 @@ def update_stock_in_supabase(
         return None
 
 
+# PostgreSQL に直接 COPY で一括登録（大量ロード向け）
+def insert_stock_data_via_copy(data_list):
+    import db_connector
+
+    timestamp = datetime.datetime.now().isoformat()
+    rows = []
+    for d in data_list:
+        row = {
+            "product_id": d["product_id"],
+            "product_name": d["product_name"],
+            "description": d.get("description", ""),
+            "site": d["site"],
+            "seller_site_id": d.get("seller_site_id", ""),
+            "seller_site_name": d.get("seller_site_name", ""),
+            "stock_status": d["stock_status"],
+            "price": d.get("price", 0),
+            "insert_time": timestamp,
+            "update_time": timestamp,
+            "jan_code": d.get("jan_code"),
+            "ranking_genre_id": d.get("ranking_genre_id"),
+            "ranking_rank": d.get("ranking_rank"),
+            "content_hash": d.get("content_hash"),
+        }
+        rows.append(row)
+
+    columns = stock_columns()
+    try:
+        db_connector.copy_rows("trn_ranked_item_stock", columns, ([r[c] for c in columns] for r in rows))
+        return rows
+    except Exception as e:
+        print(f"❌ エラー trn_ranked_item_stock COPY: {e}")
+        return []
+
+
+# 登録したレコードをストリーミング異常検知に流し、検知結果を登録
+def detect_stock_anomalies(inserted_rows):
+    if not stream_anomaly.is_enabled() or not inserted_rows:
+        return
+    try:
+        monitor = stream_anomaly.get_monitor()
+        monitor.observe_many(inserted_rows, "trn_ranked_item_stock")
+        count = monitor.flush(get_supabase())
+        if count:
+            print(f"⚠️ 異常を検知しました: {count}件")
+    except Exception as e:
+        print(f"❌ エラー 異常検知: {e}")
+
+
+# 登録したレコードで在庫区間（trn_stock_intervals）を延長・分割
+def update_stock_intervals(inserted_rows):
+    if not stock_intervals.is_enabled() or not inserted_rows:
+        return
+    try:
+        maintainer = stock_intervals.get_maintainer()
+        maintainer.observe_many(inserted_rows)
+        maintainer.flush()
+    except Exception as e:
+        print(f"❌ エラー 在庫区間の更新: {e}")
+
+
+# 登録したレコードで hourly / daily ロールアップを更新
+def update_stock_rollups(inserted_rows):
+    if not stock_rollup.is_enabled() or not inserted_rows:
+        return
+    try:
+        maintainer = stock_rollup.get_maintainer()
+        maintainer.observe_many(inserted_rows)
+        maintainer.flush()
+    except Exception as e:
+        print(f"❌ エラー ロールアップの更新: {e}")
+
+
+# 登録したレコードで JAN コード別の出品一覧を更新
+def update_jan_index(inserted_rows):
+    if not jan_index.is_enabled() or not inserted_rows:
+        return
+    try:
+        maintainer = jan_index.get_maintainer()
+        maintainer.observe_many(inserted_rows)
+        maintainer.flush()
+    except Exception as e:
+        print(f"❌ エラー JANインデックスの更新: {e}")
+
+
+# 商品名・説明を mst_item_content に移し、行には content_hash だけを残す
+def dedupe_stock_content(data_list):
+    store = content_store.get_store()
+    # 呼び出し元のデータを書き換えないようコピーしてから置き換える
+    rows = store.prepare([dict(d) for d in data_list])
+    # 行より先に文字列を登録しておく（失敗した場合は行も登録しない）
+    store.flush()
+    return rows
+
+
 # リスト形式のデータをまとめて登録
 def insert_stock_data(data_list):
     if data_list:
-        for d in data_list:
-            update_stock_in_supabase(
-                product_id=d["product_id"],
-                product_name=d["product_name"],
-                site=d["site"],
-                stock_status=d["stock_status"],
-                description=d.get("description", ""),
-                seller_site_id=d.get("seller_site_id", ""),
-                seller_site_name=d.get("seller_site_name", ""),
-                price=d.get("price", 0),
-                jan_code=d.get("jan_code")  # 🆕 追加
-            )
+        if content_store.is_enabled():
+            data_list = dedupe_stock_content(data_list)
+
+        if STOCK_WRITE_BACKEND == "postgres":
+            inserted_rows = insert_stock_data_via_copy(data_list)
+        else:
+            inserted_rows = insert_stock_data_via_supabase(data_list)
+
+        counter("stock_db_rows_written_total", "DBに書き込んだ行数").inc(len(inserted_rows), table="trn_ranked_item_stock")
+        detect_stock_anomalies(inserted_rows)
+        update_stock_intervals(inserted_rows)
+        update_stock_rollups(inserted_rows)
+        update_jan_index(inserted_rows)
+        return len(inserted_rows)
+    return 0
+
+
+# 取得と並行して届くデータを batch_size 件ずつ登録（途中で失敗しても登録済みの分は残る）
+def insert_stock_stream(items, batch_size=STOCK_STREAM_BATCH_SIZE):
+    total = 0
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            total += insert_stock_data(batch)
+            batch = []
+    if batch:
+        total += insert_stock_data(batch)
+    return total
+
+
+# PostgREST 経由で 1 件ずつ登録
+def insert_stock_data_via_supabase(data_list):
+    inserted_rows = []
+    for d in data_list:
+        row = update_stock_in_supabase(
+            product_id=d["product_id"],
+            product_name=d["product_name"],
+            site=d["site"],
+            stock_status=d["stock_status"],
+            description=d.get("description", ""),
+            seller_site_id=d.get("seller_site_id", ""),
+            seller_site_name=d.get("seller_site_name", ""),
+            price=d.get("price", 0),
+            jan_code=d.get("jan_code"),  # 🆕 追加
+            ranking_genre_id=d.get("ranking_genre_id"),
+            ranking_rank=d.get("ranking_rank"),
+            content_hash=d.get("content_hash"),
+        )
+        if row:
+            inserted_rows.append(row)
+    return inserted_rows
 
 
 # 実行テスト用サンプル
@@ -1,15 +1,41 @@
+import os
+import sys
+from contextlib import contextmanager
+
 from common.logger import log_info, log_response  # インポート
 
-from database.supabase_insert import insert_stock_data
+from database.supabase_insert import insert_stock_data, insert_stock_stream
 # from data_acquisition.fetch_amazon import fetch_amazon_stock
 from data_acquisition.fetch_rakuten import fetch_rakuten_stock
-from data_acquisition.fetch_yahoo import fetch_yahoo_stock
+from data_acquisition.fetch_yahoo import iter_yahoo_stock
 from data_acquisition.summary_item import aggregate_and_upsert_site_item
 
 from data_acquisition.fetch_rakuten_from_mstItem import main_rakuten
 from data_acquisition.fetch_yahoo_shopping_from_mstItem import main_yahoo
 
-# while True:
+# 各モジュールと同じインスタンスを使うため、common をパスに追加してから読み込む
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "common")))
+from metrics import export_metrics, timer
+from dag import Checkpoint, DagRunner, Stage
+import profiling
+
+STAGE_METRIC = "stock_stage_duration_seconds"
+STAGE_HELP = "ステージごとの所要時間"
+
+# 途中で失敗した実行を再開するためのチェックポイント
+FETCH_CHECKPOINT_PATH = os.getenv("FETCH_CHECKPOINT_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "state", "fetch_checkpoint.json"
+)
+FETCH_MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", "2"))
+
+
+@contextmanager
+def stage(name):
+    """ステージの所要時間を計測し、有効ならプロファイルも取る"""
+    with timer(STAGE_METRIC, STAGE_HELP, stage=name), profiling.profile_stage(name):
+        yield
+
+
 # amazon_data = fetch_amazon_stock()
 # amazon_data = [{"product_name": "PS5", "site": "Amazon", "stock_status": True}]
 # # レスポンスをログファイルに保存
@@ -17,32 +43,68 @@ from data_acquisition.fetch_yahoo_shopping_from_mstItem import main_yahoo
 # #insert_stock_data(amazon_data)
 # log_info(f" 📦 amazon在庫データ更新完了")
 
-rakuten_data = fetch_rakuten_stock()
-# レスポンスをログファイルに保存
-# log_response("rakuten_data",rakuten_data)
-insert_stock_data(rakuten_data)
-log_info(f" 📦 rakuten在庫データ更新完了")
+def run_rakuten_ranking(progress):
+    rakuten_data = fetch_rakuten_stock()
+    # レスポンスをログファイルに保存
+    # log_response("rakuten_data",rakuten_data)
+    insert_stock_data(rakuten_data)
+    log_info(f" 📦 rakuten在庫データ更新完了")
+
+
+def run_yahoo_ranking(progress):
+    # 在庫確認が終わった商品から順にまとめて登録する
+    count = insert_stock_stream(iter_yahoo_stock())
+    log_info(f" 📦 yahoo在庫データ更新完了（{count}件）")
+
+
+def run_aggregate_site_item(progress):
+    # ランキングに上がった商品を集計してmst_site_itemにupsertする
+    aggregate_and_upsert_site_item()
+    log_info(f" 📦 mst_site_item更新完了")
+
+
+def run_rakuten_item_sync(progress):
+    main_rakuten(progress)
+    log_info(f" 📦 rakuten 過去にランキングに上がった商品ごとの在庫データ更新完了")
+
 
-yahoo_data = fetch_yahoo_stock()
-# レスポンスをログファイルに保存
-# log_response("yahoo_data",yahoo_data)
-insert_stock_data(yahoo_data)
-log_info(f" 📦 yahoo在庫データ更新完了")
+def run_yahoo_item_sync(progress):
+    main_yahoo(progress)
+    log_info(f" 📦 yashoo 過去にランキングに上がった商品ごとの在庫データ更新完了")
 
 
-# ランキングに上がった商品を集計してmst_site_itemにupsertする
-aggregate_and_upsert_site_item()
-log_info(f" 📦 mst_site_item更新完了")
+# 2つのランキング取得、2つの商品同期はそれぞれ独立しているので並列に実行する
+FETCH_STAGES = [
+    Stage("rakuten_ranking", run_rakuten_ranking),
+    Stage("yahoo_ranking", run_yahoo_ranking),
+    Stage("aggregate_site_item", run_aggregate_site_item, deps=["rakuten_ranking", "yahoo_ranking"]),
+    Stage("rakuten_item_sync", run_rakuten_item_sync, deps=["aggregate_site_item"]),
+    Stage("yahoo_item_sync", run_yahoo_item_sync, deps=["aggregate_site_item"]),
+]
 
 
-main_rakuten()
-log_info(f" 📦 rakuten 過去にランキングに上がった商品ごとの在庫データ更新完了")
+def run_fetch_cycle(fresh=False):
+    """取得処理を 1 回実行する。前回が途中で失敗していれば続きから再開する"""
+    checkpoint = Checkpoint(FETCH_CHECKPOINT_PATH)
+    if fresh:
+        checkpoint.clear()
+    elif checkpoint.resumed:
+        log_info(f" ⏩ 前回の実行（{checkpoint.state['started_at']}開始）を再開します")
 
-main_yahoo()
-log_info(f" 📦 yashoo 過去にランキングに上がった商品ごとの在庫データ更新完了")
+    runner = DagRunner(FETCH_STAGES, checkpoint, max_workers=FETCH_MAX_WORKERS, stage_context=stage, log=log_info)
+    failed = runner.run()
 
+    if failed:
+        log_info(f" ❌ 失敗したステージ: {', '.join(failed)}（次回実行時に続きから再開します）")
+    else:
+        log_info(f" 📦 すべての在庫データ更新完了")
+    export_metrics("fetch")
+    log_info("-" * 50 + "\n")
+    return failed
 
-log_info(f" 📦 すべての在庫データ更新完了")
-log_info("-" * 50 + "\n")
 
-# # time.sleep(3600)  # 1時間ごとに実行
+if __name__ == "__main__":
+    # PROFILE=1 / --profile でステージごとのプロファイルを出力
+    profiling.configure("fetch", sys.argv[1:])
+    failed = run_fetch_cycle(fresh="--fresh" in sys.argv[1:])
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,347 @@
+"""
+スクリプト名: backtest.py
+
+目的:
+予測モデル（auto_arima / LSTM / Croston / 単純なベースライン）を、同じ過去データでローリング起点の検証にかけ、
+どのモデルが在庫をよく予測できるかを比較表にする。
+
+検証方法:
+商品ごとに日次の在庫あり率の系列を作り、起点 t を step 日ずつ進めながら
+「t より前で学習 → t から horizon 日を予測 → 実測と比較」を繰り返す（1 回を fold と呼ぶ）。
+商品は ProcessPoolExecutor で並列に処理し、モデルが対応していれば fold 間で学習済みの状態を引き継ぐ
+（auto_arima は最初の fold で次数を選び、以降は新しい観測で update するだけ。LSTM は重みを引き継いで追加学習）。
+
+指標（全 fold をまとめた配列で一括計算）:
+  mae                … 予測（0〜1 に丸めた値）と実測の在庫あり率の平均絶対誤差
+  brier              … 在庫あり（実測 >= 0.5）を確率として予測したときの Brier スコア
+  stockout_hit_rate  … 予測期間内に在庫切れが起きた fold のうち、在庫切れ日を ±許容日数で当てた割合
+  false_alarm_rate   … 在庫切れが起きなかった fold のうち、在庫切れを予測してしまった割合
+
+使い方:
+python src/prediction/backtest.py --models naive,moving_average,croston,auto_arima --horizon 7 --folds 5
+python src/prediction/backtest.py --limit 200 --output backtest.csv
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../common")))
+from metrics import counter, export_metrics, gauge
+from stock_panel import build_panel
+from series_triage import croston_sba
+
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", "0")) or os.cpu_count() or 1
+DEFAULT_MODELS = ["naive", "moving_average", "croston", "auto_arima"]
+AVAILABLE_MODELS = ["naive", "moving_average", "croston", "auto_arima", "lstm"]
+
+# 在庫あり率がこれを下回った日を在庫切れとみなす
+STOCKOUT_THRESHOLD = 0.5
+MOVING_AVERAGE_WINDOW = 7
+LSTM_EPOCHS = 10
+LSTM_UPDATE_EPOCHS = 2
+
+
+def build_series(df):
+    """
+    train_arima.fetch_stock_data() の結果（update_time が index）から、
+    商品ごとの日次在庫あり率の系列 {(site, seller_site, product_id): ndarray} を作る
+    """
+    panel = build_panel(df, freq="D")
+    return {key: panel.slice(i) for i, key in panel.items()}
+
+
+def fold_origins(length, horizon, min_train, step, max_folds):
+    """検証に使う起点の位置（新しいものから max_folds 個を古い順に並べる）"""
+    origins = list(range(min_train, length - horizon + 1, step))
+    return origins[-max_folds:] if max_folds else origins
+
+
+class NaiveForecaster:
+    """最後の観測値をそのまま延ばす"""
+
+    def fit(self, y):
+        self.last = y[-1]
+
+    def update(self, y_new, y):
+        self.last = y[-1]
+
+    def predict(self, horizon):
+        return np.full(horizon, self.last)
+
+
+class MovingAverageForecaster:
+    """直近 window 日の平均を延ばす"""
+
+    def __init__(self, window=MOVING_AVERAGE_WINDOW):
+        self.window = window
+
+    def fit(self, y):
+        self.level = y[-self.window:].mean()
+
+    def update(self, y_new, y):
+        self.fit(y)
+
+    def predict(self, horizon):
+        return np.full(horizon, self.level)
+
+
+class CrostonForecaster:
+    """在庫切れを間欠需要とみなした Croston/SBA（series_triage で intermittent に使う方法）"""
+
+    def fit(self, y):
+        self.level = 1.0 - croston_sba(1.0 - y)
+
+    def update(self, y_new, y):
+        self.fit(y)
+
+    def predict(self, horizon):
+        return np.full(horizon, self.level)
+
+
+class AutoArimaForecaster:
+    """最初の fold で auto_arima による次数選定を行い、以降は update で係数だけ更新する"""
+
+    def fit(self, y):
+        from pmdarima import auto_arima
+
+        self.model = auto_arima(
+            y,
+            seasonal=False,
+            stepwise=True,
+            suppress_warnings=True,
+            error_action="ignore",
+            trace=False,
+        )
+
+    def update(self, y_new, y):
+        if len(y_new):
+            self.model.update(y_new)
+
+    def predict(self, horizon):
+        return np.asarray(self.model.predict(n_periods=horizon), dtype=float)
+
+
+class LstmForecaster:
+    """train_lstm と同じ構成のモデルで「前日の値 → 当日の値」を学習し、予測は 1 日ずつ繰り返す"""
+
+    def fit(self, y):
+        from train_lstm import build_lstm_model
+
+        self.model = build_lstm_model()
+        self._train(y, LSTM_EPOCHS)
+
+    def update(self, y_new, y):
+        # 重みを引き継ぎ、新しい観測を含む区間だけ追加で学習する
+        if len(y_new):
+            self._train(y[-(len(y_new) + 1):], LSTM_UPDATE_EPOCHS)
+        self.last = y[-1]
+
+    def _train(self, y, epochs):
+        X = y[:-1].reshape(-1, 1, 1)
+        target = y[1:].reshape(-1, 1)
+        self.model.fit(X, target, batch_size=8, epochs=epochs, verbose=0)
+        self.last = y[-1]
+
+    def predict(self, horizon):
+        values = []
+        current = self.last
+        for _ in range(horizon):
+            current = float(self.model.predict(np.array([[[current]]]), verbose=0)[0][0])
+            values.append(current)
+        return np.array(values)
+
+
+FORECASTERS = {
+    "naive": NaiveForecaster,
+    "moving_average": MovingAverageForecaster,
+    "croston": CrostonForecaster,
+    "auto_arima": AutoArimaForecaster,
+    "lstm": LstmForecaster,
+}
+
+
+def backtest_product(task):
+    """
+    1 商品分のローリング起点検証（プロセスプールのワーカーで実行）。
+    戻り値: {model: {"forecasts": (fold, horizon), "actuals": (fold, horizon), "seconds": 秒, "error": str|None}}
+    """
+    key, y, models, horizon, min_train, step, max_folds = task
+    origins = fold_origins(len(y), horizon, min_train, step, max_folds)
+    results = {}
+
+    for name in models:
+        forecaster = FORECASTERS[name]()
+        forecasts, actuals = [], []
+        started = time.perf_counter()
+        error = None
+        try:
+            previous = None
+            for origin in origins:
+                history = y[:origin]
+                if previous is None:
+                    forecaster.fit(history)
+                else:
+                    forecaster.update(y[previous:origin], history)
+                previous = origin
+                forecasts.append(forecaster.predict(horizon))
+                actuals.append(y[origin:origin + horizon])
+        except Exception as e:
+            # 1 モデルの失敗で他のモデルの結果を捨てない
+            error = f"{type(e).__name__}: {e}"
+            forecasts, actuals = [], []
+
+        results[name] = {
+            "forecasts": np.array(forecasts, dtype=float).reshape(-1, horizon),
+            "actuals": np.array(actuals, dtype=float).reshape(-1, horizon),
+            "seconds": time.perf_counter() - started,
+            "error": error,
+        }
+    return key, results
+
+
+def compute_metrics(forecasts, actuals, tolerance_days=1):
+    """(fold, horizon) の予測と実測から指標をまとめて計算する"""
+    if len(forecasts) == 0:
+        return {
+            "mae": np.nan, "brier": np.nan,
+            "stockout_hit_rate": np.nan, "false_alarm_rate": np.nan, "stockout_folds": 0,
+        }
+
+    probability = np.clip(forecasts, 0.0, 1.0)
+    in_stock = (actuals >= STOCKOUT_THRESHOLD).astype(float)
+
+    actual_out = actuals < STOCKOUT_THRESHOLD
+    predicted_out = probability < STOCKOUT_THRESHOLD
+    has_actual = actual_out.any(axis=1)
+    has_predicted = predicted_out.any(axis=1)
+    # 期間内で最初に在庫切れになる日（起きない fold の値は has_* で除外する）
+    actual_day = actual_out.argmax(axis=1)
+    predicted_day = predicted_out.argmax(axis=1)
+    hits = has_actual & has_predicted & (np.abs(actual_day - predicted_day) <= tolerance_days)
+
+    stockout_folds = int(has_actual.sum())
+    quiet_folds = int((~has_actual).sum())
+    return {
+        "mae": float(np.abs(probability - actuals).mean()),
+        "brier": float(((probability - in_stock) ** 2).mean()),
+        "stockout_hit_rate": hits.sum() / stockout_folds if stockout_folds else np.nan,
+        "false_alarm_rate": (has_predicted & ~has_actual).sum() / quiet_folds if quiet_folds else np.nan,
+        "stockout_folds": stockout_folds,
+    }
+
+
+def run_backtest(series, models=None, horizon=7, min_train=14, step=7, max_folds=5,
+                 tolerance_days=1, max_workers=None):
+    """全商品を並列に検証し、モデルごとの比較表（DataFrame）を返す"""
+    models = models or DEFAULT_MODELS
+    unknown = [m for m in models if m not in FORECASTERS]
+    if unknown:
+        raise ValueError(f"未対応のモデル: {unknown}（対応: {AVAILABLE_MODELS}）")
+
+    tasks = [
+        (key, y, models, horizon, min_train, step, max_folds)
+        for key, y in series.items()
+        if len(y) >= min_train + horizon
+    ]
+    print(f"🔁 バックテスト: {len(tasks)}商品（対象外 {len(series) - len(tasks)}商品）× {models}")
+
+    collected = {name: {"forecasts": [], "actuals": [], "seconds": 0.0, "products": 0, "errors": 0, "first_error": None} for name in models}
+    max_workers = max_workers or BACKTEST_WORKERS
+    # 1 タスクが軽いベースラインだけのときもプロセス間通信で遅くならないようにまとめて渡す
+    chunksize = max(1, len(tasks) // (max_workers * 4))
+
+    def collect(results):
+        for name, result in results.items():
+            entry = collected[name]
+            entry["seconds"] += result["seconds"]
+            if result["error"]:
+                entry["errors"] += 1
+                entry["first_error"] = entry["first_error"] or result["error"]
+                continue
+            entry["products"] += 1
+            entry["forecasts"].append(result["forecasts"])
+            entry["actuals"].append(result["actuals"])
+
+    if max_workers == 1:
+        for task in tasks:
+            collect(backtest_product(task)[1])
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for _, results in executor.map(backtest_product, tasks, chunksize=chunksize):
+                collect(results)
+
+    rows = []
+    for name, entry in collected.items():
+        if entry["errors"]:
+            print(f"⚠ {name}: {entry['errors']}商品で失敗しました（例: {entry['first_error']}）")
+        forecasts = np.concatenate(entry["forecasts"]) if entry["forecasts"] else np.empty((0, horizon))
+        actuals = np.concatenate(entry["actuals"]) if entry["actuals"] else np.empty((0, horizon))
+        scores = compute_metrics(forecasts, actuals, tolerance_days)
+        rows.append({
+            "model": name,
+            "products": entry["products"],
+            "errors": entry["errors"],
+            "folds": len(forecasts),
+            **scores,
+            "fit_seconds": entry["seconds"],
+        })
+        counter("stock_backtest_folds_total", "バックテストで評価した fold 数").inc(len(forecasts), model=name)
+        if not np.isnan(scores["mae"]):
+            gauge("stock_backtest_mae", "バックテストの平均絶対誤差").set(scores["mae"], model=name)
+
+    return pd.DataFrame(rows).set_index("model").sort_values("mae")
+
+
+def main(argv=None):
+    import argparse
+    from train_arima import fetch_stock_data
+
+    parser = argparse.ArgumentParser(description="予測モデルをローリング起点で検証して比較する")
+    parser.add_argument("--models", default=",".join(DEFAULT_MODELS), help=f"カンマ区切り（{', '.join(AVAILABLE_MODELS)}）")
+    parser.add_argument("--horizon", type=int, default=7, help="1 fold で予測する日数")
+    parser.add_argument("--min-train", type=int, default=14, help="最初の fold の学習に使う最小日数")
+    parser.add_argument("--step", type=int, default=7, help="起点を進める日数")
+    parser.add_argument("--folds", type=int, default=5, help="商品あたりの最大 fold 数（0 で全て）")
+    parser.add_argument("--tolerance", type=int, default=1, help="在庫切れ日の許容誤差（日）")
+    parser.add_argument("--workers", type=int, default=BACKTEST_WORKERS)
+    parser.add_argument("--limit", type=int, default=0, help="先頭の N 商品だけを対象にする")
+    parser.add_argument("--output", help="比較表を CSV で保存するパス")
+    args = parser.parse_args(argv)
+
+    df = fetch_stock_data()
+    if df is None or df.empty:
+        print("⚠ データがないため、バックテストを実行しません。")
+        return None
+
+    series = build_series(df)
+    if args.limit:
+        series = dict(list(series.items())[:args.limit])
+
+    started = time.perf_counter()
+    table = run_backtest(
+        series,
+        models=[m.strip() for m in args.models.split(",") if m.strip()],
+        horizon=args.horizon,
+        min_train=args.min_train,
+        step=args.step,
+        max_folds=args.folds,
+        tolerance_days=args.tolerance,
+        max_workers=args.workers,
+    )
+    print(f"⏱ バックテスト完了: {time.perf_counter() - started:.1f}秒")
+    print(table.to_string(float_format=lambda v: f"{v:.4f}"))
+
+    if args.output:
+        table.to_csv(args.output)
+        print(f"✅ 比較表を保存しました: {args.output}")
+    export_metrics("backtest")
+    return table
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+スクリプト名: dirty_set.py
+
+目的:
+前回の予測以降に新しいスナップショットが登録された商品（dirty set）を求め、
+予測サイクルで前処理・再学習する商品をそれだけに絞る。
+
+仕組み:
+trn_ranked_item_stock の id は登録順に増えるため、前回のサイクル開始時点の最大 id を
+ウォーターマークとして状態ファイルに保存し、次のサイクルでは「id > ウォーターマーク」の行の
+product_id だけを読む。読み込む量は前回からの登録件数に比例し、商品数には依存しない。
+
+serial の id は採番順にコミットされるとは限らず、ウォーターマークを取った時点で登録中だった行は
+後からウォーターマーク以下の id で見えるようになる。そのため読んだ範囲で欠けていた id を
+pending_ids として状態ファイルに残し、次のサイクルでその id だけを読み直す。
+ロールバックなどで永久に欠番になる id は、最大 id から PREDICTION_WATERMARK_OVERLAP 件（既定 1000）より
+古くなった時点で追跡をやめる。それより遅れてコミットされた行は、次の全商品の処理まで反映されない。
+
+一定時間（PREDICTION_FULL_REFRESH_HOURS、既定 24 時間）ごと、または状態ファイルがないときは
+全商品を対象にする（削除・直接更新など、id の増加で検出できない変更を取り込むため）。
+"""
+
+import datetime
+import json
+import os
+
+from metrics import counter
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WATERMARK_PATH = os.getenv("PREDICTION_WATERMARK_PATH") or os.path.abspath(
+    os.path.join(BASE_DIR, "..", "state", "prediction_watermark.json")
+)
+FULL_REFRESH_HOURS = float(os.getenv("PREDICTION_FULL_REFRESH_HOURS", "24"))
+# 欠番の id を遅れてコミットされる行として追跡する範囲（最大 id からの件数）
+WATERMARK_OVERLAP = int(os.getenv("PREDICTION_WATERMARK_OVERLAP", "1000"))
+
+SOURCE_TABLE = "trn_ranked_item_stock"
+PAGE_SIZE = 1000
+# in_ フィルタ 1 回で指定する id 数（URL 長の制限に収まるように）
+ID_CHUNK_SIZE = 200
+
+
+def is_enabled():
+    return os.getenv("PREDICTION_INCREMENTAL", "1") == "1"
+
+
+class Watermark:
+    """前回処理した最大 id、その時点で欠番だった id（pending_ids）と、最後に全商品を処理した時刻"""
+
+    def __init__(self, path=WATERMARK_PATH):
+        self.path = path
+        self.last_id = None
+        self.pending_ids = []
+        self.last_full_refresh = None
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    state = json.load(f)
+                self.last_id = state.get("last_id")
+                self.pending_ids = list(state.get("pending_ids") or [])
+                if state.get("last_full_refresh"):
+                    self.last_full_refresh = datetime.datetime.fromisoformat(state["last_full_refresh"])
+            except (OSError, ValueError):
+                # 壊れた状態ファイルは無視して全件から始める
+                self.last_id = None
+                self.pending_ids = []
+                self.last_full_refresh = None
+
+    def full_refresh_due(self, now=None):
+        if self.last_id is None or self.last_full_refresh is None:
+            return True
+        now = now or datetime.datetime.now()
+        return now - self.last_full_refresh >= datetime.timedelta(hours=FULL_REFRESH_HOURS)
+
+    def save(self, last_id, pending_ids=(), full_refresh=False, now=None):
+        """サイクルが成功したときだけ呼ぶ（失敗したサイクルの変更は次回も dirty のまま残る）"""
+        self.last_id = last_id
+        self.pending_ids = sorted(pending_ids)
+        if full_refresh:
+            self.last_full_refresh = now or datetime.datetime.now()
+        state = {
+            "last_id": self.last_id,
+            "pending_ids": self.pending_ids,
+            "last_full_refresh": self.last_full_refresh.isoformat() if self.last_full_refresh else None,
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def latest_id(client):
+    """trn_ranked_item_stock の現在の最大 id（行がなければ 0）"""
+    response = client.table(SOURCE_TABLE).select("id").order("id", desc=True).limit(1).execute()
+    return response.data[0]["id"] if response.data else 0
+
+
+def find_dirty_products(client, after_id, until_id, pending_ids=()):
+    """
+    after_id < id <= until_id の行、または前回欠番だった pending_ids の行がある product_id の集合と、
+    次回に読み直す欠番の id（最大 id から WATERMARK_OVERLAP 件以内のもの）を返す。
+    """
+    dirty = set()
+    seen = set()
+    cursor = after_id
+    fetched = 0
+    while cursor < until_id:
+        # id の範囲で読み進めるので、offset が大きくなっても遅くならない
+        response = (
+            client.table(SOURCE_TABLE)
+            .select("id, product_id")
+            .gt("id", cursor)
+            .lte("id", until_id)
+            .order("id")
+            .limit(PAGE_SIZE)
+            .execute()
+        )
+        if not response.data:
+            break
+        for row in response.data:
+            dirty.add(row["product_id"])
+            seen.add(row["id"])
+        fetched += len(response.data)
+        cursor = response.data[-1]["id"]
+
+    pending_ids = sorted(pending_ids)
+    for i in range(0, len(pending_ids), ID_CHUNK_SIZE):
+        response = (
+            client.table(SOURCE_TABLE)
+            .select("id, product_id")
+            .in_("id", pending_ids[i:i + ID_CHUNK_SIZE])
+            .execute()
+        )
+        for row in response.data or []:
+            dirty.add(row["product_id"])
+            seen.add(row["id"])
+        fetched += len(response.data or [])
+    counter("stock_db_rows_fetched_total", "DBから取得した行数").inc(fetched, table=SOURCE_TABLE)
+
+    oldest = until_id - WATERMARK_OVERLAP
+    missing = {i for i in range(max(after_id, oldest) + 1, until_id + 1) if i not in seen}
+    missing.update(i for i in pending_ids if i > oldest and i not in seen)
+    return dirty, missing
+
+
+def find_missing_ids(client, until_id):
+    """
+    最大 id から WATERMARK_OVERLAP 件以内の欠番の id（全商品を処理したサイクルの後に追跡を始める分）。
+    """
+    return find_dirty_products(client, max(until_id - WATERMARK_OVERLAP, 0), until_id)[1]
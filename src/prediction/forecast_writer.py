@@ -0,0 +1,115 @@
+"""
+スクリプト名: forecast_writer.py
+
+目的:
+商品ごとの予測結果を、学習を続けながら一定件数ずつ Supabase に upsert する。
+
+- add() で受け取った予測を上限付きのバッファに溜め、chunk_size 件たまるごとに 1 回の upsert として送る。
+- 送信は別スレッドで行い、学習はその間も進む。送信待ちのチャンクは max_pending 個までで、
+  それを超えると add() が待つため、メモリ使用量は商品数に比例しない。
+- 失敗したチャンクは間隔を延ばしながら max_retries 回まで送り直す。それでも失敗したチャンクは
+  件数を記録して残りの送信を続ける（1 回の失敗で実行全体の結果を失わない）。
+- close() で残りを送り、保存できた件数・失敗した件数を返す。
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import counter
+
+FORECAST_CHUNK_SIZE = int(os.getenv("FORECAST_CHUNK_SIZE", "500"))
+FORECAST_MAX_RETRIES = int(os.getenv("FORECAST_MAX_RETRIES", "3"))
+FORECAST_RETRY_BACKOFF = float(os.getenv("FORECAST_RETRY_BACKOFF", "1.0"))
+FORECAST_MAX_PENDING = 2
+
+
+def forecast_records(forecast_df):
+    """予測 DataFrame（update_time, forecast, site, seller_site, product_id）を upsert 用の dict にする"""
+    times = forecast_df["update_time"].map(lambda t: t.isoformat())
+    return [
+        {
+            "forecast_datetime": forecast_datetime,
+            "forecast": float(forecast),
+            "site": site,
+            "seller_site": seller_site,
+            "product_id": product_id,
+        }
+        for forecast_datetime, forecast, site, seller_site, product_id in zip(
+            times, forecast_df["forecast"], forecast_df["site"], forecast_df["seller_site"], forecast_df["product_id"]
+        )
+    ]
+
+
+class ForecastWriter:
+    def __init__(self, client_getter, table, on_conflict, chunk_size=None, max_retries=None,
+                 retry_backoff=None, max_pending=FORECAST_MAX_PENDING, sleep=time.sleep):
+        self._client_getter = client_getter
+        self.table = table
+        self.on_conflict = on_conflict
+        self.chunk_size = chunk_size or FORECAST_CHUNK_SIZE
+        self.max_retries = FORECAST_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_backoff = FORECAST_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self._sleep = sleep
+
+        self._buffer = []
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.retried = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, forecast_df):
+        """1 商品分の予測を追加する（バッファがたまれば送信を始める）"""
+        self.add_records(forecast_records(forecast_df))
+
+    def add_records(self, records):
+        self._buffer.extend(records)
+        while len(self._buffer) >= self.chunk_size:
+            chunk, self._buffer = self._buffer[:self.chunk_size], self._buffer[self.chunk_size:]
+            self._submit(chunk)
+
+    def _submit(self, chunk):
+        # 送信待ちが max_pending 個ある間は待つ
+        self._slots.acquire()
+        self._executor.submit(self._send, chunk)
+
+    def _send(self, chunk):
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self._client_getter().table(self.table).upsert(chunk, on_conflict=self.on_conflict).execute()
+                    with self._lock:
+                        self.written += len(chunk)
+                    counter("stock_db_rows_written_total", "DBに書き込んだ行数").inc(len(chunk), table=self.table)
+                    return
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        with self._lock:
+                            self.failed += len(chunk)
+                        counter("stock_forecast_rows_failed_total", "保存に失敗した予測の行数").inc(len(chunk), table=self.table)
+                        print(f"❌ 予測データの保存に失敗（{len(chunk)}件）: {e}")
+                        return
+                    with self._lock:
+                        self.retried += 1
+                    wait = self.retry_backoff * (2 ** attempt)
+                    print(f"⚠ 予測データの保存に失敗したため {wait:.1f}秒後に再送します（{attempt + 1}/{self.max_retries}）: {e}")
+                    self._sleep(wait)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """残りのバッファを送り、送信の完了を待って保存件数を返す"""
+        if self._buffer:
+            chunk, self._buffer = self._buffer, []
+            self._submit(chunk)
+        self._executor.shutdown(wait=True)
+        return self.written
@@ -0,0 +1,149 @@
+"""
+スクリプト名: series_triage.py
+
+目的:
+全商品の在庫系列をまとめて分類し、それぞれ十分な精度が出る最も安い予測方法に振り分ける。
+
+分類:
+  constant      … stock_status が一度も変わっていない。最後の値をそのまま予測にする（学習なし）
+  intermittent  … 在庫切れの発生がまれ、または観測が少ない。在庫切れを「間欠需要」とみなし Croston（SBA 補正）で予測
+  regular       … 上記以外。従来どおり auto_arima で学習
+  long_volatile … 観測期間が長い、または状態の変化が多い。auto_arima で学習するが、直近の期間だけに絞る
+
+分類に使う統計量は groupby の集計で全商品分を一度に計算する（商品ごとのループはしない）。
+
+有効化:
+環境変数 SERIES_TRIAGE_ENABLED=0 で無効化（全商品を auto_arima に送る従来の動作）
+"""
+
+import os
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+CONSTANT = "constant"
+INTERMITTENT = "intermittent"
+REGULAR = "regular"
+LONG_VOLATILE = "long_volatile"
+KINDS = [CONSTANT, INTERMITTENT, REGULAR, LONG_VOLATILE]
+
+GROUP_KEYS = ["site", "seller_site", "product_id"]
+
+# 在庫あり率がこれを下回った時点を在庫切れとみなす（ロールアップ入力では stock_status が 0〜1 の比率）
+STOCKOUT_THRESHOLD = 0.5
+# 在庫切れの発生間隔の平均（日）がこれ以上なら間欠的とみなす
+INTERMITTENT_INTERVAL_DAYS = float(os.getenv("TRIAGE_INTERMITTENT_INTERVAL_DAYS", "14"))
+# これより観測時点が少ない系列は auto_arima に送らない（従来はここでスキップしていた）
+MIN_ARIMA_POINTS = 3
+# 状態が変化した割合がこれ以上、または観測期間がこれより長い系列は long_volatile
+VOLATILE_CHANGE_RATE = float(os.getenv("TRIAGE_VOLATILE_CHANGE_RATE", "0.3"))
+LONG_SERIES_DAYS = int(os.getenv("TRIAGE_LONG_SERIES_DAYS", "180"))
+# long_volatile の学習に使う直近の日数
+LONG_SERIES_WINDOW_DAYS = int(os.getenv("TRIAGE_LONG_SERIES_WINDOW_DAYS", "90"))
+
+CROSTON_ALPHA = 0.1
+FORECAST_DAYS = 10
+
+
+def is_enabled():
+    return os.getenv("SERIES_TRIAGE_ENABLED", "1") == "1"
+
+
+def classify_series(df):
+    """
+    update_time が index の在庫データから、商品ごとの統計量と分類（kind 列）を持つ DataFrame を返す。
+    index は (site, seller_site, product_id)。
+    """
+    status = df["stock_status"].astype(float)
+    keys = [df[k] for k in GROUP_KEYS]
+    grouped = status.groupby(keys, observed=True)
+
+    previous = grouped.shift(1)
+    changed = (status != previous) & previous.notna()
+    stockout = status < STOCKOUT_THRESHOLD
+    # 在庫あり → 在庫切れ に変わった時点（最初の観測が在庫切れの場合も 1 回と数える）
+    previous_stockout = previous < STOCKOUT_THRESHOLD
+    onset = stockout & ~previous_stockout
+    times = pd.Series(df.index, index=df.index)
+
+    stats = pd.DataFrame({
+        "points": times.groupby(keys, observed=True).nunique(),
+        "span_days": (
+            times.groupby(keys, observed=True).max() - times.groupby(keys, observed=True).min()
+        ).dt.days,
+        "distinct": grouped.nunique(),
+        "changes": changed.groupby(keys, observed=True).sum(),
+        "stockouts": onset.groupby(keys, observed=True).sum(),
+        "observations": grouped.size(),
+    })
+    stats["change_rate"] = stats["changes"] / (stats["observations"] - 1).clip(lower=1)
+    # 在庫切れの平均発生間隔（日）。一度も在庫切れがなければ無限大
+    stats["stockout_interval_days"] = (
+        stats["span_days"].clip(lower=1) / stats["stockouts"].replace(0, np.nan)
+    ).fillna(np.inf)
+
+    kind = np.select(
+        [
+            stats["distinct"] <= 1,
+            stats["points"] < MIN_ARIMA_POINTS,
+            (stats["span_days"] > LONG_SERIES_DAYS) | (stats["change_rate"] >= VOLATILE_CHANGE_RATE),
+            stats["stockout_interval_days"] >= INTERMITTENT_INTERVAL_DAYS,
+        ],
+        [CONSTANT, INTERMITTENT, LONG_VOLATILE, INTERMITTENT],
+        default=REGULAR,
+    )
+    stats["kind"] = pd.Categorical(kind, categories=KINDS)
+    return stats
+
+
+def croston_sba(values, alpha=CROSTON_ALPHA):
+    """
+    間欠需要 values（0 以上）の 1 期あたりの平均を Croston 法（SBA 補正）で推定する。
+    需要が一度もなければ 0。
+    """
+    values = np.asarray(values, dtype=float)
+    occurred = np.flatnonzero(values > 0)
+    if len(occurred) == 0:
+        return 0.0
+
+    size = values[occurred[0]]
+    interval = occurred[0] + 1.0
+    for previous, current in zip(occurred[:-1], occurred[1:]):
+        size += alpha * (values[current] - size)
+        interval += alpha * ((current - previous) - interval)
+    return (1 - alpha / 2) * size / interval
+
+
+def _forecast_frame(last_time, value, site, seller_site, product_id, periods=FORECAST_DAYS):
+    return pd.DataFrame({
+        "update_time": [last_time + timedelta(days=i) for i in range(1, periods + 1)],
+        "forecast": np.full(periods, float(value)),
+        "site": site,
+        "seller_site": seller_site,
+        "product_id": product_id,
+    })
+
+
+def constant_forecast(group, site, seller_site, product_id):
+    """最後の stock_status をそのまま予測値にする"""
+    return _forecast_frame(group.index[-1], group["stock_status"].astype(float).iloc[-1], site, seller_site, product_id)
+
+
+def intermittent_forecast(group, site, seller_site, product_id):
+    """在庫切れ（1 - 在庫あり率）を間欠需要として Croston/SBA で推定し、在庫あり率の予測にする"""
+    daily = group["stock_status"].astype(float)
+    if daily.index.freq is None:
+        daily = daily.resample("D").mean().ffill()
+    stockout_rate = croston_sba(1.0 - daily.to_numpy())
+    return _forecast_frame(group.index[-1], min(max(1.0 - stockout_rate, 0.0), 1.0), site, seller_site, product_id)
+
+
+def recent_window(group, days=LONG_SERIES_WINDOW_DAYS):
+    """long_volatile の系列を直近 days 日に絞る"""
+    return group[group.index >= group.index[-1] - timedelta(days=days)]
+
+
+def summarize(stats):
+    """分類ごとの件数（KINDS の順）"""
+    return stats["kind"].value_counts().reindex(KINDS, fill_value=0)
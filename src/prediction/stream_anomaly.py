@@ -0,0 +1,293 @@
+"""
+スクリプト名: stream_anomaly.py
+
+目的:
+取得処理（insert_stock_data / upsert_product_to_supabase）から呼び出され、
+レコードが届いた時点で異常（価格の急落・外れ値、在庫状態の頻繁な反転、
+同一販売元での一斉在庫切れ）を検知する。
+商品ごとの統計量（価格の EWMA と分散、在庫反転率）は配列ベースのストアで O(1) 更新し、
+テーブル全体の再読み込みは行わない。検知結果は「trn_stock_anomaly」テーブルに登録する。
+"""
+
+import datetime
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_DIR = os.path.join(BASE_DIR, "state")
+DEFAULT_STATE_PATH = os.path.join(STATE_DIR, "anomaly_state.npz")
+
+ANOMALY_TABLE = "trn_stock_anomaly"
+
+
+class ProductStatsStore:
+    """商品ごとの統計量を連続した NumPy 配列で保持するストア"""
+
+    def __init__(self, capacity=1024):
+        self.slots = {}
+        self.keys = []
+        self.mean_price = np.zeros(capacity, dtype=np.float64)
+        self.var_price = np.zeros(capacity, dtype=np.float64)
+        self.flip_rate = np.zeros(capacity, dtype=np.float32)
+        self.last_status = np.full(capacity, -1, dtype=np.int8)
+        self.count = np.zeros(capacity, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _grow(self):
+        capacity = len(self.count) * 2
+        self.mean_price = np.resize(self.mean_price, capacity)
+        self.var_price = np.resize(self.var_price, capacity)
+        self.flip_rate = np.resize(self.flip_rate, capacity)
+        last_status = np.full(capacity, -1, dtype=np.int8)
+        last_status[:len(self.last_status)] = self.last_status
+        self.last_status = last_status
+        count = np.zeros(capacity, dtype=np.int32)
+        count[:len(self.count)] = self.count
+        self.count = count
+
+    def slot(self, key):
+        """キーに対応する配列上の位置を返す（未登録なら割り当てる）"""
+        index = self.slots.get(key)
+        if index is None:
+            index = len(self.keys)
+            if index >= len(self.count):
+                self._grow()
+            self.mean_price[index] = 0.0
+            self.var_price[index] = 0.0
+            self.flip_rate[index] = 0.0
+            self.slots[key] = index
+            self.keys.append(key)
+        return index
+
+    def save(self, path):
+        """
+        統計量を .npz に保存する（ワンショット実行間で状態を引き継ぐため）。
+        一時ファイルは呼び出しごとに別名で作るため、複数のプロセスが同時に保存しても壊れない。
+        """
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        n = len(self.keys)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    keys=np.array(self.keys, dtype=str),
+                    mean_price=self.mean_price[:n],
+                    var_price=self.var_price[:n],
+                    flip_rate=self.flip_rate[:n],
+                    last_status=self.last_status[:n],
+                    count=self.count[:n],
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """保存済みの統計量を読み込む（存在しなければ空のストア）"""
+        if not os.path.exists(path):
+            return cls()
+
+        with np.load(path) as data:
+            keys = data["keys"].tolist()
+            store = cls(capacity=max(1024, len(keys) * 2))
+            n = len(keys)
+            store.mean_price[:n] = data["mean_price"]
+            store.var_price[:n] = data["var_price"]
+            store.flip_rate[:n] = data["flip_rate"]
+            store.last_status[:n] = data["last_status"]
+            store.count[:n] = data["count"]
+        store.keys = keys
+        store.slots = {key: i for i, key in enumerate(keys)}
+        return store
+
+
+class StreamingAnomalyDetector:
+    """到着したレコードを 1 件ずつ評価するオンライン異常検知器"""
+
+    def __init__(
+        self,
+        store=None,
+        alpha=0.2,
+        z_threshold=4.0,
+        crash_ratio=0.5,
+        flip_threshold=0.5,
+        min_samples=5,
+        seller_stockout_ratio=0.5,
+        seller_min_stockouts=5,
+    ):
+        self.store = store if store is not None else ProductStatsStore()
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.crash_ratio = crash_ratio
+        self.flip_threshold = flip_threshold
+        self.min_samples = min_samples
+        self.seller_stockout_ratio = seller_stockout_ratio
+        self.seller_min_stockouts = seller_min_stockouts
+        # 販売元ごとの (観測商品数, 在庫切れに転じた商品数)。drain_seller_events() でリセット
+        self._seller_counts = {}
+        self._lock = threading.Lock()
+
+    def observe(self, record, source_table):
+        """1 件のレコードで統計量を更新し、検知したイベントのリストを返す"""
+        site = record.get("site")
+        seller_site_id = record.get("seller_site_id")
+        product_id = record.get("product_id")
+        key = f"{source_table}|{site}|{seller_site_id}|{product_id}"
+        events = []
+
+        with self._lock:
+            store = self.store
+            i = store.slot(key)
+            n = int(store.count[i])
+
+            price = _to_float(record.get("price"))
+            if price is not None and price > 0:
+                mean = store.mean_price[i]
+                var = store.var_price[i]
+                if n >= self.min_samples and mean > 0:
+                    std = var ** 0.5
+                    if price < mean * (1 - self.crash_ratio):
+                        events.append(("price_crash", price, mean, price / mean))
+                    elif std > 0 and abs(price - mean) / std > self.z_threshold:
+                        events.append(("price_outlier", price, mean, (price - mean) / std))
+
+                if n == 0:
+                    store.mean_price[i] = price
+                else:
+                    diff = price - mean
+                    increment = self.alpha * diff
+                    store.mean_price[i] = mean + increment
+                    store.var_price[i] = (1 - self.alpha) * (var + diff * increment)
+
+            status = record.get("stock_status")
+            if status is not None:
+                status = 1 if status else 0
+                last = int(store.last_status[i])
+                if last >= 0:
+                    flipped = 1.0 if status != last else 0.0
+                    rate = (1 - self.alpha) * float(store.flip_rate[i]) + self.alpha * flipped
+                    store.flip_rate[i] = rate
+                    if flipped and n >= self.min_samples and rate > self.flip_threshold:
+                        events.append(("stock_flapping", float(status), float(last), rate))
+
+                    seller_key = (source_table, site, seller_site_id)
+                    observed, stockouts = self._seller_counts.get(seller_key, (0, 0))
+                    self._seller_counts[seller_key] = (observed + 1, stockouts + (last == 1 and status == 0))
+                store.last_status[i] = status
+
+            store.count[i] = n + 1
+
+        return [
+            _event_row(source_table, event_type, site, seller_site_id, product_id, value, expected, score)
+            for event_type, value, expected, score in events
+        ]
+
+    def drain_seller_events(self):
+        """販売元単位の一斉在庫切れを判定し、集計をリセットする"""
+        with self._lock:
+            seller_counts, self._seller_counts = self._seller_counts, {}
+
+        events = []
+        for (source_table, site, seller_site_id), (observed, stockouts) in seller_counts.items():
+            if stockouts >= self.seller_min_stockouts and stockouts / observed >= self.seller_stockout_ratio:
+                events.append(_event_row(
+                    source_table, "seller_mass_stockout", site, seller_site_id, None,
+                    stockouts, observed, stockouts / observed,
+                ))
+        return events
+
+    def save_state(self, path):
+        """統計量を保存する（observe() による更新の途中を書き出さないようにロックを取る）"""
+        with self._lock:
+            self.store.save(path)
+
+
+def _to_float(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _event_row(source_table, event_type, site, seller_site_id, product_id, value, expected, score):
+    return {
+        "detected_at": datetime.datetime.now().isoformat(),
+        "source_table": source_table,
+        "event_type": event_type,
+        "site": site,
+        "seller_site_id": seller_site_id,
+        "product_id": product_id,
+        "value": float(value),
+        "expected": float(expected),
+        "score": round(float(score), 4),
+    }
+
+
+class AnomalyMonitor:
+    """検知器と検知結果の書き込みをまとめたもの。取得処理からはこれを使う"""
+
+    def __init__(self, state_path=DEFAULT_STATE_PATH, detector=None):
+        self.state_path = state_path
+        self.detector = detector or StreamingAnomalyDetector(store=ProductStatsStore.load(state_path))
+        self.pending = []
+        self._lock = threading.Lock()
+        # 取り出し → INSERT → 状態の保存を 1 つずつ行う（並列のステージ・バッチから同時に呼ばれるため）
+        self._flush_lock = threading.Lock()
+
+    def observe(self, record, source_table):
+        events = self.detector.observe(record, source_table)
+        if events:
+            with self._lock:
+                self.pending.extend(events)
+        return events
+
+    def observe_many(self, records, source_table):
+        for record in records:
+            self.observe(record, source_table)
+
+    def flush(self, client):
+        """
+        販売元単位の判定を行い、溜まったイベントを 1 回の INSERT で登録して状態を保存する。
+        登録に失敗したイベントは pending に戻して次回の flush で再送する（例外はそのまま送出）。
+        """
+        with self._flush_lock:
+            seller_events = self.detector.drain_seller_events()
+            with self._lock:
+                events, self.pending = self.pending + seller_events, []
+
+            if events:
+                try:
+                    client.table(ANOMALY_TABLE).insert(events).execute()
+                except Exception:
+                    with self._lock:
+                        # 取り出した後に届いたイベントより前に戻す
+                        self.pending[:0] = events
+                    raise
+            self.detector.save_state(self.state_path)
+        return len(events)
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_monitor():
+    """プロセス内で共有する AnomalyMonitor を返す（初回呼び出し時に状態を読み込む）"""
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = AnomalyMonitor(state_path=os.getenv("ANOMALY_STATE_PATH", DEFAULT_STATE_PATH))
+        return _monitor
+
+
+def is_enabled():
+    return os.getenv("STREAM_ANOMALY_ENABLED", "1") != "0"
@@ -1,39 +1,31 @@
 import os
+import sys
+import time
 from dotenv import load_dotenv
 import pandas as pd
 from datetime import timedelta
-import matplotlib.pyplot as plt
-from supabase import create_client, Client
-from pmdarima import auto_arima
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../common")))
+from stock_loader import PRETREATMENT_COLUMNS, load_stock_frame
+from metrics import counter, gauge, timer
+from supabase_client import get_supabase
+from stock_rollup import fetch_rollup_data, use_rollup_input
+import series_triage
+from forecast_writer import ForecastWriter
 
 # .env ファイルの読み込み
 load_dotenv()
 
-# Supabaseの設定
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-
-def fetch_stock_data():
-    """ trn_ranked_item_stock_pretreatment からデータ取得 """
+def fetch_stock_data(product_ids=None):
+    """ trn_ranked_item_stock_pretreatment からデータ取得（product_ids を渡すとその商品だけ。取得失敗時は例外を送出） """
+    if use_rollup_input():
+        return fetch_rollup_data(product_ids)
     try:
-        response = supabase.table("trn_ranked_item_stock_pretreatment").select("*").execute()
-
-        if "error" in response and response["error"]:
-            print(f"❌ HTTPエラー: {response['error']}")
-            return None
-
-        if response.data:
-            df = pd.DataFrame(response.data)
-
-            if 'update_time' not in df.columns:
-                raise ValueError("❌ 'update_time' カラムがデータフレームに存在しません")
-
-            df["update_time"] = pd.to_datetime(df["update_time"])
-            df["stockout_time"] = pd.to_datetime(df["stockout_time"])
-            df["restock_time"] = pd.to_datetime(df["restock_time"])
+        df = load_stock_frame(
+            get_supabase(), "trn_ranked_item_stock_pretreatment", PRETREATMENT_COLUMNS, product_ids=product_ids
+        )
 
+        if not df.empty:
             df.sort_values(["site", "seller_site", "product_id", "update_time"], inplace=True)
             df.set_index("update_time", inplace=True)
 
@@ -48,20 +40,26 @@ def fetch_stock_data():
             print("⚠ データが取得できませんでした。")
             return None
     except Exception as e:
+        # 呼び出し元（予測サイクル）が失敗として扱えるよう、握りつぶさずに送出する
         print(f"❌ データ取得エラー: {e}")
-        return None
+        raise
 
 
 def train_arima_and_forecast(df, site=None, seller_site=None, product_id=None):
     """ auto_arima を使って自動モデル選定・予測し、グラフ保存 """
+    # 起動を軽くするため、重いライブラリは学習時に読み込む
+    import matplotlib.pyplot as plt
+    from pmdarima import auto_arima
 
     if df.index.nunique() < 3:
         print(f"⚠ データ数が少なすぎるためスキップ: site={site}, seller_site={seller_site}, product_id={product_id}")
         return None
 
-    inferred_freq = pd.infer_freq(df.index)
-    df = df.asfreq(inferred_freq if inferred_freq else "D")
-    df.ffill(inplace=True)
+    if getattr(df.index, "freq", None) is None:
+        # 時刻が揃っていない系列は、商品ごとに推定した間隔で揃える
+        inferred_freq = pd.infer_freq(df.index)
+        df = df.asfreq(inferred_freq if inferred_freq else "D")
+        df.ffill(inplace=True)
 
     if not isinstance(df.index, pd.DatetimeIndex):
         raise ValueError("❌ 'update_time' が DatetimeIndex になっていません！")
@@ -70,14 +68,16 @@ def train_arima_and_forecast(df, site=None, seller_site=None, product_id=None):
 
     try:
         # 🔹 auto_arima による自動モデル選定
-        model = auto_arima(
-            df["stock_trend"],
-            seasonal=False,
-            stepwise=True,
-            suppress_warnings=True,
-            error_action='ignore',
-            trace=False
-        )
+        with timer("stock_model_fit_duration_seconds", "モデル学習の所要時間", model="auto_arima"):
+            model = auto_arima(
+                df["stock_trend"],
+                seasonal=False,
+                stepwise=True,
+                suppress_warnings=True,
+                error_action='ignore',
+                trace=False
+            )
+        counter("stock_model_fits_total", "モデル学習の回数").inc(model="auto_arima", result="ok")
 
         forecast_values = model.predict(n_periods=10)
         future_dates = [df.index[-1] + timedelta(days=i) for i in range(1, 11)]
@@ -110,56 +110,109 @@ def train_arima_and_forecast(df, site=None, seller_site=None, product_id=None):
         return forecast_df
 
     except Exception as e:
+        counter("stock_model_fits_total", "モデル学習の回数").inc(model="auto_arima", result="error")
         print(f"❌ auto_arima の学習エラー: {e}")
         return None
 
 
-def save_forecast_to_supabase(forecast_df):
-    """ 予測データを Supabase に保存 """
-    try:
-        records = []
-        for row in forecast_df.itertuples(index=False):
-            records.append({
-                "forecast_datetime": row.update_time.isoformat(),
-                "forecast": row.forecast,
-                "site": row.site,
-                "seller_site": row.seller_site,
-                "product_id": row.product_id
-            })
-
-        if records:
-            response = supabase.table("stock_forecast_arima") \
-                .upsert(records, on_conflict=["forecast_datetime", "site", "seller_site", "product_id"]) \
-                .execute()
-
-            if "error" in response and response["error"]:
-                print(f"❌ HTTPエラー: {response['error']}")
-            else:
-                print("✅ 予測データを Supabase に保存（または更新）しました！")
-        else:
-            print("⚠ 保存するデータがありません。")
-    except Exception as e:
-        print(f"❌ データ保存エラー: {e}")
+FORECAST_TABLE = "stock_forecast_arima"
+FORECAST_CONFLICT_COLUMNS = ["forecast_datetime", "site", "seller_site", "product_id"]
 
 
-def main():
-    df = fetch_stock_data()
-    if df is not None and not df.empty:
-        grouped = df.groupby(["site", "seller_site", "product_id"])
-        all_forecasts = []
+def open_forecast_writer():
+    """ 予測を一定件数ずつ stock_forecast_arima に upsert するライター """
+    return ForecastWriter(get_supabase, FORECAST_TABLE, FORECAST_CONFLICT_COLUMNS)
 
-        for (site, seller_site, product_id), group in grouped:
-            forecast_df = train_arima_and_forecast(group, site, seller_site, product_id)
-            if forecast_df is not None:
-                all_forecasts.append(forecast_df)
 
-        valid_forecasts = [df for df in all_forecasts if df is not None and not df.empty]
-        if valid_forecasts:
-            save_forecast_to_supabase(pd.concat(valid_forecasts))
+def save_forecast_to_supabase(forecast_df):
+    """ 予測データを Supabase に保存（チャンクごとに upsert し、保存件数を返す） """
+    if forecast_df is None or forecast_df.empty:
+        print("⚠ 保存するデータがありません。")
+        return 0
+    with open_forecast_writer() as writer:
+        writer.add(forecast_df)
+    print(f"✅ 予測データを Supabase に保存（または更新）しました: {writer.written}件")
+    return writer.written
+
+
+def forecast_group(kind, group, site, seller_site, product_id):
+    """ 分類に応じた方法で 1 商品を予測する（kind が None なら従来どおり auto_arima） """
+    if kind == series_triage.CONSTANT:
+        return series_triage.constant_forecast(group, site, seller_site, product_id)
+    if kind == series_triage.INTERMITTENT:
+        return series_triage.intermittent_forecast(group, site, seller_site, product_id)
+    if kind == series_triage.LONG_VOLATILE:
+        recent = series_triage.recent_window(group)
+        if recent.index.nunique() >= series_triage.MIN_ARIMA_POINTS:
+            group = recent
+    return train_arima_and_forecast(group, site, seller_site, product_id)
+
+
+def report_triage(counts, seconds, arima_kinds=(series_triage.REGULAR, series_triage.LONG_VOLATILE)):
+    """ 分類ごとの件数・所要時間と、安い方法に回したことで省けた時間の見積もりを出力する """
+    summary = ", ".join(f"{kind}={counts[kind]}" for kind in series_triage.KINDS)
+    print(f"🔀 系列の分類: {summary}")
+    for kind in series_triage.KINDS:
+        gauge("stock_triage_series", "分類ごとの系列数").set(counts[kind], kind=kind)
+
+    arima_count = sum(counts[k] for k in arima_kinds)
+    if not arima_count:
+        return
+    arima_average = sum(seconds[k] for k in arima_kinds) / arima_count
+    cheap_kinds = [k for k in series_triage.KINDS if k not in arima_kinds]
+    cheap_count = sum(counts[k] for k in cheap_kinds)
+    saved = max(cheap_count * arima_average - sum(seconds[k] for k in cheap_kinds), 0.0)
+    gauge("stock_triage_seconds_saved", "分類により省けた学習時間の見積もり（秒）").set(saved)
+    print(f"⏱ auto_arima 平均 {arima_average:.2f}秒/商品、{cheap_count}商品を省略して約 {saved:.1f}秒 短縮")
+
+
+def main(product_ids=None):
+    """
+    全商品（product_ids を渡すとその商品だけ）を学習・予測して保存し、保存件数を返す。
+    データの取得や予測の保存に失敗した場合は例外を送出する（保存は残りのチャンクを送ってから送出する）。
+    """
+    if product_ids is not None and not product_ids:
+        print("⚠ 対象の商品がないため、予測を実行しません。")
+        return 0
+    df = fetch_stock_data(product_ids)
+    if df is not None and not df.empty:
+        # 商品ごとに元の時刻のまま渡し、時刻の揃え方（infer_freq）は商品ごとに決める
+        grouped = df.groupby(["site", "seller_site", "product_id"], observed=True)
+        kinds = series_triage.classify_series(df)["kind"] if series_triage.is_enabled() else None
+        counts = dict.fromkeys(series_triage.KINDS, 0)
+        seconds = dict.fromkeys(series_triage.KINDS, 0.0)
+        forecast_count = 0
+
+        # 予測は溜め込まず、学習を続けながら一定件数ずつ保存する（with を抜けるときに残りを保存）
+        with open_forecast_writer() as writer:
+            started = time.perf_counter()
+            for (site, seller_site, product_id), group in grouped:
+                kind = kinds.get((site, seller_site, product_id)) if kinds is not None else None
+                group_started = time.perf_counter()
+                forecast_df = forecast_group(kind, group, site, seller_site, product_id)
+                if kind is not None:
+                    counts[kind] += 1
+                    seconds[kind] += time.perf_counter() - group_started
+                if forecast_df is not None and not forecast_df.empty:
+                    writer.add(forecast_df)
+                    forecast_count += 1
+            elapsed = time.perf_counter() - started
+        if elapsed > 0:
+            gauge("stock_model_fits_per_second", "1秒あたりのモデル学習数").set(grouped.ngroups / elapsed, model="auto_arima")
+        if kinds is not None:
+            report_triage(counts, seconds)
+
+        if forecast_count:
+            gauge("stock_forecast_rows_persisted", "直近の実行で保存した予測の行数").set(writer.written, table=FORECAST_TABLE)
+            print(f"✅ {forecast_count}商品の予測を保存しました: {writer.written}件（失敗 {writer.failed}件、再送 {writer.retried}回）")
         else:
             print("⚠ 有効な予測データが存在しないため、保存をスキップしました。")
+        if writer.failed:
+            raise RuntimeError(f"予測データの保存に失敗しました: {writer.failed}件")
+        return writer.written
     else:
         print("⚠ データがないため、予測を実行しません。")
+    return 0
 
 
 if __name__ == "__main__":
@@ -1,27 +1,24 @@
 import os
+import sys
 from dotenv import load_dotenv
 import numpy as np
 import pandas as pd
-from supabase import Client, create_client
-import tensorflow as tf
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import LSTM, Dense
 import uuid
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../common")))
+from supabase_client import get_supabase
+from lstm_numpy import LSTM_WEIGHTS_PATH, LstmWeightBank, LstmWeights, verify_against_keras
+
 # .env ファイルの読み込み
 load_dotenv()
 
 os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
 
-# Supabase の設定
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 def fetch_stock_data():
     """Supabase から在庫データを取得"""
     try:
-        response = supabase.table("trn_ranked_item_stock_pretreatment").select("update_time, site, seller_site, product_id, stock_status").execute()
+        response = get_supabase().table("trn_ranked_item_stock_pretreatment").select("update_time, site, seller_site, product_id, stock_status").execute()
         if "error" in response and response["error"]:
             print(f"❌ HTTPエラー: {response['error']}")
             return None
@@ -46,6 +43,10 @@ def prepare_data(df):
 
 def build_lstm_model():
     """LSTM モデルの構築"""
+    # TensorFlow は import だけで数秒かかるため、モデル構築時に読み込む
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import LSTM, Dense
+
     model = Sequential([
         LSTM(50, return_sequences=False, input_shape=(1, 1)),
         Dense(25, activation="relu"),
@@ -59,7 +60,7 @@ def save_forecast_to_supabase(df, predictions, site, seller_site, product_id):
     try:
         existing_times = {
             (row["forecast_datetime"], row["site"], row["seller_site"], row["product_id"])
-            for row in supabase.table("stock_forecast_lstm").select("forecast_datetime, site, seller_site, product_id").execute().data
+            for row in get_supabase().table("stock_forecast_lstm").select("forecast_datetime, site, seller_site, product_id").execute().data
         }
 
         records = []
@@ -93,7 +94,7 @@ def save_forecast_to_supabase(df, predictions, site, seller_site, product_id):
             })
 
         if records:
-            response = supabase.table("stock_forecast_lstm").insert(records).execute()
+            response = get_supabase().table("stock_forecast_lstm").insert(records).execute()
             if "error" in response and response["error"]:
                 print(f"❌ HTTPエラー: {response['error']}")
             else:
@@ -109,25 +110,51 @@ def save_forecast_to_supabase(df, predictions, site, seller_site, product_id):
         print(f"❌ データ保存エラー: {e}")
 
 
-def main():
+def main(predict_only=False, weights_path=LSTM_WEIGHTS_PATH):
+    """
+    商品ごとに LSTM を学習・予測し、学習した重みを weights_path に書き出す。
+    predict_only=True では学習せず、書き出した重みで NumPy だけを使って予測する（TensorFlow を読み込まない）。
+    """
     df = fetch_stock_data()
     if df is None or df.empty:
         print("⚠ データがないため、処理を中断します。")
         return
 
+    bank = LstmWeightBank.load(weights_path) if predict_only else LstmWeightBank()
+    verified = predict_only
+
+    # 商品ごとに実際の観測時刻のまま学習・予測する（予測時刻も観測時刻になる）
     grouped = df.groupby(["site", "seller_site", "product_id"])
     for (site, seller_site, product_id), group in grouped:
+        group = group.reset_index(drop=True)
         X, y = prepare_data(group)
-        
-        # LSTMモデルを構築 & 学習
-        model = build_lstm_model()
-        model.fit(X, y, batch_size=8, epochs=10, verbose=1)
-        
-        # 予測
-        predictions = model.predict(X)
-        
+
+        if predict_only:
+            if (site, seller_site, product_id) not in bank:
+                print(f"⚠ 学習済みの重みがないためスキップ: {site} - {seller_site} - {product_id}")
+                continue
+            predictions = bank.get((site, seller_site, product_id)).predict(X)
+        else:
+            # LSTMモデルを構築 & 学習
+            model = build_lstm_model()
+            model.fit(X, y, batch_size=8, epochs=10, verbose=1)
+
+            # 予測
+            predictions = model.predict(X)
+            bank.add((site, seller_site, product_id), LstmWeights.from_keras(model))
+            if not verified:
+                # 書き出す重みで Keras と同じ結果になるかを最初の 1 商品で確認する
+                ok, max_error = verify_against_keras(model, X)
+                print(f"{'✅' if ok else '⚠'} NumPy 推論と Keras の最大誤差: {max_error:.2e}")
+                verified = True
+
         # 予測結果を保存
         save_forecast_to_supabase(group, predictions, site, seller_site, product_id)
 
+    if not predict_only and len(bank):
+        bank.save(weights_path)
+        print(f"✅ {len(bank)}商品分の重みを書き出しました: {weights_path}")
+
 if __name__ == "__main__":
-    main()
+    # --predict-only: 書き出した重みで予測だけを行う（TensorFlow 不要）
+    main(predict_only="--predict-only" in sys.argv[1:])
@@ -1,13 +1,81 @@
+import os
+import sys
+from contextlib import contextmanager
+
 from common.logger import log_info, log_response
+# prediction 配下のモジュールは同じディレクトリのモジュール（series_triage など）を直接 import するため、
+# パッケージとして読み込む前に prediction をパスに追加する
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "prediction")))
 from prediction import train_arima
 from prediction.pretreatment import pretreatment  # インポート
 
-# while True:
-pretreatment()
-log_info(f" 📦 前処理完了")
+# 各モジュールと同じインスタンスを使うため、common をパスに追加してから読み込む
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "common")))
+from metrics import export_metrics, gauge, timer
+from supabase_client import get_supabase
+import profiling
+from prediction import dirty_set
+
+STAGE_METRIC = "stock_stage_duration_seconds"
+STAGE_HELP = "ステージごとの所要時間"
+
+
+@contextmanager
+def stage(name):
+    """ステージの所要時間を計測し、有効ならプロファイルも取る"""
+    with timer(STAGE_METRIC, STAGE_HELP, stage=name), profiling.profile_stage(name):
+        yield
+
+
+def run_prediction_cycle(full=False):
+    """
+    前処理と ARIMA 予測を 1 回実行する（常駐スケジューラからも呼ばれる）。
+    通常は前回から新しいスナップショットが登録された商品だけを対象にし、
+    full=True または前回の全件処理から一定時間が経ったときは全商品を対象にする。
+    前処理・予測のどちらかが失敗すると例外を送出し、ウォーターマークは進めない
+    （今回の対象商品は次回も dirty のまま残る）。
+    """
+    product_ids = None
+    watermark = None
+    if dirty_set.is_enabled():
+        client = get_supabase()
+        watermark = dirty_set.Watermark()
+        # この時点までの登録分を今回の対象にする（実行中に登録された分は次回に回る）
+        until_id = dirty_set.latest_id(client)
+        full = full or watermark.full_refresh_due()
+        if not full:
+            product_ids, pending_ids = dirty_set.find_dirty_products(
+                client, watermark.last_id, until_id, watermark.pending_ids
+            )
+            gauge("stock_prediction_dirty_products", "再学習の対象になった商品数").set(len(product_ids))
+            if not product_ids:
+                log_info(f" 📦 前回から変更のある商品がないため予測をスキップ")
+                watermark.save(until_id, pending_ids)
+                export_metrics("prediction")
+                return
+            log_info(f" 📦 変更のあった {len(product_ids)}商品を再学習")
+        else:
+            pending_ids = dirty_set.find_missing_ids(client, until_id)
+            log_info(f" 📦 全商品を再学習")
+
+    try:
+        with stage("pretreatment"):
+            pretreatment(product_ids)
+        log_info(f" 📦 前処理完了")
+
+        with stage("train_arima"):
+            train_arima.main(product_ids)
+        log_info(f" 📦 ARIMA完了")
 
-train_arima()
-log_info(f" 📦 ARIMA完了")
+        # 両方のステージが例外なく終わったときだけ進める
+        if watermark is not None:
+            watermark.save(until_id, pending_ids, full_refresh=full)
+    finally:
+        export_metrics("prediction")
 
 
-# time.sleep(3600)  # 1時間ごとに実行
+if __name__ == "__main__":
+    # PROFILE=1 / --profile でステージごとのプロファイルを出力
+    profiling.configure("prediction", sys.argv[1:])
+    # --full で変更の有無にかかわらず全商品を再学習
+    run_prediction_cycle(full="--full" in sys.argv[1:])
@@ -0,0 +1,306 @@
+"""
+スクリプト名: scheduler_daemon.py
+
+目的:
+取得処理（fetch_scheduler）と予測処理（prediction_scheduler）を常駐プロセスで定期実行する。
+pandas / pmdarima などの import、Supabase クライアント、プロセス内のキャッシュ・状態を
+実行のたびに作り直さず、ウォームな状態のまま使い回す。
+
+機能:
+- cron 形式（分 時 日 月 曜日）のスケジュールとランダムなジッター
+- 前回の実行が終わっていない場合は次の実行をスキップ（多重実行しない）
+- SIGTERM / SIGINT で実行中の処理の完了を待ってから終了
+- 状態ファイル（JSON）に各ジョブの最終実行・次回予定・エラーを書き出す（ヘルスチェック用）
+
+使い方:
+python src/scheduler_daemon.py                    # fetch / prediction の両方
+python src/scheduler_daemon.py --jobs fetch --run-now
+python src/scheduler_daemon.py --jobs fetch,prediction,archive   # 古いスナップショットのアーカイブも実行
+
+環境変数:
+FETCH_SCHEDULE（既定 "20 * * * *"）、PREDICTION_SCHEDULE（既定 "40 */6 * * *"）、
+ARCHIVE_SCHEDULE（既定 "30 3 * * *"）、
+SCHEDULER_JITTER_SECONDS（既定 60）、SCHEDULER_STATUS_PATH
+（prediction は前回から変更のあった商品だけを再学習し、PREDICTION_FULL_REFRESH_HOURS ごとに全商品を再学習する）
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import signal
+import sys
+import threading
+import traceback
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FETCH_SCHEDULE = os.getenv("FETCH_SCHEDULE", "20 * * * *")
+PREDICTION_SCHEDULE = os.getenv("PREDICTION_SCHEDULE", "40 */6 * * *")
+ARCHIVE_SCHEDULE = os.getenv("ARCHIVE_SCHEDULE", "30 3 * * *")
+SCHEDULER_JITTER_SECONDS = float(os.getenv("SCHEDULER_JITTER_SECONDS", "60"))
+SCHEDULER_STATUS_PATH = os.getenv("SCHEDULER_STATUS_PATH") or os.path.join(BASE_DIR, "state", "scheduler_status.json")
+
+# 終了時に実行中ジョブの完了を待つ最大秒数
+SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("SCHEDULER_SHUTDOWN_TIMEOUT", "600"))
+
+
+class CronSchedule:
+    """cron 形式（分 時 日 月 曜日、曜日は 0=日曜）の簡易パーサ"""
+
+    RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron 形式は 5 フィールドです: {expression!r}")
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse_field(field, low, high) for field, (low, high) in zip(fields, self.RANGES)
+        )
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(field, low, high):
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/", 1)
+                step = int(step_text)
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(v) for v in part.split("-", 1))
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"cron フィールドの範囲外: {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt):
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.isoweekday() % 7) in self.weekdays
+        # cron の仕様: 日と曜日の両方が指定されていればどちらかに一致すればよい
+        if not self.any_day and not self.any_weekday:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, dt):
+        """dt より後で最初に一致する時刻（秒以下は 0）"""
+        candidate = dt.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = candidate + datetime.timedelta(days=366 * 5)
+
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year = candidate.year + (candidate.month == 12)
+                month = candidate.month % 12 + 1
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(candidate):
+                candidate = (candidate + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = (candidate + datetime.timedelta(hours=1)).replace(minute=0)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += datetime.timedelta(minutes=1)
+                continue
+            return candidate
+
+        raise ValueError(f"一致する時刻がありません: {self.expression!r}")
+
+
+class Job:
+    def __init__(self, name, schedule, func, jitter_seconds=0.0):
+        self.name = name
+        self.schedule = CronSchedule(schedule)
+        self.func = func
+        self.jitter_seconds = jitter_seconds
+        self.next_run = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.status = {
+            "schedule": schedule,
+            "runs": 0,
+            "failures": 0,
+            "skipped_overlaps": 0,
+            "running": False,
+            "last_started": None,
+            "last_finished": None,
+            "last_status": None,
+            "last_error": None,
+            "next_run": None,
+        }
+
+    def plan_next(self, now):
+        jitter = datetime.timedelta(seconds=random.uniform(0, self.jitter_seconds)) if self.jitter_seconds else datetime.timedelta()
+        self.next_run = self.schedule.next_after(now) + jitter
+        self.status["next_run"] = self.next_run.isoformat()
+
+
+class SchedulerDaemon:
+    def __init__(self, jobs, status_path=SCHEDULER_STATUS_PATH, log=print):
+        self.jobs = jobs
+        self.status_path = status_path
+        self.log = log
+        self.stop_event = threading.Event()
+        self.started_at = datetime.datetime.now()
+        self._status_lock = threading.Lock()
+
+    def write_status(self):
+        """状態ファイルを一時ファイル経由で書き換える"""
+        with self._status_lock:
+            status = {
+                "pid": os.getpid(),
+                "started_at": self.started_at.isoformat(),
+                "updated_at": datetime.datetime.now().isoformat(),
+                "stopping": self.stop_event.is_set(),
+                "jobs": {job.name: dict(job.status) for job in self.jobs},
+            }
+            os.makedirs(os.path.dirname(self.status_path), exist_ok=True)
+            tmp_path = f"{self.status_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(status, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.status_path)
+
+    def _run_job(self, job):
+        job.status.update({
+            "running": True,
+            "last_started": datetime.datetime.now().isoformat(),
+        })
+        self.write_status()
+        try:
+            job.func()
+            job.status["last_status"] = "ok"
+            job.status["last_error"] = None
+        except BaseException as e:
+            # SystemExit を含め、ジョブの失敗でデーモンを止めない
+            job.status["last_status"] = "error"
+            job.status["last_error"] = f"{e!r}"
+            job.status["failures"] += 1
+            self.log(f" ❌ ジョブ失敗: {job.name}: {e!r}\n{traceback.format_exc()}")
+        finally:
+            job.status["runs"] += 1
+            job.status["running"] = False
+            job.status["last_finished"] = datetime.datetime.now().isoformat()
+            job.lock.release()
+            self.write_status()
+
+    def trigger(self, job):
+        """ジョブを別スレッドで開始する。前回が実行中ならスキップする"""
+        if not job.lock.acquire(blocking=False):
+            job.status["skipped_overlaps"] += 1
+            self.log(f" ⏭ 前回の実行が終わっていないためスキップ: {job.name}")
+            return False
+        job.thread = threading.Thread(target=self._run_job, args=(job,), name=f"job-{job.name}")
+        job.thread.start()
+        return True
+
+    def stop(self, signum=None, frame=None):
+        self.log(f" 🛑 停止シグナルを受信しました（signal={signum}）。実行中のジョブの完了を待ちます")
+        self.stop_event.set()
+
+    def run(self, run_now=False):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        now = datetime.datetime.now()
+        for job in self.jobs:
+            if run_now:
+                job.next_run = now
+                job.status["next_run"] = now.isoformat()
+            else:
+                job.plan_next(now)
+            self.log(f" ⏰ {job.name}: {job.status['schedule']} 次回 {job.status['next_run']}")
+        self.write_status()
+
+        while not self.stop_event.is_set():
+            now = datetime.datetime.now()
+            for job in self.jobs:
+                if job.next_run <= now:
+                    self.trigger(job)
+                    job.plan_next(now)
+                    self.write_status()
+
+            next_due = min(job.next_run for job in self.jobs)
+            # 状態ファイルの updated_at が止まらないよう、最長 60 秒ごとに起きる
+            wait_seconds = max(0.0, min((next_due - datetime.datetime.now()).total_seconds(), 60.0))
+            if self.stop_event.wait(wait_seconds):
+                break
+            self.write_status()
+
+        deadline = datetime.datetime.now() + datetime.timedelta(seconds=SHUTDOWN_TIMEOUT_SECONDS)
+        for job in self.jobs:
+            if job.thread is not None and job.thread.is_alive():
+                remaining = max(0.0, (deadline - datetime.datetime.now()).total_seconds())
+                job.thread.join(remaining)
+        self.write_status()
+        self.log(" 🛑 スケジューラを停止しました")
+
+
+def build_jobs(names):
+    """ジョブを組み立てる。各スケジューラはここで一度だけ import され、以後使い回される"""
+    sys.path.append(os.path.join(BASE_DIR, "common"))
+    import profiling
+
+    jobs = []
+    if "fetch" in names:
+        from fetch_scheduler import run_fetch_cycle
+
+        def fetch_job():
+            profiling.configure("fetch")
+            failed = run_fetch_cycle()
+            if failed:
+                # 状態ファイルに失敗として残す（続きは次回の実行で再開される）
+                raise RuntimeError(f"失敗したステージ: {', '.join(failed)}")
+
+        jobs.append(Job("fetch", FETCH_SCHEDULE, fetch_job, SCHEDULER_JITTER_SECONDS))
+
+    if "prediction" in names:
+        from prediction_scheduler import run_prediction_cycle
+
+        def prediction_job():
+            profiling.configure("prediction")
+            run_prediction_cycle()
+
+        jobs.append(Job("prediction", PREDICTION_SCHEDULE, prediction_job, SCHEDULER_JITTER_SECONDS))
+
+    if "archive" in names:
+        from stock_archive import archive_old_rows
+
+        def archive_job():
+            archive_old_rows()
+
+        jobs.append(Job("archive", ARCHIVE_SCHEDULE, archive_job, SCHEDULER_JITTER_SECONDS))
+
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="取得・予測処理の常駐スケジューラ")
+    parser.add_argument("--jobs", default="fetch,prediction", help="実行するジョブ（カンマ区切り）")
+    parser.add_argument("--run-now", action="store_true", help="起動直後に各ジョブを 1 回実行する")
+    parser.add_argument("--profile", action="store_true", help="ステージごとのプロファイルを出力する")
+    parser.add_argument("--profile-memory", action="store_true", help="tracemalloc のメモリプロファイルも出力する")
+    args = parser.parse_args()
+
+    from common.logger import log_info
+
+    sys.path.append(os.path.join(BASE_DIR, "common"))
+    import profiling
+    profiling.configure("daemon", [flag for flag, on in (("--profile", args.profile), ("--profile-memory", args.profile_memory)) if on])
+
+    jobs = build_jobs([name.strip() for name in args.jobs.split(",") if name.strip()])
+    if not jobs:
+        parser.error("実行するジョブがありません")
+
+    SchedulerDaemon(jobs, log=log_info).run(run_now=args.run_now)
+
+
+if __name__ == "__main__":
+    main()
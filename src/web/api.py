@@ -0,0 +1,398 @@
+"""
+スクリプト名: api.py
+
+目的:
+stock_forecast_arima / stock_forecast_lstm の予測と最新の在庫状況を返す読み取り専用の HTTP API。
+ダッシュボードや連携ツールが Supabase を直接引いたり Streamlit 画面を読んだりしなくて済むようにする。
+
+エンドポイント（batch 以外は GET、すべて JSON を返す）:
+  /health
+  /api/forecasts/<model>?product_id=A,B&site=...&seller_site=...   model は arima / lstm
+  /api/products/<product_id>                                        商品名・説明、両モデルの予測と最新の在庫状況
+  /api/sites/<site>/forecasts?model=arima                           サイト単位
+  /api/sellers/<seller_site>/forecasts?model=arima                  販売元単位
+  /api/stock/latest?product_id=A,B&site=...                         最新の在庫状況
+  POST /api/forecasts/batch  {"product_ids": [...], "models": ["arima", "lstm"]}
+
+キャッシュ:
+同じ問い合わせの結果はプロセス内の LRU キャッシュ（件数上限と有効期限つき）から返す。
+レスポンスには本文のハッシュを ETag として付け、If-None-Match が一致すれば 304 を返す。
+Accept-Encoding に gzip があれば圧縮して返す（圧縮結果もキャッシュする）。
+
+使い方:
+python src/web/api.py    # FORECAST_API_HOST / FORECAST_API_PORT（既定 127.0.0.1:8000）
+"""
+
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Flask, Response, abort, request
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../common")))
+from metrics import counter
+from supabase_client import get_supabase
+import content_store
+import stock_intervals
+
+FORECAST_API_HOST = os.getenv("FORECAST_API_HOST", "127.0.0.1")
+FORECAST_API_PORT = int(os.getenv("FORECAST_API_PORT", "8000"))
+FORECAST_API_CACHE_SIZE = int(os.getenv("FORECAST_API_CACHE_SIZE", "1024"))
+FORECAST_API_CACHE_TTL = float(os.getenv("FORECAST_API_CACHE_TTL", "300"))
+# 最新の在庫状況を trn_ranked_item_stock から求めるときに遡る時間
+LATEST_STOCK_LOOKBACK_HOURS = int(os.getenv("LATEST_STOCK_LOOKBACK_HOURS", "48"))
+
+FORECAST_TABLES = {
+    "arima": "stock_forecast_arima",
+    "lstm": "stock_forecast_lstm",
+}
+FORECAST_COLUMNS = ["site", "seller_site", "product_id", "forecast_datetime", "forecast"]
+FORECAST_ORDER = ["site", "seller_site", "product_id", "forecast_datetime"]
+STOCK_COLUMNS = ["site", "seller_site_id", "product_id", "stock_status", "price", "update_time"]
+
+PAGE_SIZE = 1000
+# in_ フィルタ 1 回で指定する件数（URL 長の制限に収まるように）
+ID_CHUNK_SIZE = 100
+# 1 回の問い合わせで指定できる商品数
+MAX_BATCH_PRODUCTS = 500
+# これより小さい本文は圧縮しない
+GZIP_MIN_BYTES = 512
+
+
+class TTLCache:
+    """件数上限つきの LRU キャッシュ。登録から ttl 秒を過ぎたエントリは使わない"""
+
+    def __init__(self, maxsize=FORECAST_API_CACHE_SIZE, ttl=FORECAST_API_CACHE_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CachedBody:
+    """JSON 本文・ETag・（必要になったときに作る）gzip 圧縮済み本文"""
+
+    def __init__(self, payload):
+        self.body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self._gzipped = None
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+
+def _split_values(values):
+    """?product_id=A,B&product_id=C のような指定を重複なしのリストにする"""
+    result = []
+    for value in values:
+        for item in value.split(","):
+            item = item.strip()
+            if item and item not in result:
+                result.append(item)
+    return result
+
+
+def _chunks(values, size=ID_CHUNK_SIZE):
+    return [values[i:i + size] for i in range(0, len(values), size)] if values else [None]
+
+
+def _paged(build_query, chunk_column=None, chunk_values=None):
+    """build_query() の結果をページングしながら全件取得する（chunk_values があれば in_ で分割）"""
+    rows = []
+    for chunk in _chunks(chunk_values):
+        offset = 0
+        while True:
+            query = build_query()
+            if chunk is not None:
+                query = query.in_(chunk_column, chunk)
+            response = query.range(offset, offset + PAGE_SIZE - 1).execute()
+            if not response.data:
+                break
+            rows.extend(response.data)
+            if len(response.data) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+    return rows
+
+
+def fetch_forecasts(client, model, product_ids=None, site=None, seller_site=None):
+    table = FORECAST_TABLES[model]
+
+    def build_query():
+        query = client.table(table).select(", ".join(FORECAST_COLUMNS))
+        if site:
+            query = query.eq("site", site)
+        if seller_site:
+            query = query.eq("seller_site", seller_site)
+        # range() でのページングが重複・欠落しないよう、一意になるカラムの組で並べる
+        for column in FORECAST_ORDER:
+            query = query.order(column)
+        return query
+
+    rows = _paged(build_query, "product_id", product_ids)
+    counter("stock_db_rows_fetched_total", "DBから取得した行数").inc(len(rows), table=table)
+    return rows
+
+
+def group_forecasts(rows):
+    """予測の行を商品ごとにまとめる"""
+    products = OrderedDict()
+    for row in rows:
+        key = (row["site"], row["seller_site"], row["product_id"])
+        entry = products.setdefault(key, {
+            "site": row["site"],
+            "seller_site": row["seller_site"],
+            "product_id": row["product_id"],
+            "forecasts": [],
+        })
+        entry["forecasts"].append({"forecast_datetime": row["forecast_datetime"], "forecast": row["forecast"]})
+    return list(products.values())
+
+
+def fetch_latest_stock(client, product_ids=None, site=None):
+    """商品ごとの最新の在庫状況（在庫区間が有効なら開いている区間、なければ直近のスナップショット）"""
+    if stock_intervals.is_enabled():
+        def build_query():
+            query = client.table(stock_intervals.INTERVAL_TABLE).select(
+                "site, seller_site_id, product_id, stock_status, end_time"
+            ).eq("is_open", True)
+            if site:
+                query = query.eq("site", site)
+            # range() でのページングが重複・欠落しないよう、主キーの順に並べる
+            for column in ("site", "seller_site_id", "product_id", "start_time"):
+                query = query.order(column)
+            return query
+
+        rows = _paged(build_query, "product_id", product_ids)
+        counter("stock_db_rows_fetched_total", "DBから取得した行数").inc(len(rows), table=stock_intervals.INTERVAL_TABLE)
+        return [
+            {
+                "site": r["site"], "seller_site_id": r["seller_site_id"], "product_id": r["product_id"],
+                "stock_status": r["stock_status"], "update_time": r["end_time"],
+            }
+            for r in rows
+        ]
+
+    since = datetime.datetime.now() - datetime.timedelta(hours=LATEST_STOCK_LOOKBACK_HOURS)
+
+    def build_query():
+        query = (
+            client.table("trn_ranked_item_stock")
+            .select(", ".join(STOCK_COLUMNS))
+            .gte("update_time", since.isoformat())
+        )
+        if site:
+            query = query.eq("site", site)
+        # 同じ update_time の行がページをまたいでも重複・欠落しないよう、id を同順位の決め手にする
+        return query.order("update_time", desc=True).order("id", desc=True)
+
+    rows = _paged(build_query, "product_id", product_ids)
+    counter("stock_db_rows_fetched_total", "DBから取得した行数").inc(len(rows), table="trn_ranked_item_stock")
+    latest = OrderedDict()
+    for row in rows:
+        # 新しい順に並んでいるので、商品ごとに最初の行が最新
+        latest.setdefault((row["site"], row.get("seller_site_id") or "", row["product_id"]), row)
+    return list(latest.values())
+
+
+def fetch_product_text(client, product_id, store):
+    """
+    商品の直近のスナップショットの商品名・説明。
+    content_store が有効な行は文字列を持たないため、content_hash から mst_item_content を引き直す。
+    """
+    columns = list(content_store.TEXT_COLUMNS)
+    if content_store.is_enabled():
+        columns.append("content_hash")
+    response = (
+        client.table("trn_ranked_item_stock")
+        .select(", ".join(columns))
+        .eq("product_id", product_id)
+        .order("update_time", desc=True)
+        .limit(1)
+        .execute()
+    )
+    if not response.data:
+        return {col: None for col in content_store.TEXT_COLUMNS}
+    row = dict(response.data[0])
+    if row.get("content_hash"):
+        store.attach_text([row])
+    return {col: row.get(col) for col in content_store.TEXT_COLUMNS}
+
+
+def create_app(client_getter=get_supabase, cache=None):
+    app = Flask(__name__)
+    app.json.ensure_ascii = False
+    cache = cache if cache is not None else TTLCache()
+    app.config["FORECAST_CACHE"] = cache
+    # 商品名・説明の引き直し用（取得した文字列はストア内の LRU キャッシュに残る）
+    text_store = content_store.ContentStore(client_getter)
+
+    def respond(cache_key, build_payload, endpoint):
+        cached = cache.get(cache_key)
+        hit = cached is not None
+        if not hit:
+            cached = CachedBody(build_payload(client_getter()))
+            cache.set(cache_key, cached)
+
+        if request.if_none_match.contains(cached.etag):
+            counter("stock_forecast_api_requests_total", "予測 API のリクエスト数").inc(endpoint=endpoint, cache="hit" if hit else "miss", status=304)
+            response = Response(status=304)
+            response.set_etag(cached.etag)
+            return response
+
+        counter("stock_forecast_api_requests_total", "予測 API のリクエスト数").inc(endpoint=endpoint, cache="hit" if hit else "miss", status=200)
+        use_gzip = "gzip" in request.accept_encodings and len(cached.body) >= GZIP_MIN_BYTES
+        response = Response(cached.gzipped() if use_gzip else cached.body, mimetype="application/json")
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(cached.etag)
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = f"max-age={int(cache.ttl)}"
+        return response
+
+    def product_ids_arg():
+        product_ids = _split_values(request.args.getlist("product_id"))
+        if len(product_ids) > MAX_BATCH_PRODUCTS:
+            abort(400, f"product_id は {MAX_BATCH_PRODUCTS} 件まで指定できます")
+        return product_ids
+
+    def model_or_404(model):
+        if model not in FORECAST_TABLES:
+            abort(404, f"未対応のモデル: {model}")
+        return model
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok", "cache_entries": len(cache)}
+
+    @app.get("/api/forecasts/<model>")
+    def forecasts(model):
+        model = model_or_404(model)
+        product_ids = product_ids_arg()
+        site = request.args.get("site")
+        seller_site = request.args.get("seller_site")
+        key = ("forecasts", model, tuple(sorted(product_ids)), site, seller_site)
+        return respond(
+            key,
+            lambda client: {
+                "model": model,
+                "products": group_forecasts(fetch_forecasts(client, model, product_ids, site, seller_site)),
+            },
+            "forecasts",
+        )
+
+    @app.get("/api/sites/<site>/forecasts")
+    def site_forecasts(site):
+        model = model_or_404(request.args.get("model", "arima"))
+        return respond(
+            ("site", model, site),
+            lambda client: {"model": model, "site": site, "products": group_forecasts(fetch_forecasts(client, model, site=site))},
+            "site",
+        )
+
+    @app.get("/api/sellers/<seller_site>/forecasts")
+    def seller_forecasts(seller_site):
+        model = model_or_404(request.args.get("model", "arima"))
+        return respond(
+            ("seller", model, seller_site),
+            lambda client: {
+                "model": model,
+                "seller_site": seller_site,
+                "products": group_forecasts(fetch_forecasts(client, model, seller_site=seller_site)),
+            },
+            "seller",
+        )
+
+    @app.get("/api/products/<product_id>")
+    def product(product_id):
+        return respond(
+            ("product", product_id),
+            lambda client: {
+                "product_id": product_id,
+                **fetch_product_text(client, product_id, text_store),
+                "forecasts": {
+                    model: group_forecasts(fetch_forecasts(client, model, [product_id]))
+                    for model in FORECAST_TABLES
+                },
+                "stock": fetch_latest_stock(client, [product_id]),
+            },
+            "product",
+        )
+
+    @app.get("/api/stock/latest")
+    def latest_stock():
+        product_ids = product_ids_arg()
+        site = request.args.get("site")
+        if not product_ids and not site:
+            abort(400, "product_id か site を指定してください")
+        return respond(
+            ("stock", tuple(sorted(product_ids)), site),
+            lambda client: {"stock": fetch_latest_stock(client, product_ids, site)},
+            "stock",
+        )
+
+    @app.post("/api/forecasts/batch")
+    def batch_forecasts():
+        body = request.get_json(silent=True) or {}
+        if not isinstance(body, dict):
+            abort(400, "JSON オブジェクトで指定してください")
+        raw_product_ids = body.get("product_ids", [])
+        raw_models = body.get("models", list(FORECAST_TABLES))
+        # 文字列を渡されると 1 文字ずつの ID になってしまうため、リストだけを受け付ける
+        if not isinstance(raw_product_ids, list):
+            abort(400, "product_ids はリストで指定してください")
+        if not isinstance(raw_models, list):
+            abort(400, "models はリストで指定してください")
+        product_ids = _split_values(str(p) for p in raw_product_ids)
+        models = [model_or_404(str(m)) for m in raw_models]
+        if not product_ids or len(product_ids) > MAX_BATCH_PRODUCTS:
+            abort(400, f"product_ids は 1〜{MAX_BATCH_PRODUCTS} 件で指定してください")
+        return respond(
+            ("batch", tuple(sorted(product_ids)), tuple(sorted(models))),
+            lambda client: {
+                model: group_forecasts(fetch_forecasts(client, model, product_ids))
+                for model in models
+            },
+            "batch",
+        )
+
+    return app
+
+
+if __name__ == "__main__":
+    create_app().run(host=FORECAST_API_HOST, port=FORECAST_API_PORT, threaded=True)
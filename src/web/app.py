@@ -1,43 +1,32 @@
 import os
+import sys
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
 import plotly.graph_objects as go
-from statsmodels.tsa.arima.model import ARIMA
 from datetime import timedelta
 import streamlit as st
-from pmdarima import auto_arima  # auto_arimaを使用
 
 # Supabaseの設定
 from dotenv import load_dotenv
-from supabase import create_client, Client
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../common")))
+from stock_loader import PRETREATMENT_COLUMNS, load_stock_frame
+from supabase_client import get_supabase
+from stock_rollup import fetch_rollup_data, use_rollup_input
+from stock_panel import build_panel
+import jan_index
+from lstm_numpy import LSTM_WEIGHTS_PATH, LstmWeightBank
 
 # .env ファイルの読み込み
 load_dotenv()
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 def fetch_stock_data():
     """ trn_ranked_item_stock_pretreatment からデータ取得 """
     try:
-        response = supabase.table("trn_ranked_item_stock_pretreatment").select("*").execute()
-        
-        if "error" in response and response["error"]:
-            print(f"❌ HTTPエラー: {response['error']}")
-            return None
-        
-        if response.data:
-            df = pd.DataFrame(response.data)
-            # update_time のカラム名確認
-            if 'update_time' not in df.columns:
-                raise ValueError("❌ 'update_time' カラムがデータフレームに存在しません")
-            
-            df["update_time"] = pd.to_datetime(df["update_time"])
-            df["stockout_time"] = pd.to_datetime(df["stockout_time"])
-            df["restock_time"] = pd.to_datetime(df["restock_time"])
-            
+        if use_rollup_input():
+            return fetch_rollup_data()
+        df = load_stock_frame(get_supabase(), "trn_ranked_item_stock_pretreatment", PRETREATMENT_COLUMNS)
+
+        if not df.empty:
             df.sort_values(["site", "seller_site", "product_id", "update_time"], inplace=True)
             df.set_index("update_time", inplace=True)
             df["stockout_duration"] = (df["restock_time"] - df["stockout_time"]).dt.days.fillna(0)
@@ -54,11 +43,13 @@ def fetch_stock_data():
 
 def train_arima_and_forecast(df, site=None, seller_site=None, product_id=None):
     """ auto_arima モデルを学習し、予測 """
+    from pmdarima import auto_arima  # auto_arimaを使用（画面表示を速くするため学習時に読み込む）
     if df.index.nunique() < 3:
         print(f"⚠ データ数が少なすぎるためスキップ: site={site}, seller_site={seller_site}, product_id={product_id}")
         return None
 
-    df = df.asfreq("D", method='ffill')
+    if getattr(df.index, "freq", None) is None:
+        df = df.asfreq("D", method='ffill')
 
     try:
         # auto_arima モデルで自動的に最適なパラメータを選定
@@ -92,16 +83,64 @@ def plot_forecast(forecast_df):
     )
     st.plotly_chart(fig)
 
+def show_jan_listings():
+    """ JAN コードから各サイトの出品と最新の在庫状況を表示 """
+    st.subheader("JANコードでサイト横断検索")
+    jan_code = st.text_input("JANコード")
+    if not jan_code:
+        return
+
+    index = jan_index.load_jan_index(get_supabase(), [jan_code])
+    listings = index.lookup(jan_code)
+    if not listings:
+        st.info("この JAN コードの出品は見つかりませんでした。")
+        return
+
+    in_stock = index.in_stock(jan_code)
+    st.write(f"出品 {len(listings)}件（在庫あり {len(in_stock)}件）")
+    st.dataframe(pd.DataFrame(listings)[
+        ["site", "seller_site_name", "product_id", "stock_status", "price", "update_time"]
+    ])
+
+
+def show_lstm_scores(panel):
+    """ 書き出し済みの LSTM の重みで、全商品の翌日の予測を NumPy だけで計算して表示 """
+    if not os.path.exists(LSTM_WEIGHTS_PATH):
+        return
+    bank = LstmWeightBank.load(LSTM_WEIGHTS_PATH)
+    rows = [(i, key) for i, key in panel.items() if key in bank]
+    if not rows:
+        return
+
+    last_values = [panel.values[i, panel.last[i]] for i, _ in rows]
+    scores = bank.predict_next(last_values, keys=[key for _, key in rows])
+    st.subheader("LSTM による翌日の在庫予測")
+    st.dataframe(pd.DataFrame({
+        "site": [key[0] for _, key in rows],
+        "seller_site": [key[1] for _, key in rows],
+        "product_id": [key[2] for _, key in rows],
+        "last_stock_status": last_values,
+        "forecast": scores,
+    }))
+
+
 def main():
     st.title("在庫予測アプリ")
+
+    if jan_index.is_enabled():
+        show_jan_listings()
+
     st.write("在庫の予測結果を表示します。")
 
     df = fetch_stock_data()
     if df is not None and not df.empty:
-        grouped = df.groupby(["site", "seller_site", "product_id"])
+        # 全商品の日次系列を一度に作り、各商品はその 1 行を読む
+        panel = build_panel(df, freq="D")
+        show_lstm_scores(panel)
         all_forecasts = []
 
-        for (site, seller_site, product_id), group in grouped:
+        for i, (site, seller_site, product_id) in panel.items():
+            group = panel.frame(i)
             forecast_df = train_arima_and_forecast(group, site, seller_site, product_id)
             if forecast_df is not None:
                 all_forecasts.append(forecast_df)
@@ -0,0 +1,82 @@
+"""
+lstm_numpy の NumPy 推論が Keras（train_lstm.build_lstm_model）と一致することの確認。
+Keras との比較は TensorFlow がある環境でだけ実行し、ない環境ではスキップする。
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/common")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/prediction")))
+from lstm_numpy import VERIFY_TOLERANCE, LstmWeightBank, LstmWeights
+
+UNITS = 50
+HIDDEN = 25
+
+
+def random_weights(rng):
+    """build_lstm_model と同じ形の重み（get_weights() の順）"""
+    return LstmWeights(
+        rng.normal(scale=0.5, size=(1, 4 * UNITS)),
+        rng.normal(scale=0.5, size=(UNITS, 4 * UNITS)),
+        rng.normal(scale=0.1, size=(4 * UNITS,)),
+        rng.normal(scale=0.5, size=(UNITS, HIDDEN)),
+        rng.normal(scale=0.1, size=(HIDDEN,)),
+        rng.normal(scale=0.5, size=(HIDDEN, 1)),
+        rng.normal(scale=0.1, size=(1,)),
+    )
+
+
+def test_predict_next_matches_predict():
+    rng = np.random.default_rng(0)
+    bank = LstmWeightBank()
+    weights = {}
+    for i in range(8):
+        key = ("楽天", f"shop{i % 3}", f"item{i}")
+        weights[key] = random_weights(rng)
+        bank.add(key, weights[key])
+    last_values = rng.random(len(weights)).astype(np.float32)
+
+    expected = np.array([
+        weights[key].predict(np.array([[[value]]]))[0, 0]
+        for key, value in zip(weights, last_values)
+    ])
+    np.testing.assert_allclose(bank.predict_next(last_values, keys=list(weights)), expected, atol=1e-5)
+
+
+def test_bank_save_and_load(tmp_path):
+    rng = np.random.default_rng(1)
+    bank = LstmWeightBank()
+    for i in range(3):
+        bank.add(("Yahoo! Shopping", "store", f"item{i}"), random_weights(rng))
+    path = str(tmp_path / "lstm_weights.npz")
+    bank.save(path)
+
+    loaded = LstmWeightBank.load(path)
+    last_values = np.array([0.0, 1.0, 0.5], dtype=np.float32)
+    assert loaded.keys == bank.keys
+    np.testing.assert_allclose(loaded.predict_next(last_values), bank.predict_next(last_values))
+
+
+def test_matches_keras():
+    pytest.importorskip("tensorflow")
+    from train_lstm import build_lstm_model
+
+    rng = np.random.default_rng(0)
+    X = rng.random((64, 1, 1)).astype(np.float32)
+    model = build_lstm_model()
+    model.fit(X, rng.random((64, 1)), epochs=2, verbose=0)
+    expected = model.predict(X, verbose=0)
+
+    weights = LstmWeights.from_keras(model)
+    assert np.max(np.abs(weights.predict(X) - expected)) <= VERIFY_TOLERANCE
+
+    # 同じモデルを入力ごとに別の商品として並べ、1 回の predict_next で全件を計算する
+    bank = LstmWeightBank()
+    keys = [("楽天", "shop", f"item{i}") for i in range(len(X))]
+    for key in keys:
+        bank.add(key, weights)
+    assert np.max(np.abs(bank.predict_next(X[:, 0, 0], keys=keys) - expected[:, 0])) <= VERIFY_TOLERANCE
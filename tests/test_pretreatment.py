@@ -0,0 +1,55 @@
+"""
+pretreatment の登録データが JSON として正しいこと（欠損が NaN ではなく null で送られること）の確認。
+Supabase の代わりに benchmarks/fake_supabase のインメモリクライアントを使う。
+"""
+
+import json
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/common")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/prediction")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/benchmarks")))
+from fake_supabase import FakeSupabaseClient
+import pretreatment
+import stock_archive
+
+
+def snapshot(row_id, product_id, stock_status, update_time, jan_code):
+    return {
+        "id": row_id,
+        "product_id": product_id,
+        "product_name": "商品",
+        "description": None,
+        "site": "楽天",
+        "seller_site_id": "shop",
+        "seller_site_name": None,
+        "stock_status": stock_status,
+        "price": 1000,
+        "jan_code": jan_code,
+        "insert_time": update_time,
+        "update_time": update_time,
+    }
+
+
+def test_null_jan_code_is_sent_as_null(monkeypatch, tmp_path):
+    client = FakeSupabaseClient()
+    client.seed("trn_ranked_item_stock", [
+        snapshot(1, "item1", True, "2026-01-01T00:00:00", None),
+        snapshot(2, "item1", False, "2026-01-02T00:00:00", None),
+        snapshot(3, "item2", True, "2026-01-01T00:00:00", "4901234567890"),
+    ])
+    monkeypatch.setattr(pretreatment, "get_supabase", lambda: client)
+    monkeypatch.setattr(stock_archive, "ARCHIVE_DIR", str(tmp_path))
+
+    pretreatment.pretreatment()
+
+    rows = client.tables["trn_ranked_item_stock_pretreatment"]
+    assert len(rows) == 3
+    # allow_nan=False は NaN を含むと ValueError になる（PostgREST が拒否する本文）
+    json.dumps(rows, allow_nan=False, default=str)
+    by_id = {(row["product_id"], row["update_time"]): row for row in rows}
+    assert by_id[("item1", "2026-01-01T00:00:00")]["jan_code"] is None
+    assert by_id[("item1", "2026-01-01T00:00:00")]["seller_site_name"] is None
+    assert by_id[("item2", "2026-01-01T00:00:00")]["jan_code"] == "4901234567890"
+    assert by_id[("item1", "2026-01-02T00:00:00")]["stockout_time"] == "2026-01-02T00:00:00"